@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Conciliación por lotes sin servidor
+Recorre un árbol de directorios de periodo (EXTRACTO* en la raíz y una subcarpeta
+por marca), concilia cada periodo en un pool de procesos con los mismos lectores y
+motor que la API, guarda el resultado en el formato elegido y muestra el rendimiento
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, List
+
+import pandas as pd
+
+import conciliador
+
+SHEETS = ['extracto', 'amex', 'diners', 'mc', 'visa', 'payu']
+FORMATS = ('xlsx', 'csv', 'parquet')
+
+
+def find_periods(root: str) -> List[str]:
+    """Directorios de periodo bajo `root`: los que tienen un archivo EXTRACTO* (sin entrar a las carpetas de marca)"""
+    periods = []
+    for directory, subdirs, files in os.walk(root):
+        if any(name.upper().startswith('EXTRACTO') and name.endswith(conciliador.INPUT_EXTENSIONS) for name in files):
+            periods.append(directory)
+            subdirs[:] = [name for name in subdirs if name.lower() not in SHEETS]
+        subdirs.sort()
+    return sorted(periods)
+
+
+def period_name(root: str, directory: str) -> str:
+    """Nombre del periodo para los archivos de salida (ruta relativa con '_')"""
+    relative = os.path.relpath(directory, root)
+    if relative == '.':
+        relative = os.path.basename(os.path.abspath(root))
+    return relative.replace(os.sep, '_')
+
+
+def text_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Convierte a texto las columnas object (mezclan números y textos, como en el Excel)"""
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].map(lambda value: '' if pd.isna(value) else str(value))
+    return df
+
+
+def write_period_output(result: Dict[str, Any], output_dir: str, name: str, output_format: str) -> str:
+    """Guarda el resultado de un periodo: un Excel o un archivo CSV/Parquet por hoja"""
+    if output_format == 'xlsx':
+        output_path = os.path.join(output_dir, f"CONCILIACION_{name}.xlsx")
+        conciliador.write_results_excel(result, output_path)
+        return output_path
+
+    output_path = os.path.join(output_dir, f"CONCILIACION_{name}")
+    os.makedirs(output_path, exist_ok=True)
+    for sheet in SHEETS:
+        df = result.get(sheet)
+        if df is None or df.empty:
+            continue
+        if output_format == 'csv':
+            df.to_csv(os.path.join(output_path, f"{sheet.upper()}.csv"), index=False, encoding='utf-8-sig')
+        else:
+            text_columns(df).to_parquet(os.path.join(output_path, f"{sheet.upper()}.parquet"), index=False)
+    return output_path
+
+
+def reconcile_period(directory: str, name: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Carga, concilia y exporta un periodo (se ejecuta en un proceso del pool)"""
+    summary = {'period': name, 'directory': directory}
+    seconds = {}
+    try:
+        with contextlib.ExitStack() as stack:
+            if not options['verbose']:
+                devnull = stack.enter_context(open(os.devnull, 'w'))
+                stack.enter_context(contextlib.redirect_stdout(devnull))
+
+            start = time.perf_counter()
+            extracto_df, brand_frames = conciliador.load_inputs_from_directory(directory, options['csv_options'])
+            seconds['load'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            engine = (conciliador.perform_reconciliation_partitioned if options['out_of_core']
+                      else conciliador.perform_reconciliation_multi_step)
+            result = engine(
+                extracto_df, *(brand_frames[brand] for brand in SHEETS[1:]), date_window=options['date_window'],
+                acquirer_partitions=options['acquirer_partitions']
+            )
+            seconds['reconcile'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            output_path = write_period_output(result, options['output_dir'], name, options['format'])
+            seconds['export'] = time.perf_counter() - start
+
+            if options['history']:
+                fingerprint = conciliador.compute_input_fingerprint(extracto_df, brand_frames, options['currency'], {
+                    'date_window': options['date_window'],
+                    'acquirer_partitions': options['acquirer_partitions'],
+                    'out_of_core': options['out_of_core']
+                })
+                conciliador.history_record(uuid.uuid4().hex[:12], options['currency'], fingerprint,
+                                           os.path.basename(output_path), result)
+    except Exception as e:
+        return {**summary, 'error': f"{type(e).__name__}: {e}", 'seconds': seconds}
+
+    extracto = result['extracto']
+    conciliados = int((~extracto['ESTADO'].astype(str).str.startswith('Pendiente')).sum())
+    return {
+        **summary,
+        'output': output_path,
+        'rows': {sheet: len(result[sheet]) for sheet in SHEETS if result.get(sheet) is not None},
+        'stats': {'extracto_total': len(extracto), 'conciliados': conciliados, 'pendientes': len(extracto) - conciliados},
+        'phases': result['stats'],
+        'seconds': seconds
+    }
+
+
+def print_summary(runs: List[Dict[str, Any]], wall_seconds: float, workers: int):
+    """Resumen de rendimiento del lote"""
+    ok = [run for run in runs if 'error' not in run]
+    rows = sum(sum(run['rows'].values()) for run in ok)
+    extracto_rows = sum(run['stats']['extracto_total'] for run in ok)
+    conciliados = sum(run['stats']['conciliados'] for run in ok)
+    stage_seconds = {stage: sum(run['seconds'].get(stage, 0) for run in ok) for stage in ('load', 'reconcile', 'export')}
+    busy_seconds = sum(stage_seconds.values())
+
+    print(f"\n📊 {len(ok)}/{len(runs)} periodos en {wall_seconds:.2f}s con {workers} procesos")
+    print(f"  filas: {rows} ({extracto_rows} del extracto, {conciliados} conciliadas)")
+    if wall_seconds:
+        print(f"  rendimiento: {rows / wall_seconds:,.0f} filas/s, {len(ok) * 60 / wall_seconds:.1f} periodos/min")
+        print(f"  ocupación del pool: {busy_seconds / (wall_seconds * workers):.0%}")
+    for stage, stage_total in stage_seconds.items():
+        print(f"  {stage:<10} {stage_total:>10.2f}s acumulados")
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Concilia por lotes un árbol de directorios de periodo')
+    parser.add_argument('root', help='Directorio raíz (un periodo o carpetas con un periodo cada una)')
+    parser.add_argument('--output-dir', default='outputs/batch', help='Directorio de resultados')
+    parser.add_argument('--format', choices=FORMATS, default='xlsx',
+                        help='xlsx (un libro por periodo) o csv/parquet (un archivo por hoja)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Procesos en paralelo')
+    parser.add_argument('--delimiter', default=',', help='Separador de los CSV de entrada (`tab` para tabulador)')
+    parser.add_argument('--decimal', default='.', help='Separador decimal de los CSV de entrada')
+    parser.add_argument('--thousands', default='', help='Separador de miles de los CSV de entrada (por defecto ninguno)')
+    parser.add_argument('--date-window', type=int, default=0, help='Ventana de fechas en días hábiles (0 = fecha exacta)')
+    parser.add_argument('--acquirer-partitions', action='store_true',
+                        help='Recorrer primero las filas del extracto del adquirente de cada fase')
+    parser.add_argument('--out-of-core', action='store_true',
+                        help='Conciliar cada periodo por meses con memoria acotada (backfills largos)')
+    parser.add_argument('--currency', default='', help='Moneda con que se registran las corridas en el histórico')
+    parser.add_argument('--history', action='store_true', help='Guardar cada periodo en el histórico (HISTORY_PATH)')
+    parser.add_argument('--summary-json', help='Guardar el detalle por periodo y el resumen en un JSON')
+    parser.add_argument('--verbose', action='store_true', help='Mostrar los mensajes del motor')
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+    if not 0 <= args.date_window <= conciliador.DATE_WINDOW_MAX_DAYS:
+        print(f"❌ --date-window debe estar entre 0 y {conciliador.DATE_WINDOW_MAX_DAYS}")
+        return 2
+
+    periods = find_periods(args.root)
+    if not periods:
+        print(f"❌ No hay directorios con EXTRACTO* en {args.root}")
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    options = {
+        'csv_options': conciliador.resolve_csv_options(args.delimiter, args.decimal, args.thousands),
+        'output_dir': args.output_dir,
+        'format': args.format,
+        'date_window': args.date_window,
+        'acquirer_partitions': args.acquirer_partitions,
+        'out_of_core': args.out_of_core,
+        'currency': args.currency.strip().upper(),
+        'history': args.history,
+        'verbose': args.verbose
+    }
+    workers = max(1, min(args.workers, len(periods)))
+    print(f"🚀 {len(periods)} periodos con {workers} procesos → {args.output_dir} ({args.format})")
+
+    runs = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(reconcile_period, directory, period_name(args.root, directory), options)
+                   for directory in periods]
+        for future in as_completed(futures):
+            run = future.result()
+            runs.append(run)
+            if 'error' in run:
+                print(f"❌ {run['period']}: {run['error']}")
+            else:
+                stats = run['stats']
+                print(f"✅ {run['period']}: {stats['conciliados']}/{stats['extracto_total']} conciliados "
+                      f"en {sum(run['seconds'].values()):.2f}s")
+    wall_seconds = time.perf_counter() - start
+
+    runs.sort(key=lambda run: run['period'])
+    print_summary(runs, wall_seconds, workers)
+
+    if args.summary_json:
+        with open(args.summary_json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'timestamp': datetime.now().strftime('%Y%m%d_%H%M%S'),
+                'workers': workers,
+                'wall_seconds': wall_seconds,
+                'runs': runs
+            }, f, indent=2, default=str)
+        print(f"📁 Detalle guardado en {args.summary_json}")
+
+    return 1 if any('error' in run for run in runs) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
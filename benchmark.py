@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+Benchmark del Sistema de Conciliación
+Genera datos sintéticos (extracto + AMEX, DINERS, MC, VISA, PAYU) y mide
+la carga de archivos, cada fase de conciliación y la exportación a Excel
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import socket
+import tracemalloc
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import conciliador
+
+# Descripciones del extracto por familia de adquirente (deben pasar el filtro del extracto)
+EXTRACTO_DESCRIPCIONES = {
+    'amex': 'CIA DE SERV AMERICAN EXPRESS',
+    'diners': 'DINERS CLUB PERU S.A.',
+    'mc': 'ABONO DE PROCESOS DE MEDIOS DE PAGO',
+    'visa': 'COMPANIA PERUANA DE MEDIOS DE PAGO',
+    'payu': 'DE PAYU PERU S.A.C'
+}
+DESCRIPCION_RUIDO = 'TRANSFERENCIA INTERBANCARIA'
+
+PAYU_COLUMNS = ['FECHA', 'DOCUMENTO', 'DESCRIPCION', 'CREDITOS', 'DEBITOS', 'NUEVO SALDO',
+                'SALDO CONGELADO ANTERIOR', 'SALDO RESERVA', 'SALDO DISPONIBLE']
+
+BRANDS = ['amex', 'diners', 'mc', 'visa', 'payu']
+
+
+def generate_dataset(rows: int, seed: int = 42, months: int = 1) -> Dict[str, Any]:
+    """Genera un extracto de `rows` filas y los archivos de cada marca que lo concilian (fechas en `months` meses de 28 días)"""
+    rng = np.random.default_rng(seed)
+    base_date = datetime(2025, 1, 1)
+    per_brand = max(1, rows // len(BRANDS))
+
+    extracto_rows = []
+    brand_rows = {brand: [] for brand in BRANDS}
+    op_counter = [100000]
+
+    def next_op() -> str:
+        op_counter[0] += 1
+        return str(op_counter[0])
+
+    def random_amount(low: float = 50, high: float = 5000) -> float:
+        return round(float(rng.uniform(low, high)), 2)
+
+    def random_date() -> datetime:
+        return base_date + timedelta(days=int(rng.integers(0, 28 * months)))
+
+    def extracto_row(fecha: datetime, brand: str, monto: float, referencia2: str = '') -> Dict[str, Any]:
+        return {
+            'FECHA': fecha.strftime('%d/%m/%Y'),
+            'DESCRIPCIÓN OPERACIÓN': EXTRACTO_DESCRIPCIONES[brand],
+            'MONTO': monto,
+            'OPERACIÓN - NÚMERO': next_op(),
+            'REFERENCIA2': referencia2
+        }
+
+    # Códigos de comercio (7 dígitos) para MC y VISA
+    mc_codcoms = [str(1000000 + i) for i in range(5)]
+    visa_codcoms = [str(2000000 + i) for i in range(5)]
+
+    # AMEX: fecha + monto (y una parte con fecha distinta para la fase 3)
+    for i in range(per_brand):
+        fecha = random_date()
+        monto = random_amount()
+        fecha_amex = fecha if i % 10 else fecha + timedelta(days=2)
+        brand_rows['amex'].append({
+            'CODIGO': f"AX{i:07d}",
+            'NETO_TOTAL': monto,
+            'FECHA_ABONO': int(fecha_amex.strftime('%Y%m%d')),
+            'COMISION': round(monto * 0.03, 2)
+        })
+        extracto_rows.append(extracto_row(fecha, 'amex', monto))
+
+    # DINERS: grupos por orden de pago (10 primeros dígitos) y fecha
+    for i in range(per_brand):
+        fecha = random_date()
+        items = int(rng.integers(1, 4))
+        orden = f"{7000000000 + i}"
+        total = 0.0
+        for j in range(items):
+            monto = random_amount(20, 1500)
+            total += monto
+            brand_rows['diners'].append({
+                'CÓDIGO DE COMERCIO': '5501234',
+                'ORDEN DE PAGO': f"{orden}{j:02d}",
+                'FECHA DE PAGO': fecha.strftime('%d/%m/%Y'),
+                'IMPORTE NETO DE PAGO': monto
+            })
+        # Algunas líneas con los ajustes de las fases 2 (+2.07) y 3 (-5.90)
+        ajuste = -2.07 if i % 17 == 0 else (-5.90 if i % 19 == 0 else 0.0)
+        extracto_rows.append(extracto_row(fecha, 'diners', round(total + ajuste, 2)))
+
+    # MC: CODCOM (nombre de archivo) + monto, REFERENCIA2 con código de 9 dígitos
+    # (cada 15 filas el código no es de ningún comercio cargado: solo concilia por monto en la fase 2)
+    for i in range(per_brand):
+        fecha = random_date()
+        monto = random_amount()
+        codcom = mc_codcoms[i % len(mc_codcoms)]
+        brand_rows['mc'].append({
+            'CODCOM': codcom,
+            'NETO_TOTAL': monto,
+            'FECHA_ABONO': int(fecha.strftime('%Y%m%d'))
+        })
+        referencia = f"ABONO 00{9000000 + i % 5}" if i % 15 == 7 else f"ABONO 00{codcom}"
+        extracto_rows.append(extracto_row(fecha, 'mc', monto, referencia))
+
+    # MC fase 3: un abono sin código que suma dos liquidaciones, en una fecha propia (después del rango)
+    for i in range(min(5, max(1, per_brand // 100))):
+        fecha = base_date + timedelta(days=28 * months + i)
+        montos = [random_amount(), random_amount()]
+        for monto in montos:
+            brand_rows['mc'].append({
+                'CODCOM': mc_codcoms[i % len(mc_codcoms)],
+                'NETO_TOTAL': monto,
+                'FECHA_ABONO': int(fecha.strftime('%Y%m%d'))
+            })
+        extracto_rows.append(extracto_row(fecha, 'mc', round(sum(montos), 2)))
+
+    # VISA: grupos por comercio y fecha de proceso
+    for i in range(per_brand):
+        fecha = random_date()
+        codcom = visa_codcoms[i % len(visa_codcoms)]
+        items = int(rng.integers(1, 5))
+        total = 0.0
+        for _ in range(items):
+            monto = random_amount(10, 800)
+            total += monto
+            brand_rows['visa'].append({
+                'COMERCIO/CADENA': codcom,
+                'FECHA PROCESO': fecha.strftime('%d/%m/%Y'),
+                'IMPORTE NETO': monto
+            })
+        extracto_rows.append(extracto_row(fecha, 'visa', round(total, 2), f"LIQ 00{codcom}"))
+
+    # PAYU: débitos de órdenes de pago
+    saldo = 1_000_000.0
+    for i in range(per_brand):
+        fecha = random_date()
+        monto = random_amount()
+        saldo -= monto
+        brand_rows['payu'].append({
+            'FECHA': fecha.strftime('%d/%m/%Y'),
+            'DOCUMENTO': f"PO-{i:08d}",
+            'DESCRIPCION': 'PAYMENT_ORDER [PAYMENT_ORDER]',
+            'CREDITOS': 0.0,
+            'DEBITOS': -monto,
+            'NUEVO SALDO': round(saldo, 2),
+            'SALDO CONGELADO ANTERIOR': 0.0,
+            'SALDO RESERVA': 0.0,
+            'SALDO DISPONIBLE': round(saldo, 2)
+        })
+        extracto_rows.append(extracto_row(fecha, 'payu', monto))
+
+    # Completar con movimientos que el filtro del extracto descarta
+    while len(extracto_rows) < rows:
+        extracto_rows.append({**extracto_row(random_date(), 'amex', random_amount()),
+                              'DESCRIPCIÓN OPERACIÓN': DESCRIPCION_RUIDO})
+
+    order = rng.permutation(len(extracto_rows))
+    extracto = pd.DataFrame([extracto_rows[i] for i in order])
+
+    # Archivos por marca: el 10% final va en un archivo de meses anteriores (MA-)
+    files = {}
+    for brand in BRANDS:
+        df = pd.DataFrame(brand_rows[brand])
+        split = int(len(df) * 0.9)
+        if brand == 'mc':
+            files[brand] = [
+                (f"{codcom}-MC.xlsx", group.drop(columns=['CODCOM']))
+                for codcom, group in df.groupby('CODCOM', sort=True)
+            ]
+        else:
+            files[brand] = [
+                (f"{brand.upper()}.xlsx", df.iloc[:split]),
+                (f"{brand.upper()} DIC24.xlsx", df.iloc[split:])
+            ]
+
+    return {'rows': rows, 'extracto': extracto, 'files': files}
+
+
+def write_excel_with_header_offset(df: pd.DataFrame, path: str, title: str):
+    """Escribe un Excel con el encabezado en la fila 5 (como el extracto y PAYU)"""
+    with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False, startrow=4)
+        writer.sheets['Sheet1'].write(0, 0, title)
+
+
+def write_dataset(dataset: Dict[str, Any], directory: str) -> Dict[str, Any]:
+    """Escribe el dataset sintético con los formatos que espera la carga"""
+    os.makedirs(directory, exist_ok=True)
+    extracto_path = os.path.join(directory, 'EXTRACTO.xlsx')
+    write_excel_with_header_offset(dataset['extracto'], extracto_path, 'ESTADO DE CUENTA')
+
+    # Una subcarpeta por marca (formato de conciliador.load_inputs_from_directory)
+    brand_paths = {}
+    for brand, brand_files in dataset['files'].items():
+        brand_paths[brand] = []
+        os.makedirs(os.path.join(directory, brand), exist_ok=True)
+        for filename, df in brand_files:
+            path = os.path.join(directory, brand, filename)
+            if brand == 'payu':
+                write_excel_with_header_offset(df[PAYU_COLUMNS], path, 'REPORTE PAYU')
+            else:
+                df.to_excel(path, index=False, engine='xlsxwriter')
+            brand_paths[brand].append((path, filename))
+
+    return {'extracto': extracto_path, 'brands': brand_paths}
+
+
+def peak_rss_mb() -> float:
+    """Pico de memoria residente del proceso en MB (cada tamaño corre en su propio proceso)"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KB, macOS bytes
+    return usage / (1024 * 1024) if sys.platform == 'darwin' else usage / 1024
+
+
+@contextlib.contextmanager
+def measure(results: Dict[str, Any], name: str, use_tracemalloc: bool):
+    """Mide duración (y pico de tracemalloc opcional) de un bloque, silenciando los print del motor"""
+    if use_tracemalloc:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+    results['seconds'][name] = time.perf_counter() - start
+    if use_tracemalloc:
+        results['tracemalloc_peak_mb'][name] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+
+
+def run_benchmark(rows: int, workdir: str, seed: int = 42, use_tracemalloc: bool = False,
+                  date_window: int = 0, acquirer_partitions: bool = False, months: int = 1,
+                  out_of_core: bool = False) -> Dict[str, Any]:
+    """Ejecuta el pipeline completo (carga, conciliación y exportación) para un tamaño"""
+    dataset = generate_dataset(rows, seed, months)
+    directory = os.path.join(workdir, f"rows_{rows}" if months == 1 else f"rows_{rows}_months_{months}")
+    paths = write_dataset(dataset, directory)
+    del dataset
+
+    results = {'rows': rows, 'months': months, 'date_window': date_window, 'acquirer_partitions': acquirer_partitions,
+               'out_of_core': out_of_core, 'seconds': {}, 'tracemalloc_peak_mb': {}, 'input_rows': {}}
+    if use_tracemalloc:
+        tracemalloc.start()
+
+    # Carga
+    with measure(results, 'ingest_extracto', use_tracemalloc):
+        extracto = conciliador.load_extracto_file(paths['extracto'])
+    results['input_rows']['extracto'] = len(extracto)
+
+    frames = {}
+    for brand, brand_files in paths['brands'].items():
+        loaded = []
+        with measure(results, f"ingest_{brand}", use_tracemalloc):
+            for path, filename in brand_files:
+                df, _ = conciliador.load_brand_file(brand, path, filename)
+                if df is not None:
+                    # Identificadores únicos en la marca y consolidación como en la API
+                    start = sum(len(previous) for previous in loaded)
+                    loaded.append(df.set_axis(pd.RangeIndex(start, start + len(df))))
+            frames[brand] = conciliador.consolidate_frames(loaded)
+        results['input_rows'][brand] = len(frames[brand])
+
+    # Conciliación (las fases se toman de los tiempos internos del motor; las entradas no se copian)
+    engine = conciliador.perform_reconciliation_partitioned if out_of_core else conciliador.perform_reconciliation_multi_step
+    with measure(results, 'reconcile_total', use_tracemalloc):
+        result = engine(
+            extracto, frames['amex'], frames['diners'], frames['mc'], frames['visa'], frames['payu'],
+            date_window=date_window,
+            acquirer_partitions=acquirer_partitions
+        )
+    for phase, seconds in result['timings'].items():
+        results['seconds'][f"phase_{phase}"] = seconds
+    results['matches'] = result['stats']
+
+    # Exportación
+    with measure(results, 'export_excel', use_tracemalloc):
+        conciliador.write_results_excel(result, os.path.join(directory, 'RESULTADO.xlsx'))
+
+    if use_tracemalloc:
+        tracemalloc.stop()
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def run_isolated(rows: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """Ejecuta un tamaño en un subproceso nuevo para que el pico RSS sea solo de esa corrida"""
+    result_path = os.path.join(args.workdir, f"result_{rows}.json")
+    command = [sys.executable, os.path.abspath(__file__), 'single', '--rows', str(rows), '--seed', str(args.seed),
+               '--workdir', args.workdir, '--date-window', str(args.date_window), '--months', str(args.months),
+               '--result', result_path]
+    if args.tracemalloc:
+        command.append('--tracemalloc')
+    if args.acquirer_partitions:
+        command.append('--acquirer-partitions')
+    if args.out_of_core:
+        command.append('--out-of-core')
+    subprocess.run(command, check=True)
+    with open(result_path, encoding='utf-8') as f:
+        results = json.load(f)
+    os.remove(result_path)
+    return results
+
+
+def run_key(run: Dict[str, Any]) -> tuple:
+    """Clave de una corrida: tamaño, meses y opciones del motor"""
+    return (run['rows'], run.get('months', 1), run.get('date_window', 0),
+            run.get('acquirer_partitions', False), run.get('out_of_core', False))
+
+
+def free_port() -> int:
+    """Puerto TCP libre en localhost"""
+    with contextlib.closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def measure_startup(repeat: int = 3) -> Dict[str, float]:
+    """Arranque en frío (mejor de N): importar el módulo y levantar uvicorn hasta que /readyz responde 200"""
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    import_times, ready_times = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import conciliador'], cwd=module_dir, check=True)
+        import_times.append(time.perf_counter() - start)
+
+        port = free_port()
+        start = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'conciliador:app', '--port', str(port), '--log-level', 'warning'],
+            cwd=module_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            while True:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/readyz", timeout=1):
+                        break
+                except (urllib.error.URLError, OSError):
+                    # Sin conexión todavía o 503 mientras precalienta
+                    pass
+                if server.poll() is not None or time.perf_counter() - start > 60:
+                    raise RuntimeError('El servidor no llegó a estar listo')
+                time.sleep(0.01)
+            ready_times.append(time.perf_counter() - start)
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+    return {'import_seconds': min(import_times), 'ready_seconds': min(ready_times)}
+
+
+def git_commit() -> str:
+    """Commit actual del repositorio (o 'unknown')"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare_results(old_path: str, new_path: str, threshold: float) -> int:
+    """Compara dos archivos de resultados y devuelve 1 si hay regresiones sobre el umbral"""
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+
+    old_runs = {run_key(run): run for run in old['runs']}
+    regressions = 0
+    print(f"📊 {old['commit']} → {new['commit']}")
+    for run in new['runs']:
+        base = old_runs.get(run_key(run))
+        if base is None:
+            continue
+        options = [f"{run.get('months', 1)} meses", f"ventana {run.get('date_window', 0)}"]
+        if run.get('acquirer_partitions'):
+            options.append('particiones')
+        if run.get('out_of_core'):
+            options.append('por meses')
+        print(f"\n▶ {run['rows']} filas ({', '.join(options)})")
+        for metric, seconds in run['seconds'].items():
+            before = base['seconds'].get(metric)
+            if not before:
+                continue
+            ratio = seconds / before
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = '  ⚠️ REGRESIÓN'
+                regressions += 1
+            print(f"  {metric:<22} {before:>10.4f}s → {seconds:>10.4f}s  x{ratio:.2f}{flag}")
+        print(f"  {'peak_rss_mb':<22} {base['peak_rss_mb']:>10.1f}  → {run['peak_rss_mb']:>10.1f}")
+
+    if old.get('startup') and new.get('startup'):
+        print("\n▶ arranque")
+        for metric, seconds in new['startup'].items():
+            before = old['startup'].get(metric)
+            if not before:
+                continue
+            ratio = seconds / before
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = '  ⚠️ REGRESIÓN'
+                regressions += 1
+            print(f"  {metric:<22} {before:>10.4f}s → {seconds:>10.4f}s  x{ratio:.2f}{flag}")
+
+    return 1 if regressions else 0
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark del pipeline de conciliación')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='Genera datos y mide el pipeline')
+    single = sub.add_parser('single', help='Mide un solo tamaño (uso interno de run, un proceso por tamaño)')
+    for command in (run, single):
+        command.add_argument('--seed', type=int, default=42)
+        command.add_argument('--workdir', default='temp/benchmark', help='Directorio para los archivos generados')
+        command.add_argument('--tracemalloc', action='store_true', help='Medir pico de memoria Python por etapa (más lento)')
+        command.add_argument('--date-window', type=int, default=0, help='Ventana de fechas en días hábiles (0 = fecha exacta)')
+        command.add_argument('--acquirer-partitions', action='store_true',
+                             help='Recorrer primero las filas del extracto del adquirente de cada fase')
+        command.add_argument('--months', type=int, default=1, help='Meses que abarcan las fechas del dataset sintético')
+        command.add_argument('--out-of-core', action='store_true', help='Conciliar por meses con memoria acotada')
+    run.add_argument('--rows', type=int, nargs='+', default=[1000, 10000], help='Filas del extracto por corrida')
+    run.add_argument('--output-dir', default='bench_results', help='Directorio de resultados JSON')
+    run.add_argument('--startup-repeat', type=int, default=3,
+                     help='Arranques en frío a medir (import y tiempo hasta /readyz); 0 para omitir')
+    single.add_argument('--rows', type=int, required=True)
+    single.add_argument('--result', required=True, help='Archivo JSON donde guardar la corrida')
+
+    generate = sub.add_parser('generate', help='Solo genera los archivos sintéticos')
+    generate.add_argument('--rows', type=int, default=1000)
+    generate.add_argument('--seed', type=int, default=42)
+    generate.add_argument('--months', type=int, default=1)
+    generate.add_argument('--dir', required=True)
+
+    compare = sub.add_parser('compare', help='Compara dos resultados JSON')
+    compare.add_argument('old')
+    compare.add_argument('new')
+    compare.add_argument('--threshold', type=float, default=0.10, help='Regresión tolerada (0.10 = 10%%)')
+
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+
+    if args.command == 'generate':
+        paths = write_dataset(generate_dataset(args.rows, args.seed, args.months), args.dir)
+        print(f"✅ Dataset generado en {args.dir}: {json.dumps(paths, indent=2)}")
+        return 0
+
+    if args.command == 'compare':
+        return compare_results(args.old, args.new, args.threshold)
+
+    if args.command == 'single':
+        run_result = run_benchmark(args.rows, args.workdir, args.seed, args.tracemalloc, args.date_window,
+                                   args.acquirer_partitions, args.months, args.out_of_core)
+        with open(args.result, 'w', encoding='utf-8') as f:
+            json.dump(run_result, f)
+        return 0
+
+    commit = git_commit()
+    startup = None
+    if args.startup_repeat:
+        print("🚀 Midiendo arranque en frío...")
+        startup = measure_startup(args.startup_repeat)
+        print(f"✅ Import {startup['import_seconds']:.2f}s, listo (/readyz) en {startup['ready_seconds']:.2f}s")
+
+    runs = []
+    for rows in args.rows:
+        print(f"🚀 Benchmark con {rows} filas...")
+        run_result = run_isolated(rows, args)
+        runs.append(run_result)
+        total = sum(v for k, v in run_result['seconds'].items() if not k.startswith('phase_'))
+        print(f"✅ {rows} filas: {total:.2f}s, pico RSS {run_result['peak_rss_mb']:.1f} MB")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    output_path = os.path.join(args.output_dir, f"bench_{commit}_{timestamp}.json")
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'commit': commit,
+            'timestamp': timestamp,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pandas': pd.__version__,
+            'startup': startup,
+            'runs': runs
+        }, f, indent=2)
+    print(f"📁 Resultados guardados en {output_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
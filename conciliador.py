@@ -9,503 +9,1821 @@ import numpy as np
 import os
 import re
 from datetime import datetime
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Header
+from fastapi.responses import FileResponse, HTMLResponse, PlainTextResponse, StreamingResponse, Response
+from starlette.datastructures import Headers
+from starlette.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Callable
 import uuid
 import json
-import xlsxwriter
+import hashlib
+from collections import OrderedDict
 from io import BytesIO
 from itertools import combinations
 import math
+import time
+import gzip
+import logging
+import sys
+import threading
+import contextlib
+import cProfile
+import tracemalloc
+import atexit
+import shutil
+import csv
+import bisect
+import sqlite3
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import asyncio
+import importlib.util
 
-app = FastAPI()
+# pyarrow es opcional (sin él los datos cargados quedan en memoria) y se importa al primer uso,
+# como xlsxwriter y openpyxl: los workers y herramientas de línea de comandos no pagan lo que no usan
+PYARROW_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+pa = None
+pa_ipc = None
 
-# Crear directorios necesarios
-os.makedirs("temp", exist_ok=True)
-os.makedirs("outputs", exist_ok=True)
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-# Variables globales para almacenar datos
+# Estado del arranque para /readyz: listo recién cuando termina el precalentamiento del lifespan
+startup_state = {'ready': False, 'seconds': None}
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Arranque: directorios, temporales huérfanos y precalentamiento; al cerrar libera los workers"""
+    start = time.perf_counter()
+    await run_in_threadpool(warm_up)
+    startup_state['seconds'] = round(time.perf_counter() - start, 3)
+    startup_state['ready'] = True
+    print(f"🟢 Listo para recibir tráfico en {startup_state['seconds']:.2f}s")
+    try:
+        yield
+    finally:
+        startup_state['ready'] = False
+        shutdown_workers()
+
+app = FastAPI(lifespan=lifespan)
+
+# Moneda por defecto (set-currency) para las peticiones que no indican ?currency_code=
 currency = None
-extracto_data = None
-amex_data = []
-diners_data = []
-mc_data = []
-visa_data = []
-payu_data = []
-files_info = {
-    'amex': [],
-    'diners': [],
-    'mc': [],
-    'visa': [],
-    'payu': []
+
+# Espacios de trabajo por moneda: datos cargados, último resultado y worker de conciliación propios,
+# así PEN y USD se cargan y concilian en paralelo (clave '' = sin moneda)
+BRAND_TYPES = ('amex', 'diners', 'mc', 'visa', 'payu')
+workspaces = {}
+# Los lotes se numeran en el threadpool: la reserva del rango de identificadores es atómica
+row_labels_lock = threading.Lock()
+
+# Worker de conciliación por moneda: 'process' (un proceso por moneda, en paralelo real) o 'thread'
+RECONCILE_WORKERS = os.getenv('RECONCILE_WORKERS', 'process')
+worker_progress_queue = None
+worker_flushes = {}
+# Almacenamiento de datos cargados en archivos Arrow IPC leídos con memory-map
+ARROW_STORAGE = PYARROW_AVAILABLE and os.getenv("ARROW_STORAGE", "1") != "0"
+ARROW_DIR = os.path.join("temp", "arrow", str(os.getpid()))
+# Formatos de entrada aceptados y fechas ISO en texto de los CSV
+INPUT_EXTENSIONS = ('.xlsx', '.xls', '.csv', '.parquet')
+ISO_DATE_PATTERN = r'^\d{4}-\d{2}-\d{2}( \d{2}:\d{2}(:\d{2})?)?$'
+
+# Hilos para descomprimir y leer los archivos de una carga agrupada (ZIP)
+BUNDLE_WORKERS = int(os.getenv("BUNDLE_WORKERS", "4"))
+parser_pool = None
+
+# Columnas requeridas por marca (también limitan las columnas leídas de CSV/Parquet/Excel)
+BRAND_REQUIRED_COLUMNS = {
+    'amex': ['CODIGO', 'NETO_TOTAL', 'FECHA_ABONO'],
+    'diners': ['CÓDIGO DE COMERCIO', 'ORDEN DE PAGO', 'FECHA DE PAGO', 'IMPORTE NETO DE PAGO'],
+    'mc': ['NETO_TOTAL', 'FECHA_ABONO'],
+    'visa': ['COMERCIO/CADENA', 'FECHA PROCESO', 'IMPORTE NETO'],
+    'payu': ['FECHA', 'DOCUMENTO', 'DESCRIPCION', 'CREDITOS', 'DEBITOS', 'NUEVO SALDO', 'SALDO CONGELADO ANTERIOR', 'SALDO RESERVA', 'SALDO DISPONIBLE']
 }
 
+# Patrones de columnas del extracto (subcadenas, en orden de preferencia)
+EXTRACTO_REQUIRED_PATTERNS = {
+    'FECHA': ['FECHA'],
+    'DESCRIPCIÓN OPERACIÓN': ['DESCRIPCIÓN OPERACIÓN', 'DESCRIPCION OPERACION', 'DESCRIPCIÓN', 'DESCRIPCION'],
+    'MONTO': ['MONTO', 'IMPORTE', 'VALOR'],
+    'OPERACIÓN - NÚMERO': ['OPERACIÓN - NÚMERO', 'OPERACION - NUMERO', 'OPERACIÓN NÚMERO', 'OPERACION NUMERO', 'OP NUMERO', 'OP - NUMERO'],
+    'REFERENCIA2': ['REFERENCIA2', 'REFERENCIA 2', 'REF2', 'REFERENCIA']
+}
+
+# Filtro del extracto por descripción: cada alternativa etiqueta la familia de adquirente de la fila (ADQUIRENTE)
+EXTRACTO_ACQUIRER_REGEX = (
+    r'(?P<diners>DINERS CLUB|DINERS CLUB PERU S)|(?P<amex>CIA DE SERV)|(?P<mc>DE PROCESOS DE MEDIOS)'
+    r'|(?P<payu>DE PAYU PERU S.A.C)|(?P<visa>COMPAN)'
+)
+
+# Detección de esquema: filas revisadas para ubicar el encabezado y caché de mapeos por huella de encabezado
+SCHEMA_SCAN_ROWS = int(os.getenv("SCHEMA_SCAN_ROWS", "15"))
+SCHEMA_CACHE_SIZE = int(os.getenv("SCHEMA_CACHE_SIZE", "256"))
+schema_cache = OrderedDict()
+# Huellas de encabezados ya reconocidos por tipo de archivo (los lectores corren en hilos: se comparten con lock)
+known_headers = OrderedDict()
+schema_lock = threading.Lock()
+
+# Caché de resultados por huella de entradas (LRU acotada)
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '8'))
+result_cache = OrderedDict()
+result_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+# Conciliaciones ejecutadas (job_id -> artefactos como trazas), se conservan las últimas N
+JOB_HISTORY_SIZE = int(os.getenv('JOB_HISTORY_SIZE', '50'))
+jobs = OrderedDict()
+
+# Cargas por bloques reanudables: el archivo se arma en temp/uploads y se procesa al confirmar
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
+UPLOAD_TTL_HOURS = float(os.getenv('UPLOAD_TTL_HOURS', '24'))
+UPLOAD_DIR = os.path.join("temp", "uploads")
+chunked_uploads = {}
+
+# Control de admisión (0 = sin límite): bytes por request de carga, filas cargadas por tipo de archivo,
+# conciliaciones simultáneas y memoria estimada de cada conciliación (factor × bytes de los datos cargados)
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(512 * 1024 * 1024)))
+MAX_ROWS_PER_TYPE = int(os.getenv('MAX_ROWS_PER_TYPE', '2000000'))
+MAX_CONCURRENT_RECONCILES = int(os.getenv('MAX_CONCURRENT_RECONCILES', '2'))
+RECONCILE_MEMORY_FACTOR = float(os.getenv('RECONCILE_MEMORY_FACTOR', '40'))
+MEMORY_RESERVE_MB = int(os.getenv('MEMORY_RESERVE_MB', '256'))
+RETRY_AFTER_SECONDS = int(os.getenv('RETRY_AFTER_SECONDS', '15'))
+admitted_memory = 0
+
+# Canales de progreso (SSE) por id elegido por el cliente: ?progress_id=... en cargas y conciliación
+PROGRESS_POLL_INTERVAL = float(os.getenv('PROGRESS_POLL_INTERVAL', '0.2'))
+PROGRESS_RETENTION_SECONDS = float(os.getenv('PROGRESS_RETENTION_SECONDS', '300'))
+EXPORT_PROGRESS_ROWS = 5000
+progress_channels = {}
+progress_lock = threading.Lock()
+
+# Frontend: la página se lee una vez y se sirve desde memoria (FRONTEND_RELOAD=1 la relee en cada request,
+# para desarrollo); CSS y JS van por /static con URL versionada por hash de contenido
+FRONTEND_PAGE = "conciliador.html"
+STATIC_DIR = "static"
+FRONTEND_RELOAD = os.getenv('FRONTEND_RELOAD', '0') == '1'
+STATIC_MAX_AGE = 365 * 24 * 3600
+frontend_page = None
+compressed_assets = {}
+
+# Ventana de fechas (± días hábiles) para AMEX F2, DINERS F1 y VISA; 0 = fecha exacta como el HTML
+DATE_WINDOW_DAYS = int(os.getenv('DATE_WINDOW_DAYS', '0'))
+DATE_WINDOW_MAX_DAYS = 10
+
+# Particiones por adquirente: cada fase recorre primero las filas del extracto de su familia y luego el resto
+ACQUIRER_PARTITIONS = os.getenv('ACQUIRER_PARTITIONS', '0') == '1'
+
+# Conciliación por meses fuera de memoria (perform_reconciliation_partitioned): 0 nunca (por defecto), 1 siempre,
+# auto cuando la estimación de la conciliación completa no cabe en la memoria disponible. Puede conciliar
+# distinto que la completa (los meses se recorren en orden), por eso solo se usa si se pide
+OUT_OF_CORE = os.getenv('OUT_OF_CORE', '0')
+
+# Perfilado bajo demanda (?profile=... o header X-Profile)
+PROFILE_MODES = ('cprofile', 'sample')
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.005'))
+# tracemalloc es global al proceso: un solo perfilado a la vez
+profile_lock = threading.Lock()
+
+# Columnas de fecha y monto de cada hoja del resultado
+SHEET_DATE_COLUMNS = {
+    'extracto': 'FECHA',
+    'amex': 'FECHA_ABONO',
+    'diners': 'FECHA DE PAGO',
+    'mc': 'FECHA_ABONO',
+    'visa': 'FECHA PROCESO',
+    'payu': 'FECHA'
+}
+SHEET_AMOUNT_COLUMNS = {
+    'extracto': 'MONTO',
+    'amex': 'NETO_TOTAL',
+    'diners': 'IMPORTE NETO DE PAGO',
+    'mc': 'NETO_TOTAL',
+    'visa': 'IMPORTE NETO',
+    'payu': 'DEBITOS'
+}
+
+# Columna de código de comercio de cada marca (para el libro de pendientes)
+SHEET_CODCOM_COLUMNS = {
+    'amex': 'CODIGO',
+    'diners': 'CÓDIGO DE COMERCIO',
+    'mc': 'CODCOM',
+    'visa': 'COMERCIO/CADENA',
+    'payu': None
+}
+
+# Libro de pendientes: ítems de marcas que quedan Pendiente se guardan en SQLite y se vuelven a
+# conciliar en las corridas siguientes sin subir de nuevo los archivos de meses anteriores
+LEDGER_ENABLED = os.getenv('LEDGER_ENABLED', '1') != '0'
+LEDGER_PATH = os.getenv('LEDGER_PATH', os.path.join('data', 'ledger.sqlite3'))
+LEDGER_MAX_AGE_DAYS = int(os.getenv('LEDGER_MAX_AGE_DAYS', '180'))
+ledger_lock = threading.Lock()
+
+# Histórico de conciliaciones: cada corrida guarda sus filas (ESTADO, #REF, fase) en SQLite para auditorías
+HISTORY_ENABLED = os.getenv('HISTORY_ENABLED', '1') != '0'
+HISTORY_PATH = os.getenv('HISTORY_PATH', os.path.join('data', 'history.sqlite3'))
+history_lock = threading.Lock()
+
+# Métricas en formato de exposición Prometheus
+METRIC_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+METRIC_DEFINITIONS = {
+    'conciliador_request_duration_seconds': ('histogram', 'Latencia de requests por ruta'),
+    'conciliador_rows_ingested_total': ('counter', 'Filas cargadas por tipo de archivo'),
+    'conciliador_phase_duration_seconds': ('histogram', 'Duración de cada fase de conciliación'),
+    'conciliador_phase_matches_total': ('counter', 'Conciliaciones realizadas por fase'),
+    'conciliador_export_duration_seconds': ('histogram', 'Duración de la exportación a Excel'),
+    'conciliador_reconcile_jobs_running': ('gauge', 'Conciliaciones en ejecución'),
+    'conciliador_reconcile_admitted_bytes': ('gauge', 'Memoria estimada reservada por las conciliaciones en ejecución'),
+    'conciliador_admission_rejections_total': ('counter', 'Requests rechazadas por el control de admisión por motivo'),
+    'conciliador_workspace_rows': ('gauge', 'Filas cargadas en memoria por tipo de archivo'),
+    'conciliador_workspace_bytes': ('gauge', 'Bytes de los datos cargados por tipo de archivo (en memoria o en archivos Arrow)'),
+    'conciliador_result_cache_entries': ('gauge', 'Resultados en caché')
+}
+metric_histograms = {}
+metric_counters = {}
+reconcile_jobs_running = 0
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Registra la latencia de cada request por plantilla de ruta"""
+    start = time.perf_counter()
+    response = await call_next(request)
+    
+    route = request.scope.get('route')
+    if route is not None and route.path not in ('/metrics', '/healthz', '/readyz'):
+        route_path = route.path
+        # Separar las cargas por marca sin abrir etiquetas a valores arbitrarios
+        file_type = request.path_params.get('file_type')
+        if file_type in BRAND_TYPES:
+            route_path = route_path.replace('{file_type}', file_type)
+        observe_metric('conciliador_request_duration_seconds',
+                       {'route': route_path, 'method': request.method},
+                       time.perf_counter() - start)
+    
+    return response
+
+def compress_variants(body: bytes) -> Dict[str, bytes]:
+    """Variantes precomprimidas de un recurso: gzip y, si está instalado brotli, br"""
+    variants = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(body)
+    return variants
+
+def preferred_encoding(accept_encoding: str, variants: Dict[str, bytes]) -> Optional[str]:
+    """Codificación a enviar según Accept-Encoding (br antes que gzip); None para enviar sin comprimir"""
+    accepted = {}
+    for part in accept_encoding.lower().split(','):
+        token, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token.strip()] = quality
+    for encoding in ('br', 'gzip'):
+        if encoding in variants and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Indica si If-None-Match incluye el ETag (o '*')"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+def load_frontend_page() -> Dict[str, Any]:
+    """Lee la página, versiona sus URL de /static con el hash de cada archivo y la precomprime"""
+    with open(FRONTEND_PAGE, "r", encoding="utf-8") as f:
+        html = f.read()
+    
+    def versioned(match: re.Match) -> str:
+        path = os.path.join(STATIC_DIR, match.group(1))
+        if not os.path.isfile(path):
+            return match.group(0)
+        with open(path, 'rb') as f:
+            return f"/static/{match.group(1)}?v={hashlib.sha256(f.read()).hexdigest()[:12]}"
+    
+    body = re.sub(r'/static/([\w./-]+)', versioned, html).encode('utf-8')
+    return {'body': body, 'etag': f'"{hashlib.sha256(body).hexdigest()[:16]}"', 'variants': compress_variants(body)}
+
+class FrontendStaticFiles(StaticFiles):
+    """StaticFiles con Cache-Control (inmutable si la URL lleva ?v=hash) y variantes comprimidas en memoria"""
+    
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        # ETag, Last-Modified y 304 los resuelve StaticFiles
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        versioned = b'v=' in scope.get('query_string', b'')
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable' if versioned else 'no-cache'
+        response.headers['Vary'] = 'Accept-Encoding'
+        if response.status_code != 200:
+            return response
+        
+        # Se comprime una vez por versión del archivo (ruta, mtime y tamaño)
+        version = (stat_result.st_mtime_ns, stat_result.st_size)
+        cached = compressed_assets.get(str(full_path))
+        if cached is None or cached[0] != version:
+            with open(full_path, 'rb') as f:
+                cached = (version, compress_variants(f.read()))
+            compressed_assets[str(full_path)] = cached
+        
+        encoding = preferred_encoding(Headers(scope=scope).get('accept-encoding', ''), cached[1])
+        if encoding is None:
+            return response
+        headers = {name: value for name, value in response.headers.items() if name != 'content-length'}
+        headers['Content-Encoding'] = encoding
+        return Response(cached[1][encoding], status_code=status_code, headers=headers)
+
+app.mount("/static", FrontendStaticFiles(directory=STATIC_DIR, check_dir=False), name="static")
+
 @app.get("/", response_class=HTMLResponse)
-async def index():
-    with open("conciliador.html", "r", encoding="utf-8") as f:
-        return f.read()
+async def index(request: Request):
+    """Página principal desde memoria, con ETag y precomprimida"""
+    global frontend_page
+    if frontend_page is None or FRONTEND_RELOAD:
+        frontend_page = load_frontend_page()
+    
+    # no-cache: el navegador revalida con If-None-Match y recibe 304 si la página no cambió
+    headers = {'ETag': frontend_page['etag'], 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if etag_matches(request.headers.get('if-none-match'), frontend_page['etag']):
+        return Response(status_code=304, headers=headers)
+    
+    encoding = preferred_encoding(request.headers.get('accept-encoding', ''), frontend_page['variants'])
+    if encoding is None:
+        return HTMLResponse(frontend_page['body'], headers=headers)
+    headers['Content-Encoding'] = encoding
+    return HTMLResponse(frontend_page['variants'][encoding], headers=headers)
+
+def get_parser_pool() -> ThreadPoolExecutor:
+    """Pool compartido para descomprimir y leer los archivos de una carga agrupada"""
+    global parser_pool
+    if parser_pool is None:
+        parser_pool = ThreadPoolExecutor(max_workers=BUNDLE_WORKERS, thread_name_prefix="parser")
+    return parser_pool
+
+def pid_alive(pid: int) -> bool:
+    """Indica si existe un proceso con ese PID"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def cleanup_stale_temp():
+    """Borra temporales de procesos anteriores: directorios Arrow de PIDs muertos y cargas por bloques vencidas"""
+    removed = 0
+    arrow_root = os.path.dirname(ARROW_DIR)
+    if os.path.isdir(arrow_root):
+        for name in os.listdir(arrow_root):
+            # El directorio propio también es de un proceso anterior (el PID se reutiliza en contenedores)
+            if name.isdigit() and int(name) != os.getpid() and pid_alive(int(name)):
+                continue
+            shutil.rmtree(os.path.join(arrow_root, name), ignore_errors=True)
+            removed += 1
+    
+    # Las cargas por bloques viven en memoria: tras un reinicio sus .part solo sirven hasta vencer
+    if os.path.isdir(UPLOAD_DIR):
+        limit = time.time() - UPLOAD_TTL_HOURS * 3600
+        for name in os.listdir(UPLOAD_DIR):
+            path = os.path.join(UPLOAD_DIR, name)
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+                removed += 1
+    
+    if removed:
+        print(f"🧹 Temporales huérfanos eliminados: {removed}")
+
+def warm_up():
+    """Precalienta lo que la primera petición pagaría: módulos diferidos, pool de lectura, frontend y bases SQLite"""
+    global frontend_page
+    os.makedirs("temp", exist_ok=True)
+    os.makedirs("outputs", exist_ok=True)
+    cleanup_stale_temp()
+    
+    if ARROW_STORAGE:
+        load_pyarrow()
+    import xlsxwriter
+    import openpyxl
+    
+    # Crear los hilos del pool de lectura antes de la primera carga agrupada
+    pool = get_parser_pool()
+    list(pool.map(lambda _: None, range(BUNDLE_WORKERS)))
+    
+    # Página y recursos estáticos comprimidos en memoria
+    frontend_page = load_frontend_page()
+    if os.path.isdir(STATIC_DIR):
+        for name in os.listdir(STATIC_DIR):
+            # Misma clave que usa StaticFiles (ruta real)
+            path = os.path.realpath(os.path.join(STATIC_DIR, name))
+            if os.path.isfile(path):
+                stat_result = os.stat(path)
+                with open(path, 'rb') as f:
+                    compressed_assets[path] = ((stat_result.st_mtime_ns, stat_result.st_size), compress_variants(f.read()))
+    
+    if LEDGER_ENABLED:
+        ledger_connect().close()
+    if HISTORY_ENABLED:
+        history_connect().close()
+
+def shutdown_workers():
+    """Detiene los workers de conciliación de cada moneda y el pool de lectura"""
+    global parser_pool
+    for workspace in workspaces.values():
+        if workspace['executor'] is not None:
+            workspace['executor'].shutdown(wait=False, cancel_futures=True)
+            workspace['executor'] = None
+    if parser_pool is not None:
+        parser_pool.shutdown(wait=False)
+        parser_pool = None
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: el proceso responde"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: el arranque terminó y la instancia puede recibir tráfico"""
+    if not startup_state['ready']:
+        raise HTTPException(status_code=503, detail="Iniciando")
+    return {"status": "ready", "startup_seconds": startup_state['seconds']}
 
 @app.post("/api/set-currency")
 async def set_currency(data: dict):
     global currency
     currency = data["currency"]
+    get_workspace(currency)
     return {"message": f"Moneda {currency} configurada"}
 
+def workspace_key(currency_code: Optional[str]) -> str:
+    """Clave del espacio de trabajo: la moneda indicada o, si no se indica, la configurada con set-currency"""
+    key = str((currency if currency_code is None else currency_code) or '').strip().upper()
+    if key and not re.fullmatch(r'[A-Z0-9]{1,8}', key):
+        raise HTTPException(status_code=400, detail=f"Moneda inválida: {key}")
+    return key
+
+def get_workspace(currency_code: Optional[str] = None) -> Dict[str, Any]:
+    """Espacio de trabajo de una moneda (se crea vacío la primera vez)"""
+    key = workspace_key(currency_code)
+    if key not in workspaces:
+        workspaces[key] = {
+            'currency': key,
+            'extracto': None,
+            # Meses del extracto cargado (para estimar la conciliación por meses sin releerlo)
+            'extracto_months': set(),
+            # brands[marca][i] es el DataFrame guardado que describe files_info[marca][i]
+            'brands': {brand: [] for brand in BRAND_TYPES},
+            'files_info': {brand: [] for brand in BRAND_TYPES},
+            # Siguiente identificador de fila libre por marca (reservado al guardar cada lote)
+            'next_label': {brand: 0 for brand in BRAND_TYPES},
+            # Resultado de la última conciliación (hojas guardadas en Arrow) e índices para consultarlo sin Excel
+            'last_result': None,
+            'result_indexes': {},
+            'result_frames': {},
+            'last_response': None,
+            'running': 0,
+            # Datos reemplazados mientras un job podía leerlos: se eliminan al terminar las conciliaciones
+            'stale_frames': [],
+            'executor': None
+        }
+    return workspaces[key]
+
+def init_reconcile_worker(queue):
+    """Inicializa un proceso worker con la cola por la que devuelve el progreso"""
+    global worker_progress_queue
+    worker_progress_queue = queue
+
+def forward_worker_progress(queue):
+    """Reenvía a los canales SSE los eventos que publica un proceso worker"""
+    while True:
+        try:
+            progress_id, event, data = queue.get()
+        except (EOFError, OSError):
+            return
+        if event is None:
+            # Marca de fin del job: todo lo anterior ya está publicado
+            flushed = worker_flushes.get(progress_id)
+            if flushed is not None:
+                flushed.set()
+            continue
+        publish_progress(progress_id, event, data)
+
+def workspace_executor(workspace: Dict[str, Any]):
+    """Worker de conciliación de la moneda (se crea la primera vez y se reutiliza)"""
+    if workspace['executor'] is None:
+        name = workspace['currency'] or 'default'
+        if RECONCILE_WORKERS == 'process':
+            context = multiprocessing.get_context('spawn')
+            queue = context.Queue()
+            workspace['executor'] = ProcessPoolExecutor(
+                max_workers=1, mp_context=context, initializer=init_reconcile_worker, initargs=(queue,)
+            )
+            threading.Thread(target=forward_worker_progress, args=(queue,), daemon=True, name=f"progress-{name}").start()
+            # Arrancar el proceso ya (importar pandas toma un momento) para no pagarlo al conciliar
+            workspace['executor'].submit(os.getpid)
+        else:
+            workspace['executor'] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"reconcile-{name}")
+    return workspace['executor']
+
+def normalize_header(name) -> str:
+    """Normaliza un nombre de columna: mayúsculas, sin acentos ni espacios en los extremos"""
+    return str(name).upper().replace('Ó', 'O').replace('É', 'E').replace('Í', 'I').replace('Á', 'A').replace('Ú', 'U').strip()
+
+# Alias normalizados precalculados: subcadenas del extracto y nombres exactos por marca
+# (DINERS compara sin acentos, el resto en mayúsculas)
+EXTRACTO_PATTERN_ALIASES = {
+    name: [pattern.upper() for pattern in patterns] for name, patterns in EXTRACTO_REQUIRED_PATTERNS.items()
+}
+BRAND_COLUMN_ALIASES = {
+    file_type: [(col, normalize_header(col) if file_type == 'diners' else col.upper()) for col in columns]
+    for file_type, columns in BRAND_REQUIRED_COLUMNS.items()
+}
+
+def header_fingerprint(columns: List[str]) -> str:
+    """Huella de una fila de encabezado (nombres en orden)"""
+    return hashlib.sha1('\x1f'.join(columns).encode('utf-8')).hexdigest()
+
+def map_columns(file_type: str, columns) -> Dict[str, int]:
+    """Posición de cada columna requerida en el encabezado; cacheado por huella de encabezado"""
+    columns = [str(col).strip() for col in columns]
+    key = (file_type, header_fingerprint(columns))
+    with schema_lock:
+        if key in schema_cache:
+            schema_cache.move_to_end(key)
+            return schema_cache[key]
+    
+    mapping = {}
+    if file_type == 'extracto':
+        upper_columns = [col.upper() for col in columns]
+        for standard_name, aliases in EXTRACTO_PATTERN_ALIASES.items():
+            # Primer patrón que aparece en alguna columna; si no, similitud parcial por palabra
+            index = next((i for alias in aliases for i, col in enumerate(upper_columns) if alias in col), None)
+            if index is None:
+                words = standard_name.split()
+                index = next((i for i, col in enumerate(upper_columns) if any(word in col for word in words)), None)
+            if index is not None:
+                mapping[standard_name] = index
+    else:
+        normalize = normalize_header if file_type == 'diners' else str.upper
+        positions = {}
+        for i, col in enumerate(columns):
+            positions.setdefault(normalize(col), i)
+        for col, alias in BRAND_COLUMN_ALIASES[file_type]:
+            if alias in positions:
+                mapping[col] = positions[alias]
+    
+    with schema_lock:
+        schema_cache[key] = mapping
+        while len(schema_cache) > SCHEMA_CACHE_SIZE:
+            schema_cache.popitem(last=False)
+    return mapping
+
+def open_input_source(path: str, filename: str):
+    """Abre un Excel una sola vez para detectar el encabezado y leerlo; CSV y Parquet se leen por ruta"""
+    if filename.lower().endswith(('.xlsx', '.xls')):
+        return pd.ExcelFile(path)
+    return contextlib.nullcontext(path)
+
+def read_leading_rows(path, filename: str, csv_options: Dict[str, str], nrows: int) -> List[List[str]]:
+    """Lee solo las primeras filas de un archivo Excel o CSV como texto, sin interpretar encabezados"""
+    if filename.lower().endswith('.csv'):
+        for encoding in ('utf-8-sig', 'latin-1'):
+            try:
+                with open(path, newline='', encoding=encoding) as f:
+                    reader = csv.reader(f, delimiter=csv_options.get('delimiter', ','))
+                    return [row for _, row in zip(range(nrows), reader)]
+            except UnicodeDecodeError:
+                continue
+        return []
+    
+    rows = pd.read_excel(path, header=None, nrows=nrows).values.tolist()
+    return [['' if pd.isna(value) else str(value) for value in row] for row in rows]
+
+def header_matches(file_type: str, row: List[str]) -> bool:
+    """Indica si una fila contiene todas las columnas requeridas (para el extracto, solo por patrón)"""
+    if file_type == 'extracto':
+        upper_row = [str(col).strip().upper() for col in row]
+        return all(any(alias in col for alias in aliases for col in upper_row)
+                   for aliases in EXTRACTO_PATTERN_ALIASES.values())
+    
+    normalize = normalize_header if file_type == 'diners' else str.upper
+    names = {normalize(str(col).strip()) for col in row}
+    return all(alias in names for _, alias in BRAND_COLUMN_ALIASES[file_type])
+
+def is_known_header(file_type: str, row: List[str]) -> bool:
+    """Indica si la fila es un encabezado válido; los ya vistos se reconocen por su huella sin revisar columnas"""
+    key = (file_type, header_fingerprint([str(col).strip() for col in row]))
+    with schema_lock:
+        if key in known_headers:
+            known_headers.move_to_end(key)
+            return True
+    if not header_matches(file_type, row):
+        return False
+    with schema_lock:
+        known_headers[key] = True
+        while len(known_headers) > SCHEMA_CACHE_SIZE:
+            known_headers.popitem(last=False)
+    return True
+
+def detect_header_row(path, filename: str, file_type: str, default_row: int,
+                      csv_options: Optional[Dict[str, str]] = None) -> int:
+    """Ubica la fila de encabezado entre las primeras SCHEMA_SCAN_ROWS filas (la fila por defecto primero)"""
+    rows = read_leading_rows(path, filename, csv_options or {}, SCHEMA_SCAN_ROWS)
+    candidates = list(dict.fromkeys([default_row] + list(range(len(rows)))))
+    for row_index in candidates:
+        if row_index < len(rows) and is_known_header(file_type, rows[row_index]):
+            if row_index != default_row:
+                print(f"📄 {file_type.upper()} - Encabezado detectado en la fila {row_index + 1}")
+            return row_index
+    
+    return default_row
+
+def read_with_detected_header(source, filename: str, file_type: str, default_row: int,
+                              columns: Optional[List[str]] = None,
+                              csv_options: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """Detecta el encabezado leyendo solo las primeras filas y luego lee el archivo completo una sola vez"""
+    if filename.lower().endswith('.parquet'):
+        return read_input_table(source, filename, default_row, columns, csv_options)
+    header = detect_header_row(source, filename, file_type, default_row, csv_options)
+    return read_input_table(source, filename, header, columns, csv_options)
+
+def resolve_csv_options(delimiter: str, decimal: str, thousands: str = '') -> Dict[str, str]:
+    """Valida el separador, el decimal y el separador de miles de los CSV (400 si no son válidos)"""
+    if delimiter.lower() in ('tab', '\\t'):
+        delimiter = '\t'
+    if len(delimiter) != 1:
+        raise HTTPException(status_code=400, detail=f"Separador CSV inválido: {delimiter}")
+    if decimal not in ('.', ','):
+        raise HTTPException(status_code=400, detail=f"Decimal CSV inválido: {decimal} (usar . o ,)")
+    if delimiter == decimal:
+        raise HTTPException(status_code=400, detail="El separador CSV no puede ser igual al decimal")
+    if thousands not in ('', '.', ',', ' ', "'"):
+        raise HTTPException(status_code=400, detail=f"Separador de miles CSV inválido: {thousands} (usar . , espacio o ')")
+    if thousands and thousands in (delimiter, decimal):
+        raise HTTPException(status_code=400, detail="El separador de miles CSV no puede ser igual al separador ni al decimal")
+    return {'delimiter': delimiter, 'decimal': decimal, 'thousands': thousands}
+
+def read_csv_columns(path: str, header: int, usecols, csv_options: Dict[str, str], encoding: str) -> pd.DataFrame:
+    """Lee un CSV en una pasada cargando solo las columnas pedidas"""
+    decimal = csv_options.get('decimal', '.')
+    thousands = csv_options.get('thousands', '')
+    df = pd.read_csv(
+        path,
+        header=header,
+        sep=csv_options.get('delimiter', ','),
+        decimal=decimal,
+        usecols=usecols,
+        encoding=encoding,
+        skip_blank_lines=False  # la fila de encabezado se cuenta como en Excel
+    )
+    
+    # Separador de miles solo en columnas con forma de monto ('1.234,56'); '15.01.2025' o '1.5' no la tienen
+    amount_pattern = rf'^[+-]?\d{{1,3}}({re.escape(thousands)}\d{{3}})*({re.escape(decimal)}\d+)?$' if thousands else None
+    
+    for col in df.columns:
+        if pd.api.types.is_string_dtype(df[col].dtype):
+            values = df[col].dropna().astype(str).str.strip()
+            if len(values) == 0:
+                continue
+            # Fechas ISO en texto -> fechas, como las celdas de fecha de Excel
+            if values.str.match(ISO_DATE_PATTERN).all():
+                df[col] = pd.to_datetime(df[col])
+            elif amount_pattern and values.str.contains(thousands, regex=False).any() and values.str.match(amount_pattern).all():
+                df[col] = pd.to_numeric(
+                    df[col].astype(str).str.strip().str.replace(thousands, '', regex=False).str.replace(decimal, '.', regex=False),
+                    errors='coerce'
+                )
+    return df
+
+def read_input_table(path, filename: str, header: int, columns: Optional[List[str]] = None,
+                     csv_options: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """Lee un archivo Excel, CSV o Parquet; con columns solo carga esas columnas (nombres normalizados)"""
+    wanted = {normalize_header(col) for col in columns} if columns else None
+    usecols = (lambda col: normalize_header(col) in wanted) if wanted else None
+    name = filename.lower()
+    
+    if name.endswith('.csv'):
+        try:
+            return read_csv_columns(path, header, usecols, csv_options or {}, 'utf-8-sig')
+        except UnicodeDecodeError:
+            # Exportaciones de Windows en latin-1
+            return read_csv_columns(path, header, usecols, csv_options or {}, 'latin-1')
+    
+    if name.endswith('.parquet'):
+        if not PYARROW_AVAILABLE:
+            raise Exception("Leer Parquet requiere pyarrow")
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        names = [col for col in parquet_file.schema_arrow.names if usecols is None or usecols(col)]
+        # Solo se leen los bloques de las columnas seleccionadas
+        return parquet_file.read(columns=names).to_pandas()
+    
+    return pd.read_excel(path, header=header, usecols=usecols)
+
+def load_extracto_file(path: str, filename: Optional[str] = None,
+                       csv_options: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """Lee y filtra un archivo de extracto, agregando las columnas de control"""
+    # Leer archivo (fila 5 como header por defecto); se conservan todas las columnas para el reporte
+    filename = filename or path
+    with open_input_source(path, filename) as source:
+        df = read_with_detected_header(source, filename, 'extracto', 4, csv_options=csv_options)
+    
+    # Limpiar nombres de columnas
+    df.columns = df.columns.astype(str).str.strip()
+    
+    # Mapear columnas con nombres flexibles (patrones y similitud parcial)
+    column_mapping = {name: df.columns[index] for name, index in map_columns('extracto', df.columns).items()}
+    
+    # Verificar que se encontraron todas las columnas
+    missing_cols = [col for col in EXTRACTO_REQUIRED_PATTERNS.keys() if col not in column_mapping]
+    if missing_cols:
+        available_cols = list(df.columns)
+        raise Exception(f"Faltan columnas: {', '.join(missing_cols)}. Columnas disponibles: {', '.join(available_cols)}")
+    
+    # Renombrar columnas al estándar
+    df = df.rename(columns={v: k for k, v in column_mapping.items()})
+    
+    # Filtrar por descripción operación y etiquetar la familia de adquirente en la misma pasada
+    desc_col = 'DESCRIPCIÓN OPERACIÓN'
+    families = df[desc_col].astype(str).str.upper().str.extract(EXTRACTO_ACQUIRER_REGEX).notna()
+    keep = families.any(axis=1)
+    extracto_df = df[keep].copy()
+    extracto_df['ADQUIRENTE'] = families.columns.to_numpy()[families[keep].to_numpy().argmax(axis=1)]
+    
+    # Agregar columnas de control
+    extracto_df['ESTADO'] = 'Pendiente'
+    extracto_df['#REF'] = ''
+    
+    return extracto_df
+
 @app.post("/api/upload/extracto")
-async def upload_extracto(files: List[UploadFile] = File(...)):
-    global extracto_data
+async def upload_extracto(
+    files: List[UploadFile] = File(...),
+    delimiter: str = ',',
+    decimal: str = '.',
+    thousands: str = '',
+    profile: Optional[str] = None,
+    progress_id: Optional[str] = None,
+    currency_code: Optional[str] = None,
+    x_profile: Optional[str] = Header(None)
+):
+    workspace = get_workspace(currency_code)
+    csv_options = resolve_csv_options(delimiter, decimal, thousands)
+    profile_mode = resolve_profile_mode(profile, x_profile)
+    job = new_job('upload_extracto') if profile_mode else None
+    received = 0
     
-    for file in files:
-        if not file.filename.endswith(('.xlsx', '.xls')):
-            continue
+    with profile_job(job, profile_mode) as profiler:
+        for file in files:
+            if not file.filename.endswith(INPUT_EXTENSIONS):
+                continue
+                
+            # Guardar archivo temporalmente
+            temp_file = f"temp/{uuid.uuid4()}_{file.filename}"
+            received = await save_upload(file, temp_file, received, progress_id)
             
-        # Guardar archivo temporalmente
-        temp_file = f"temp/{uuid.uuid4()}_{file.filename}"
-        with open(temp_file, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+            try:
+                def ingest_extracto() -> Dict[str, Any]:
+                    df = compact_frame(load_extracto_file(temp_file, file.filename, csv_options))
+                    return prepare_loaded_frame(workspace, 'extracto', df)
+                
+                prepared = await run_ingest(profiler, ingest_extracto)
+                register_loaded_frame(workspace, 'extracto', prepared, None, progress_id)
+                rows = prepared['rows']
+                
+                increment_metric('conciliador_rows_ingested_total', {'file_type': 'extracto'}, rows)
+                publish_progress(progress_id, 'file_parsed', {'file': file.filename, 'file_type': 'extracto', 'rows': rows})
+                print(f"✅ Extracto cargado: {rows} filas")
+                    
+            except HTTPException:
+                raise
+            except Exception as e:
+                print(f"❌ Error procesando extracto: {e}")
+                publish_progress(progress_id, 'error', {'detail': str(e)}, done=True)
+                raise HTTPException(status_code=400, detail=f"Error: {e}")
+            finally:
+                os.remove(temp_file)
+    
+    extracto_data = workspace['extracto']
+    response = {"message": f"Extracto cargado: {len(extracto_data) if extracto_data is not None else 0} registros"}
+    publish_progress(progress_id, 'done', response, done=True)
+    if job:
+        response.update(job_links(job))
+    return response
+
+def detect_type_by_name(member_name: str) -> Optional[str]:
+    """Tipo de archivo según la carpeta o el nombre del miembro (None si no se reconoce)"""
+    parts = [part.upper() for part in re.split(r'[\\/]', member_name) if part]
+    folders, filename = parts[:-1], parts[-1]
+    for folder in reversed(folders):
+        if folder in ('EXTRACTO', 'AMEX', 'DINERS', 'MC', 'VISA', 'PAYU'):
+            return folder.lower()
+    
+    if filename.startswith('EXTRACTO') or filename.startswith('EECC'):
+        return 'extracto'
+    for token in ['AMEX', 'DINERS', 'PAYU', 'VISA']:
+        if token in filename:
+            return token.lower()
+    if re.search(r'(^|[^A-Z])(MC|MASTERCARD)([^A-Z]|$)', filename):
+        return 'mc'
+    return None
+
+def read_header_rows(path: str, filename: str, csv_options: Dict[str, str]) -> List[set]:
+    """Lee las 5 primeras filas normalizadas (posibles encabezados en fila 1 y fila 5)"""
+    name = filename.lower()
+    if name.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        names = {normalize_header(col) for col in pq.read_schema(path).names}
+        return [names] * 5
+    
+    rows = read_leading_rows(path, filename, csv_options, 5)
+    header_rows = [{normalize_header(value) for value in row if value != ''} for row in rows]
+    return header_rows + [set()] * (5 - len(header_rows))
+
+def detect_type_by_header(path: str, filename: str, csv_options: Dict[str, str]) -> Optional[str]:
+    """Tipo de archivo según la firma de columnas de su encabezado (None si no coincide)"""
+    header_rows = read_header_rows(path, filename, csv_options)
+    
+    extracto_header = header_rows[4]
+    if 'FECHA' in extracto_header and any('DESCRIPCION' in col for col in extracto_header) and \
+            any(col in extracto_header for col in ('MONTO', 'IMPORTE', 'VALOR')):
+        return 'extracto'
+    
+    # De la firma más específica a la más general (MC es un subconjunto de AMEX)
+    for file_type in ['payu', 'diners', 'visa', 'amex', 'mc']:
+        header = header_rows[4] if file_type == 'payu' else header_rows[0]
+        if {normalize_header(col) for col in BRAND_REQUIRED_COLUMNS[file_type]} <= header:
+            return file_type
+    return None
+
+def parse_bundle_member(member_name: str, path: str, csv_options: Dict[str, str]) -> Dict[str, Any]:
+    """Clasifica y lee un archivo de la carga agrupada; devuelve el DataFrame compacto o el motivo de descarte"""
+    filename = os.path.basename(member_name)
+    parsed = {'name': member_name, 'file_type': None, 'routed_by': None, 'df': None, 'file_info': None}
+    try:
+        file_type = detect_type_by_name(member_name)
+        parsed['routed_by'] = 'name'
+        if file_type is None:
+            file_type = detect_type_by_header(path, filename, csv_options)
+            parsed['routed_by'] = 'header'
+        if file_type is None:
+            parsed['error'] = 'Tipo de archivo no reconocido'
+            return parsed
+        parsed['file_type'] = file_type
         
+        if file_type == 'extracto':
+            parsed['df'] = compact_frame(load_extracto_file(path, filename, csv_options))
+        else:
+            df_final, file_info = load_brand_file(file_type, path, filename, csv_options)
+            if df_final is None:
+                parsed['error'] = 'Sin registros válidos o faltan columnas'
+                return parsed
+            parsed['df'] = compact_frame(df_final)
+            parsed['file_info'] = file_info
+    except Exception as e:
+        print(f"❌ Error procesando {member_name}: {e}")
+        parsed['error'] = str(e)
+    return parsed
+
+def extract_bundle_member(archive: zipfile.ZipFile, member: zipfile.ZipInfo) -> str:
+    """Descomprime un miembro del ZIP a temp/ con nombre único"""
+    temp_file = f"temp/{uuid.uuid4()}_{os.path.basename(member.filename)}"
+    with archive.open(member) as source, open(temp_file, "wb") as target:
+        shutil.copyfileobj(source, target)
+    return temp_file
+
+# Debe registrarse antes de /api/upload/{file_type}
+@app.post("/api/upload/bundle")
+async def upload_bundle(
+    files: List[UploadFile] = File(...),
+    currency_code: Optional[str] = None,
+    reconcile_now: bool = False,
+    delimiter: str = ',',
+    decimal: str = '.',
+    thousands: str = '',
+    profile: Optional[str] = None,
+    progress_id: Optional[str] = None,
+    x_profile: Optional[str] = Header(None)
+):
+    """Carga en una sola petición un ZIP (o varios archivos) con el extracto y los archivos de marcas"""
+    workspace = get_workspace(currency_code)
+    csv_options = resolve_csv_options(delimiter, decimal, thousands)
+    profile_mode = resolve_profile_mode(profile, x_profile)
+    job = new_job('upload_bundle') if profile_mode else None
+    
+    temp_files = []
+    archives = []
+    received = 0
+    
+    with profile_job(job, profile_mode) as profiler:
         try:
-            # Leer archivo Excel (fila 5 como header)
-            df = pd.read_excel(temp_file, header=4)
-            
-            # Limpiar nombres de columnas
-            df.columns = df.columns.astype(str).str.strip()
-            
-            # Mapear columnas con nombres flexibles
-            column_mapping = {}
-            required_patterns = {
-                'FECHA': ['FECHA'],
-                'DESCRIPCIÓN OPERACIÓN': ['DESCRIPCIÓN OPERACIÓN', 'DESCRIPCION OPERACION', 'DESCRIPCIÓN', 'DESCRIPCION'],
-                'MONTO': ['MONTO', 'IMPORTE', 'VALOR'],
-                'OPERACIÓN - NÚMERO': ['OPERACIÓN - NÚMERO', 'OPERACION - NUMERO', 'OPERACIÓN NÚMERO', 'OPERACION NUMERO', 'OP NUMERO', 'OP - NUMERO'],
-                'REFERENCIA2': ['REFERENCIA2', 'REFERENCIA 2', 'REF2', 'REFERENCIA']
-            }
-            
-            # Buscar columnas por patrones
-            for standard_name, patterns in required_patterns.items():
-                found = False
-                for pattern in patterns:
-                    for col in df.columns:
-                        if pattern.upper() in str(col).upper():
-                            column_mapping[standard_name] = col
-                            found = True
-                            break
-                    if found:
-                        break
+            # Guardar las partes recibidas; los ZIP se abren y sus miembros se descomprimen en paralelo
+            members = []
+            zip_members = []
+            for file in files:
+                temp_file = f"temp/{uuid.uuid4()}_{os.path.basename(file.filename)}"
+                received = await save_upload(file, temp_file, received, progress_id)
+                temp_files.append(temp_file)
                 
-                if not found:
-                    # Buscar por similitud parcial
-                    for col in df.columns:
-                        col_upper = str(col).upper()
-                        if any(word in col_upper for word in standard_name.split()):
-                            column_mapping[standard_name] = col
-                            found = True
-                            break
+                if file.filename.lower().endswith('.zip'):
+                    try:
+                        archive = zipfile.ZipFile(temp_file)
+                    except zipfile.BadZipFile:
+                        raise HTTPException(status_code=400, detail=f"ZIP inválido: {file.filename}")
+                    archives.append(archive)
+                    for member in archive.infolist():
+                        name = os.path.basename(member.filename)
+                        if member.is_dir() or name.startswith('.') or '__MACOSX' in member.filename:
+                            continue
+                        if name.endswith(INPUT_EXTENSIONS):
+                            zip_members.append((archive, member))
+                elif file.filename.endswith(INPUT_EXTENSIONS):
+                    members.append((file.filename, temp_file))
             
-            # Verificar que se encontraron todas las columnas
-            missing_cols = [col for col in required_patterns.keys() if col not in column_mapping]
-            if missing_cols:
-                available_cols = list(df.columns)
-                raise Exception(f"Faltan columnas: {', '.join(missing_cols)}. Columnas disponibles: {', '.join(available_cols)}")
-            
-            # Renombrar columnas al estándar
-            df = df.rename(columns={v: k for k, v in column_mapping.items()})
-            
-            # Filtrar por descripción operación
-            desc_col = 'DESCRIPCIÓN OPERACIÓN'
-            extracto_data = df[
-                df[desc_col].astype(str).str.upper().str.contains(
-                    'DINERS CLUB|CIA DE SERV|DE PROCESOS DE MEDIOS|DINERS CLUB PERU S|DE PAYU PERU S.A.C|COMPAN', 
-                    na=False, regex=True
-                )
-            ].copy()
+            # El límite de bytes también aplica al contenido descomprimido de los ZIP
+            extracted_bytes = sum(member.file_size for _, member in zip_members)
+            if MAX_UPLOAD_BYTES and extracted_bytes > MAX_UPLOAD_BYTES:
+                raise admission_error(413, f"Los ZIP descomprimidos ocupan {extracted_bytes / 2**20:.1f} MB "
+                                           f"(máximo {MAX_UPLOAD_BYTES / 2**20:.1f} MB)", 'bytes', progress_id)
             
-            # Agregar columnas de control
-            extracto_data['ESTADO'] = 'Pendiente'
-            extracto_data['#REF'] = ''
+            def parse_and_report(member_name: str, path: str) -> Dict[str, Any]:
+                parsed = parse_bundle_member(member_name, path, csv_options)
+                publish_progress(progress_id, 'file_parsed', {
+                    'file': member_name, 'file_type': parsed['file_type'],
+                    'rows': len(parsed['df']) if parsed['df'] is not None else 0
+                })
+                return parsed
             
-            print(f"✅ Extracto cargado: {len(extracto_data)} filas")
+            def extract_and_parse() -> List[Dict[str, Any]]:
+                # Con perfilado se procesa en el hilo perfilado, sin el pool, para que el perfil incluya la lectura
+                mapper = get_parser_pool().map if profiler is None else map
+                extracted = list(mapper(lambda item: extract_bundle_member(*item), zip_members))
+                temp_files.extend(extracted)
+                members.extend((member.filename, path) for (_, member), path in zip(zip_members, extracted))
                 
-        except Exception as e:
-            print(f"❌ Error procesando extracto: {e}")
-            raise HTTPException(status_code=400, detail=f"Error: {e}")
+                # Orden estable por nombre para que la carga sea determinista
+                members.sort(key=lambda item: item[0])
+                return list(mapper(lambda item: parse_and_report(*item), members))
+            
+            parsed_members = await run_ingest(profiler, extract_and_parse)
         finally:
-            os.remove(temp_file)
+            for archive in archives:
+                archive.close()
+            for temp_file in temp_files:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+        
+        # Validar el total de filas por tipo antes de registrar nada
+        bundle_rows = {}
+        for parsed in parsed_members:
+            if parsed['df'] is not None:
+                bundle_rows[parsed['file_type']] = bundle_rows.get(parsed['file_type'], 0) + len(parsed['df'])
+        for file_type, rows in bundle_rows.items():
+            check_row_limit(workspace, file_type, rows, progress_id)
+        
+        # Numerar y guardar en el threadpool, en el mismo orden que las cargas individuales
+        def prepare_members():
+            for parsed in parsed_members:
+                if parsed['df'] is not None:
+                    parsed['prepared'] = prepare_loaded_frame(workspace, parsed['file_type'], parsed.pop('df'))
+        
+        await run_ingest(profiler, prepare_members)
+        
+        # Registrar en el espacio de trabajo
+        loaded = []
+        skipped = []
+        for parsed in parsed_members:
+            if 'prepared' not in parsed:
+                skipped.append({'name': parsed['name'], 'file_type': parsed['file_type'], 'reason': parsed.get('error')})
+                continue
+            
+            file_type = parsed['file_type']
+            rows = parsed['prepared']['rows']
+            register_loaded_frame(workspace, file_type, parsed['prepared'], parsed['file_info'], progress_id)
+            increment_metric('conciliador_rows_ingested_total', {'file_type': file_type}, rows)
+            loaded.append({'name': parsed['name'], 'file_type': file_type, 'routed_by': parsed['routed_by'], 'rows': rows})
+    
+    print(f"📦 Carga agrupada: {len(loaded)} archivos cargados, {len(skipped)} descartados")
+    response = {"message": f"Carga agrupada: {len(loaded)} archivos", "loaded": loaded, "skipped": skipped}
+    if job:
+        response.update(job_links(job))
     
-    return {"message": f"Extracto cargado: {len(extracto_data) if extracto_data is not None else 0} registros"}
+    if reconcile_now:
+        # El mismo canal de progreso sigue con las fases de la conciliación
+        response['reconcile'] = await reconcile(profile=profile, progress_id=progress_id, currency_code=workspace['currency'],
+                                                x_profile=x_profile)
+    else:
+        publish_progress(progress_id, 'done', {'message': response['message']}, done=True)
+    return response
 
-@app.post("/api/upload/{file_type}")
-async def upload_files(file_type: str, files: List[UploadFile] = File(...)):
-    global amex_data, diners_data, mc_data, visa_data, payu_data, files_info
+def load_brand_file(file_type: str, path: str, filename: str,
+                    csv_options: Optional[Dict[str, str]] = None) -> Tuple[Optional[pd.DataFrame], Optional[Dict[str, Any]]]:
+    """Lee un archivo de tarjeta/adquirente y devuelve el DataFrame normalizado y la info del archivo"""
+    loaded = (None, None)
     
-    processed_count = 0
+    # Detectar formato mes-año en nombre de archivo
+    formato_mes_anio = detectar_formato_mes_anio(filename)
     
-    for file in files:
-        if not file.filename.endswith(('.xlsx', '.xls')):
-            continue
-            
-        temp_file = f"temp/{uuid.uuid4()}_{file.filename}"
-        with open(temp_file, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+    # Leer según tipo, solo las columnas requeridas (encabezado en fila 5 para PAYU y fila 1 para el resto por defecto)
+    with open_input_source(path, filename) as source:
+        if file_type in BRAND_REQUIRED_COLUMNS:
+            df = read_with_detected_header(source, filename, file_type, 4 if file_type == 'payu' else 0,
+                                           BRAND_REQUIRED_COLUMNS[file_type], csv_options)
+        else:
+            df = read_input_table(source, filename, 0, None, csv_options)
+    
+    # Limpiar nombres de columnas
+    df.columns = df.columns.astype(str).str.strip()
+    
+    # Procesar según tipo
+    if file_type == 'amex':
+        required_cols = BRAND_REQUIRED_COLUMNS['amex']
+        print(f"📄 AMEX - Archivo: {filename}")
+        print(f"📄 AMEX - Columnas disponibles: {list(df.columns)}")
+        print(f"📄 AMEX - Formato MA detectado: {formato_mes_anio}")
         
-        try:
-            # Detectar formato mes-año en nombre de archivo
-            formato_mes_anio = detectar_formato_mes_anio(file.filename)
+        # Mapear columnas a índices con los alias precalculados
+        mapping = map_columns('amex', df.columns)
+        header_map = [mapping[col] for col in required_cols if col in mapping]
+        missing_cols = [col for col in required_cols if col not in mapping]
+        
+        if not missing_cols:
+            # Mapear datos usando índices y filtrar por NETO_TOTAL != 0
+            raw_data = df.to_numpy(dtype=object)
+            neto_total_idx = header_map[required_cols.index('NETO_TOTAL')]
+            filtered_data = []
+            
+            for row in raw_data:
+                neto_total = convert_to_number(row[neto_total_idx])
+                if not pd.isna(neto_total) and neto_total != 0:
+                    # Mapear solo las columnas requeridas
+                    mapped_row = [row[idx] for idx in header_map]
+                    filtered_data.append(mapped_row)
             
-            # Leer según tipo
-            if file_type in ['extracto', 'payu']:
-                df = pd.read_excel(temp_file, header=4)
+            if filtered_data:
+                # Crear DataFrame con solo las columnas requeridas + ESTADO + #REF
+                estado_inicial = 'Pendiente MA' if formato_mes_anio['encontrado'] else 'Pendiente'
+                final_data = []
+                for row in filtered_data:
+                    final_row = row + [estado_inicial, '']
+                    final_data.append(final_row)
+                
+                # Crear DataFrame final con headers correctos
+                final_headers = required_cols + ['ESTADO', '#REF']
+                df_final = pd.DataFrame(final_data, columns=final_headers)
+                
+                # Guardar info del archivo
+                file_info = {
+                    'name': filename,
+                    'formato_mes_anio': formato_mes_anio['encontrado'],
+                    'mes': formato_mes_anio.get('mes'),
+                    'anio': formato_mes_anio.get('anio'),
+                    'rows': len(final_data)
+                }
+                loaded = (df_final, file_info)
+                print(f"✅ AMEX procesado: {len(final_data)} registros, Estado: {estado_inicial}")
             else:
-                df = pd.read_excel(temp_file, header=0)
+                print(f"⚠️ AMEX - No hay registros válidos en {filename}")
+        else:
+            print(f"❌ AMEX - Faltan columnas: {missing_cols}")
             
-            # Limpiar nombres de columnas
-            df.columns = df.columns.astype(str).str.strip()
+    elif file_type == 'diners':
+        required_cols = BRAND_REQUIRED_COLUMNS['diners']
+        print(f"📄 DINERS - Archivo: {filename}")
+        print(f"📄 DINERS - Columnas disponibles: {list(df.columns)}")
+        print(f"📄 DINERS - Formato MA detectado: {formato_mes_anio}")
+        
+        # Mapear columnas a índices con los alias precalculados (sin acentos)
+        mapping = map_columns('diners', df.columns)
+        header_map = [mapping[col] for col in required_cols if col in mapping]
+        missing_cols = [col for col in required_cols if col not in mapping]
+        
+        print(f"📄 DINERS - Header map: {header_map}")
+        print(f"📄 DINERS - Missing cols: {missing_cols}")
+        
+        if not missing_cols:
+            # Filtrar filas que tienen datos en al menos una columna requerida (como en el original)
+            raw_data = df.to_numpy(dtype=object)
+            filtered_data = []
             
-            # Procesar según tipo
-            if file_type == 'amex':
-                required_cols = ['CODIGO', 'NETO_TOTAL', 'FECHA_ABONO']
-                print(f"📄 AMEX - Archivo: {file.filename}")
-                print(f"📄 AMEX - Columnas disponibles: {list(df.columns)}")
-                print(f"📄 AMEX - Formato MA detectado: {formato_mes_anio}")
+            for row in raw_data:
+                if any(row[idx] is not None and row[idx] != '' and str(row[idx]).strip() != '' for idx in header_map):
+                    # Mapear solo las columnas requeridas
+                    mapped_row = [row[idx] for idx in header_map]
+                    filtered_data.append(mapped_row)
+            
+            if filtered_data:
+                # Crear DataFrame con solo las columnas requeridas + ESTADO + #REF
+                estado_inicial = 'Pendiente MA' if formato_mes_anio['encontrado'] else 'Pendiente'
+                final_data = []
+                for row in filtered_data:
+                    final_row = row + [estado_inicial, '']
+                    final_data.append(final_row)
                 
-                # Mapear columnas usando índices como en el original
-                header_map = []
-                missing_cols = []
-                for col in required_cols:
-                    found_index = -1
-                    for i, df_col in enumerate(df.columns):
-                        if col.upper() == str(df_col).upper():
-                            found_index = i
-                            break
-                    if found_index == -1:
-                        missing_cols.append(col)
-                    else:
-                        header_map.append(found_index)
+                # Crear DataFrame final con headers correctos
+                final_headers = required_cols + ['ESTADO', '#REF']
+                df_final = pd.DataFrame(final_data, columns=final_headers)
                 
-                if not missing_cols:
-                    # Mapear datos usando índices y filtrar por NETO_TOTAL != 0
-                    raw_data = df.values
-                    neto_total_idx = header_map[required_cols.index('NETO_TOTAL')]
-                    filtered_data = []
-                    
-                    for row in raw_data:
-                        neto_total = convert_to_number(row[neto_total_idx])
-                        if not pd.isna(neto_total) and neto_total != 0:
-                            # Mapear solo las columnas requeridas
-                            mapped_row = [row[idx] for idx in header_map]
-                            filtered_data.append(mapped_row)
-                    
-                    if filtered_data:
-                        # Crear DataFrame con solo las columnas requeridas + ESTADO + #REF
-                        estado_inicial = 'Pendiente MA' if formato_mes_anio['encontrado'] else 'Pendiente'
-                        final_data = []
-                        for row in filtered_data:
-                            final_row = row + [estado_inicial, '']
-                            final_data.append(final_row)
-                        
-                        # Crear DataFrame final con headers correctos
-                        final_headers = required_cols + ['ESTADO', '#REF']
-                        df_final = pd.DataFrame(final_data, columns=final_headers)
-                        amex_data.append(df_final)
-                        
-                        # Guardar info del archivo
-                        file_info = {
-                            'name': file.filename,
-                            'formato_mes_anio': formato_mes_anio['encontrado'],
-                            'mes': formato_mes_anio.get('mes'),
-                            'anio': formato_mes_anio.get('anio'),
-                            'rows': len(final_data)
-                        }
-                        files_info['amex'].extend([file_info] * len(final_data))
-                        processed_count += len(final_data)
-                        print(f"✅ AMEX procesado: {len(final_data)} registros, Estado: {estado_inicial}")
-                    else:
-                        print(f"⚠️ AMEX - No hay registros válidos en {file.filename}")
-                else:
-                    print(f"❌ AMEX - Faltan columnas: {missing_cols}")
-                    
-            elif file_type == 'diners':
-                required_cols = ['CÓDIGO DE COMERCIO', 'ORDEN DE PAGO', 'FECHA DE PAGO', 'IMPORTE NETO DE PAGO']
-                print(f"📄 DINERS - Archivo: {file.filename}")
-                print(f"📄 DINERS - Columnas disponibles: {list(df.columns)}")
-                print(f"📄 DINERS - Formato MA detectado: {formato_mes_anio}")
+                # Guardar info del archivo
+                file_info = {
+                    'name': filename,
+                    'formato_mes_anio': formato_mes_anio['encontrado'],
+                    'mes': formato_mes_anio.get('mes'),
+                    'anio': formato_mes_anio.get('anio'),
+                    'rows': len(final_data)
+                }
+                loaded = (df_final, file_info)
+                print(f"✅ DINERS procesado: {len(final_data)} registros, Estado: {estado_inicial}")
+            else:
+                print(f"⚠️ DINERS - No hay filas válidas en {filename}")
+        else:
+            print(f"❌ DINERS - Faltan columnas: {missing_cols}")
+            
+    elif file_type == 'mc':
+        required_cols = BRAND_REQUIRED_COLUMNS['mc']
+        # MC necesita CODCOM que se extrae del nombre del archivo
+        print(f"📄 MC - Archivo: {filename}")
+        print(f"📄 MC - Columnas disponibles: {list(df.columns)}")
+        print(f"📄 MC - Formato MA detectado: {formato_mes_anio}")
+        
+        # Mapear columnas a índices con los alias precalculados
+        mapping = map_columns('mc', df.columns)
+        header_map = [mapping[col] for col in required_cols if col in mapping]
+        missing_cols = [col for col in required_cols if col not in mapping]
+        
+        if not missing_cols:
+            # Extraer CODCOM del nombre del archivo
+            codcom = filename.split('-')[0] if '-' in filename else filename.split('.')[0]
+            
+            # Mapear datos usando índices y filtrar por NETO_TOTAL != 0
+            raw_data = df.to_numpy(dtype=object)
+            neto_total_idx = header_map[required_cols.index('NETO_TOTAL')]
+            fecha_abono_idx = header_map[required_cols.index('FECHA_ABONO')]
+            filtered_data = []
+            
+            for row in raw_data:
+                neto_total = convert_to_number(row[neto_total_idx])
+                if not pd.isna(neto_total) and neto_total != 0:
+                    # Crear fila con CODCOM + columnas requeridas
+                    mapped_row = [codcom, row[neto_total_idx], row[fecha_abono_idx]]
+                    filtered_data.append(mapped_row)
+            
+            if filtered_data:
+                # Crear DataFrame con CODCOM + columnas requeridas + ESTADO + #REF
+                estado_inicial = 'Pendiente MA' if formato_mes_anio['encontrado'] else 'Pendiente'
+                final_data = []
+                for row in filtered_data:
+                    final_row = row + [estado_inicial, '']
+                    final_data.append(final_row)
                 
-                # Mapear columnas usando índices como en el original (búsqueda flexible para acentos)
-                header_map = []
-                missing_cols = []
-                for col in required_cols:
-                    found_index = -1
-                    for i, df_col in enumerate(df.columns):
-                        # Normalizar ambos strings: quitar acentos, espacios y convertir a mayúsculas
-                        col_normalized = col.upper().replace('Ó', 'O').replace('É', 'E').replace('Í', 'I').replace('Á', 'A').replace('Ú', 'U').strip()
-                        df_col_normalized = str(df_col).upper().replace('Ó', 'O').replace('É', 'E').replace('Í', 'I').replace('Á', 'A').replace('Ú', 'U').strip()
-                        if col_normalized == df_col_normalized:
-                            found_index = i
-                            break
-                    if found_index == -1:
-                        missing_cols.append(col)
-                    else:
-                        header_map.append(found_index)
+                # Headers finales: CODCOM + columnas originales + ESTADO + #REF
+                final_headers = ['CODCOM'] + required_cols + ['ESTADO', '#REF']
+                df_final = pd.DataFrame(final_data, columns=final_headers)
                 
-                print(f"📄 DINERS - Header map: {header_map}")
-                print(f"📄 DINERS - Missing cols: {missing_cols}")
+                # Guardar info del archivo
+                file_info = {
+                    'name': filename,
+                    'formato_mes_anio': formato_mes_anio['encontrado'],
+                    'mes': formato_mes_anio.get('mes'),
+                    'anio': formato_mes_anio.get('anio'),
+                    'rows': len(final_data)
+                }
+                loaded = (df_final, file_info)
+                print(f"✅ MC procesado: {len(final_data)} registros, Estado: {estado_inicial}")
+            else:
+                print(f"⚠️ MC - No hay registros válidos en {filename}")
+        else:
+            print(f"❌ MC - Faltan columnas: {missing_cols}")
+            
+    elif file_type == 'visa':
+        required_cols = BRAND_REQUIRED_COLUMNS['visa']
+        print(f"📄 VISA - Archivo: {filename}")
+        print(f"📄 VISA - Columnas disponibles: {list(df.columns)}")
+        print(f"📄 VISA - Formato MA detectado: {formato_mes_anio}")
+        
+        # Mapear columnas a índices con los alias precalculados
+        mapping = map_columns('visa', df.columns)
+        header_map = [mapping[col] for col in required_cols if col in mapping]
+        missing_cols = [col for col in required_cols if col not in mapping]
+        
+        if not missing_cols:
+            # Mapear datos usando índices y filtrar por IMPORTE NETO != 0
+            raw_data = df.to_numpy(dtype=object)
+            importe_neto_idx = header_map[required_cols.index('IMPORTE NETO')]
+            filtered_data = []
+            
+            for row in raw_data:
+                importe_neto = convert_to_number(row[importe_neto_idx])
+                if not pd.isna(importe_neto) and importe_neto != 0:
+                    # Mapear solo las columnas requeridas
+                    mapped_row = [row[idx] for idx in header_map]
+                    filtered_data.append(mapped_row)
+            
+            if filtered_data:
+                # Crear DataFrame con solo las columnas requeridas + ESTADO + #REF
+                estado_inicial = 'Pendiente MA' if formato_mes_anio['encontrado'] else 'Pendiente'
+                final_data = []
+                for row in filtered_data:
+                    final_row = row + [estado_inicial, '']
+                    final_data.append(final_row)
                 
-                if not missing_cols:
-                    # Filtrar filas que tienen datos en al menos una columna requerida (como en el original)
-                    raw_data = df.values
-                    filtered_data = []
-                    
-                    for row in raw_data:
-                        if any(row[idx] is not None and row[idx] != '' and str(row[idx]).strip() != '' for idx in header_map):
-                            # Mapear solo las columnas requeridas
-                            mapped_row = [row[idx] for idx in header_map]
-                            filtered_data.append(mapped_row)
-                    
-                    if filtered_data:
-                        # Crear DataFrame con solo las columnas requeridas + ESTADO + #REF
-                        estado_inicial = 'Pendiente MA' if formato_mes_anio['encontrado'] else 'Pendiente'
-                        final_data = []
-                        for row in filtered_data:
-                            final_row = row + [estado_inicial, '']
-                            final_data.append(final_row)
-                        
-                        # Crear DataFrame final con headers correctos
-                        final_headers = required_cols + ['ESTADO', '#REF']
-                        df_final = pd.DataFrame(final_data, columns=final_headers)
-                        diners_data.append(df_final)
-                        
-                        # Guardar info del archivo
-                        file_info = {
-                            'name': file.filename,
-                            'formato_mes_anio': formato_mes_anio['encontrado'],
-                            'mes': formato_mes_anio.get('mes'),
-                            'anio': formato_mes_anio.get('anio'),
-                            'rows': len(final_data)
-                        }
-                        files_info['diners'].extend([file_info] * len(final_data))
-                        processed_count += len(final_data)
-                        print(f"✅ DINERS procesado: {len(final_data)} registros, Estado: {estado_inicial}")
-                    else:
-                        print(f"⚠️ DINERS - No hay filas válidas en {file.filename}")
-                else:
-                    print(f"❌ DINERS - Faltan columnas: {missing_cols}")
-                    
-            elif file_type == 'mc':
-                required_cols = ['NETO_TOTAL', 'FECHA_ABONO']
-                # MC necesita CODCOM que se extrae del nombre del archivo
-                print(f"📄 MC - Archivo: {file.filename}")
-                print(f"📄 MC - Columnas disponibles: {list(df.columns)}")
-                print(f"📄 MC - Formato MA detectado: {formato_mes_anio}")
+                # Crear DataFrame final con headers correctos
+                final_headers = required_cols + ['ESTADO', '#REF']
+                df_final = pd.DataFrame(final_data, columns=final_headers)
                 
-                # Mapear columnas usando índices como en el original
-                header_map = []
-                missing_cols = []
-                for col in required_cols:
-                    found_index = -1
-                    for i, df_col in enumerate(df.columns):
-                        if col.upper() == str(df_col).upper():
-                            found_index = i
-                            break
-                    if found_index == -1:
-                        missing_cols.append(col)
-                    else:
-                        header_map.append(found_index)
+                # Guardar info del archivo
+                file_info = {
+                    'name': filename,
+                    'formato_mes_anio': formato_mes_anio['encontrado'],
+                    'mes': formato_mes_anio.get('mes'),
+                    'anio': formato_mes_anio.get('anio'),
+                    'rows': len(final_data)
+                }
+                loaded = (df_final, file_info)
+                print(f"✅ VISA procesado: {len(final_data)} registros, Estado: {estado_inicial}")
+            else:
+                print(f"⚠️ VISA - No hay registros válidos en {filename}")
+        else:
+            print(f"❌ VISA - Faltan columnas: {missing_cols}")
+            
+    elif file_type == 'payu':
+        required_cols = BRAND_REQUIRED_COLUMNS['payu']
+        print(f"📄 PAYU - Archivo: {filename}")
+        print(f"📄 PAYU - Columnas disponibles: {list(df.columns)}")
+        print(f"📄 PAYU - Formato MA detectado: {formato_mes_anio}")
+        
+        # Mapear columnas a índices con los alias precalculados
+        mapping = map_columns('payu', df.columns)
+        header_map = [mapping[col] for col in required_cols if col in mapping]
+        missing_cols = [col for col in required_cols if col not in mapping]
+        
+        if not missing_cols:
+            # Filtrar datos usando índices
+            raw_data = df.to_numpy(dtype=object)
+            descripcion_idx = header_map[required_cols.index('DESCRIPCION')]
+            debitos_idx = header_map[required_cols.index('DEBITOS')]
+            documento_idx = header_map[required_cols.index('DOCUMENTO')]
+            
+            # Filtrar solo PAYMENT_ORDER con débitos válidos
+            filtered_data = []
+            seen_combinations = set()
+            
+            for row in raw_data:
+                descripcion = str(row[descripcion_idx]).upper() if row[descripcion_idx] else ''
+                debitos = convert_to_number(row[debitos_idx])
+                documento = str(row[documento_idx]) if row[documento_idx] else ''
                 
-                if not missing_cols:
-                    # Extraer CODCOM del nombre del archivo
-                    codcom = file.filename.split('-')[0] if '-' in file.filename else file.filename.split('.')[0]
-                    
-                    # Mapear datos usando índices y filtrar por NETO_TOTAL != 0
-                    raw_data = df.values
-                    neto_total_idx = header_map[required_cols.index('NETO_TOTAL')]
-                    fecha_abono_idx = header_map[required_cols.index('FECHA_ABONO')]
-                    filtered_data = []
-                    
-                    for row in raw_data:
-                        neto_total = convert_to_number(row[neto_total_idx])
-                        if not pd.isna(neto_total) and neto_total != 0:
-                            # Crear fila con CODCOM + columnas requeridas
-                            mapped_row = [codcom, row[neto_total_idx], row[fecha_abono_idx]]
-                            filtered_data.append(mapped_row)
-                    
-                    if filtered_data:
-                        # Crear DataFrame con CODCOM + columnas requeridas + ESTADO + #REF
-                        estado_inicial = 'Pendiente MA' if formato_mes_anio['encontrado'] else 'Pendiente'
-                        final_data = []
-                        for row in filtered_data:
-                            final_row = row + [estado_inicial, '']
-                            final_data.append(final_row)
-                        
-                        # Headers finales: CODCOM + columnas originales + ESTADO + #REF
-                        final_headers = ['CODCOM'] + required_cols + ['ESTADO', '#REF']
-                        df_final = pd.DataFrame(final_data, columns=final_headers)
-                        mc_data.append(df_final)
-                        
-                        # Guardar info del archivo
-                        file_info = {
-                            'name': file.filename,
-                            'formato_mes_anio': formato_mes_anio['encontrado'],
-                            'mes': formato_mes_anio.get('mes'),
-                            'anio': formato_mes_anio.get('anio'),
-                            'rows': len(final_data)
-                        }
-                        files_info['mc'].extend([file_info] * len(final_data))
-                        processed_count += len(final_data)
-                        print(f"✅ MC procesado: {len(final_data)} registros, Estado: {estado_inicial}")
-                    else:
-                        print(f"⚠️ MC - No hay registros válidos en {file.filename}")
-                else:
-                    print(f"❌ MC - Faltan columnas: {missing_cols}")
+                if (descripcion == 'PAYMENT_ORDER [PAYMENT_ORDER]' and 
+                    not pd.isna(debitos) and debitos != 0):
                     
-            elif file_type == 'visa':
-                required_cols = ['COMERCIO/CADENA', 'FECHA PROCESO', 'IMPORTE NETO']
-                print(f"📄 VISA - Archivo: {file.filename}")
-                print(f"📄 VISA - Columnas disponibles: {list(df.columns)}")
-                print(f"📄 VISA - Formato MA detectado: {formato_mes_anio}")
+                    # Eliminar duplicados por DOCUMENTO + DEBITOS
+                    combination_key = f"{documento}_{debitos:.2f}"
+                    if combination_key not in seen_combinations:
+                        seen_combinations.add(combination_key)
+                        # Mapear solo las columnas requeridas
+                        mapped_row = [row[idx] for idx in header_map]
+                        filtered_data.append(mapped_row)
+            
+            if filtered_data:
+                # Crear DataFrame con solo las columnas requeridas + ESTADO + #REF
+                estado_inicial = 'Pendiente MA' if formato_mes_anio['encontrado'] else 'Pendiente'
+                final_data = []
+                for row in filtered_data:
+                    final_row = row + [estado_inicial, '']
+                    final_data.append(final_row)
                 
-                # Mapear columnas usando índices como en el original
-                header_map = []
-                missing_cols = []
-                for col in required_cols:
-                    found_index = -1
-                    for i, df_col in enumerate(df.columns):
-                        if col.upper() == str(df_col).upper():
-                            found_index = i
-                            break
-                    if found_index == -1:
-                        missing_cols.append(col)
-                    else:
-                        header_map.append(found_index)
+                # Crear DataFrame final con headers correctos
+                final_headers = required_cols + ['ESTADO', '#REF']
+                df_final = pd.DataFrame(final_data, columns=final_headers)
                 
-                if not missing_cols:
-                    # Mapear datos usando índices y filtrar por IMPORTE NETO != 0
-                    raw_data = df.values
-                    importe_neto_idx = header_map[required_cols.index('IMPORTE NETO')]
-                    filtered_data = []
-                    
-                    for row in raw_data:
-                        importe_neto = convert_to_number(row[importe_neto_idx])
-                        if not pd.isna(importe_neto) and importe_neto != 0:
-                            # Mapear solo las columnas requeridas
-                            mapped_row = [row[idx] for idx in header_map]
-                            filtered_data.append(mapped_row)
-                    
-                    if filtered_data:
-                        # Crear DataFrame con solo las columnas requeridas + ESTADO + #REF
-                        estado_inicial = 'Pendiente MA' if formato_mes_anio['encontrado'] else 'Pendiente'
-                        final_data = []
-                        for row in filtered_data:
-                            final_row = row + [estado_inicial, '']
-                            final_data.append(final_row)
-                        
-                        # Crear DataFrame final con headers correctos
-                        final_headers = required_cols + ['ESTADO', '#REF']
-                        df_final = pd.DataFrame(final_data, columns=final_headers)
-                        visa_data.append(df_final)
-                        
-                        # Guardar info del archivo
-                        file_info = {
-                            'name': file.filename,
-                            'formato_mes_anio': formato_mes_anio['encontrado'],
-                            'mes': formato_mes_anio.get('mes'),
-                            'anio': formato_mes_anio.get('anio'),
-                            'rows': len(final_data)
-                        }
-                        files_info['visa'].extend([file_info] * len(final_data))
-                        processed_count += len(final_data)
-                        print(f"✅ VISA procesado: {len(final_data)} registros, Estado: {estado_inicial}")
-                    else:
-                        print(f"⚠️ VISA - No hay registros válidos en {file.filename}")
-                else:
-                    print(f"❌ VISA - Faltan columnas: {missing_cols}")
-                    
-            elif file_type == 'payu':
-                required_cols = ['FECHA', 'DOCUMENTO', 'DESCRIPCION', 'CREDITOS', 'DEBITOS', 'NUEVO SALDO', 'SALDO CONGELADO ANTERIOR', 'SALDO RESERVA', 'SALDO DISPONIBLE']
-                print(f"📄 PAYU - Archivo: {file.filename}")
-                print(f"📄 PAYU - Columnas disponibles: {list(df.columns)}")
-                print(f"📄 PAYU - Formato MA detectado: {formato_mes_anio}")
+                # Guardar info del archivo
+                file_info = {
+                    'name': filename,
+                    'formato_mes_anio': formato_mes_anio['encontrado'],
+                    'mes': formato_mes_anio.get('mes'),
+                    'anio': formato_mes_anio.get('anio'),
+                    'rows': len(final_data)
+                }
+                loaded = (df_final, file_info)
+                print(f"✅ PAYU procesado: {len(final_data)} registros, Estado: {estado_inicial}")
+            else:
+                print(f"⚠️ PAYU - No hay registros PAYMENT_ORDER válidos en {filename}")
+        else:
+            print(f"❌ PAYU - Faltan columnas: {missing_cols}")
+    
+    return loaded
+
+@app.post("/api/upload/{file_type}")
+async def upload_files(
+    file_type: str,
+    files: List[UploadFile] = File(...),
+    delimiter: str = ',',
+    decimal: str = '.',
+    thousands: str = '',
+    profile: Optional[str] = None,
+    progress_id: Optional[str] = None,
+    currency_code: Optional[str] = None,
+    x_profile: Optional[str] = Header(None)
+):
+    processed_count = 0
+    
+    if file_type not in BRAND_TYPES:
+        raise HTTPException(status_code=400, detail=f"Tipo de archivo inválido: {file_type}")
+    workspace = get_workspace(currency_code)
+    csv_options = resolve_csv_options(delimiter, decimal, thousands)
+    profile_mode = resolve_profile_mode(profile, x_profile)
+    job = new_job(f'upload_{file_type}') if profile_mode else None
+    received = 0
+    
+    with profile_job(job, profile_mode) as profiler:
+        for file in files:
+            if not file.filename.endswith(INPUT_EXTENSIONS):
+                continue
                 
-                # Mapear columnas usando índices como en el original
-                header_map = []
-                missing_cols = []
-                for col in required_cols:
-                    found_index = -1
-                    for i, df_col in enumerate(df.columns):
-                        if col.upper() == str(df_col).upper():
-                            found_index = i
-                            break
-                    if found_index == -1:
-                        missing_cols.append(col)
-                    else:
-                        header_map.append(found_index)
+            temp_file = f"temp/{uuid.uuid4()}_{file.filename}"
+            received = await save_upload(file, temp_file, received, progress_id)
+            
+            try:
+                def ingest_brand() -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+                    df_final, file_info = load_brand_file(file_type, temp_file, file.filename, csv_options)
+                    if df_final is None:
+                        return None, file_info
+                    return prepare_loaded_frame(workspace, file_type, compact_frame(df_final)), file_info
                 
-                if not missing_cols:
-                    # Filtrar datos usando índices
-                    raw_data = df.values
-                    descripcion_idx = header_map[required_cols.index('DESCRIPCION')]
-                    debitos_idx = header_map[required_cols.index('DEBITOS')]
-                    documento_idx = header_map[required_cols.index('DOCUMENTO')]
-                    
-                    # Filtrar solo PAYMENT_ORDER con débitos válidos
-                    filtered_data = []
-                    seen_combinations = set()
-                    
-                    for row in raw_data:
-                        descripcion = str(row[descripcion_idx]).upper() if row[descripcion_idx] else ''
-                        debitos = convert_to_number(row[debitos_idx])
-                        documento = str(row[documento_idx]) if row[documento_idx] else ''
-                        
-                        if (descripcion == 'PAYMENT_ORDER [PAYMENT_ORDER]' and 
-                            not pd.isna(debitos) and debitos != 0):
-                            
-                            # Eliminar duplicados por DOCUMENTO + DEBITOS
-                            combination_key = f"{documento}_{debitos:.2f}"
-                            if combination_key not in seen_combinations:
-                                seen_combinations.add(combination_key)
-                                # Mapear solo las columnas requeridas
-                                mapped_row = [row[idx] for idx in header_map]
-                                filtered_data.append(mapped_row)
-                    
-                    if filtered_data:
-                        # Crear DataFrame con solo las columnas requeridas + ESTADO + #REF
-                        estado_inicial = 'Pendiente MA' if formato_mes_anio['encontrado'] else 'Pendiente'
-                        final_data = []
-                        for row in filtered_data:
-                            final_row = row + [estado_inicial, '']
-                            final_data.append(final_row)
-                        
-                        # Crear DataFrame final con headers correctos
-                        final_headers = required_cols + ['ESTADO', '#REF']
-                        df_final = pd.DataFrame(final_data, columns=final_headers)
-                        payu_data.append(df_final)
+                prepared, file_info = await run_ingest(profiler, ingest_brand)
+                
+                if prepared is not None:
+                    register_loaded_frame(workspace, file_type, prepared, file_info, progress_id)
+                    processed_count += prepared['rows']
+                publish_progress(progress_id, 'file_parsed', {
+                    'file': file.filename, 'file_type': file_type, 'rows': prepared['rows'] if prepared is not None else 0
+                })
                         
-                        # Guardar info del archivo
-                        file_info = {
-                            'name': file.filename,
-                            'formato_mes_anio': formato_mes_anio['encontrado'],
-                            'mes': formato_mes_anio.get('mes'),
-                            'anio': formato_mes_anio.get('anio'),
-                            'rows': len(final_data)
-                        }
-                        files_info['payu'].extend([file_info] * len(final_data))
-                        processed_count += len(final_data)
-                        print(f"✅ PAYU procesado: {len(final_data)} registros, Estado: {estado_inicial}")
-                    else:
-                        print(f"⚠️ PAYU - No hay registros PAYMENT_ORDER válidos en {file.filename}")
-                else:
-                    print(f"❌ PAYU - Faltan columnas: {missing_cols}")
-                    
-        except Exception as e:
-            print(f"❌ Error procesando {file_type}: {e}")
-            raise HTTPException(status_code=400, detail=f"Error procesando {file_type}: {e}")
-        finally:
-            os.remove(temp_file)
+            except HTTPException:
+                raise
+            except Exception as e:
+                print(f"❌ Error procesando {file_type}: {e}")
+                publish_progress(progress_id, 'error', {'detail': str(e)}, done=True)
+                raise HTTPException(status_code=400, detail=f"Error procesando {file_type}: {e}")
+            finally:
+                os.remove(temp_file)
     
-    return {"message": f"{file_type.upper()} cargado: {processed_count} registros"}
+    increment_metric('conciliador_rows_ingested_total', {'file_type': file_type}, processed_count)
+    response = {"message": f"{file_type.upper()} cargado: {processed_count} registros"}
+    publish_progress(progress_id, 'done', response, done=True)
+    if job:
+        response.update(job_links(job))
+    return response
+
+def admission_error(status_code: int, detail: str, reason: str, progress_id: Optional[str] = None) -> HTTPException:
+    """Rechazo del control de admisión: 413 si nunca cabe, 429 con Retry-After si es cuestión de esperar"""
+    print(f"⛔ {detail}")
+    increment_metric('conciliador_admission_rejections_total', {'reason': reason})
+    publish_progress(progress_id, 'error', {'detail': detail}, done=True)
+    headers = {'Retry-After': str(RETRY_AFTER_SECONDS)} if status_code == 429 else None
+    return HTTPException(status_code=status_code, detail=detail, headers=headers)
+
+async def save_upload(file: UploadFile, path: str, received: int = 0, progress_id: Optional[str] = None) -> int:
+    """Copia un archivo recibido a disco por bloques sin pasar por memoria; devuelve los bytes acumulados del request"""
+    def too_large(total: int) -> HTTPException:
+        return admission_error(413, f"La carga supera el máximo de {MAX_UPLOAD_BYTES / 2**20:.1f} MB por request "
+                                    f"({file.filename}: {total / 2**20:.1f} MB acumulados)", 'bytes', progress_id)
+    
+    if MAX_UPLOAD_BYTES and file.size is not None and received + file.size > MAX_UPLOAD_BYTES:
+        raise too_large(received + file.size)
+    
+    with open(path, "wb") as buffer:
+        while block := await file.read(UPLOAD_CHUNK_SIZE):
+            received += len(block)
+            if MAX_UPLOAD_BYTES and received > MAX_UPLOAD_BYTES:
+                buffer.close()
+                os.remove(path)
+                raise too_large(received)
+            buffer.write(block)
+    return received
+
+def check_row_limit(workspace: Dict[str, Any], file_type: str, rows: int, progress_id: Optional[str] = None):
+    """Rechaza una carga que dejaría más de MAX_ROWS_PER_TYPE filas de su tipo en el espacio de trabajo"""
+    if not MAX_ROWS_PER_TYPE:
+        return
+    # El extracto reemplaza al anterior; las marcas se acumulan
+    loaded = 0 if file_type == 'extracto' else sum(len(df) for df in workspace['brands'][file_type])
+    if loaded + rows > MAX_ROWS_PER_TYPE:
+        raise admission_error(413, f"{file_type.upper()}: {loaded + rows} filas superan el máximo de "
+                                   f"{MAX_ROWS_PER_TYPE} por tipo de archivo", 'rows', progress_id)
+
+def prepare_loaded_frame(workspace: Dict[str, Any], file_type: str, df: pd.DataFrame) -> Dict[str, Any]:
+    """Numera y guarda en Arrow un DataFrame compacto ya leído; corre en el threadpool junto con la lectura"""
+    prepared = {'rows': len(df), 'months': None}
+    if file_type == 'extracto':
+        prepared['months'] = set(frame_months(df, 'extracto'))
+    else:
+        # Identificadores de fila únicos en la marca: cada lote continúa la numeración de los anteriores
+        with row_labels_lock:
+            start = workspace['next_label'][file_type]
+            workspace['next_label'][file_type] = start + len(df)
+        df = df.set_axis(pd.RangeIndex(start, start + len(df)))
+    prepared['stored'] = store_frame(df)
+    return prepared
+
+def register_loaded_frame(workspace: Dict[str, Any], file_type: str, prepared: Dict[str, Any],
+                          file_info: Optional[Dict[str, Any]], progress_id: Optional[str] = None):
+    """Agrega un lote ya guardado al espacio de trabajo (el extracto reemplaza al anterior); si excede el límite lo descarta"""
+    try:
+        check_row_limit(workspace, file_type, prepared['rows'], progress_id)
+    except HTTPException:
+        release_frame(prepared['stored'])
+        raise
+    
+    if file_type == 'extracto':
+        if workspace['running']:
+            # Un job en curso puede estar por leer el archivo anterior
+            workspace['stale_frames'].append(workspace['extracto'])
+        else:
+            release_frame(workspace['extracto'])
+        workspace['extracto'] = prepared['stored']
+        workspace['extracto_months'] = prepared['months']
+        if RECONCILE_WORKERS == 'process':
+            workspace_executor(workspace)
+        return
+    
+    files_info = workspace['files_info']
+    workspace['brands'][file_type].append(prepared['stored'])
+    files_info[file_type].append({**file_info, 'file_id': len(files_info[file_type])})
+
+def chunked_upload_status(upload: Dict[str, Any]) -> Dict[str, Any]:
+    """Estado público de una carga por bloques (para reanudarla)"""
+    received = sorted(upload['received'])
+    return {
+        'upload_id': upload['id'],
+        'file_type': upload['file_type'],
+        'filename': upload['filename'],
+        'size': upload['size'],
+        'chunk_size': upload['chunk_size'],
+        'chunks': upload['chunks'],
+        'received': received,
+        'missing': [i for i in range(upload['chunks']) if i not in upload['received']]
+    }
+
+def get_chunked_upload(upload_id: str) -> Dict[str, Any]:
+    upload = chunked_uploads.get(upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail=f"Carga no encontrada: {upload_id}")
+    return upload
+
+def discard_chunked_upload(upload_id: str):
+    """Elimina una carga por bloques y su archivo parcial"""
+    upload = chunked_uploads.pop(upload_id, None)
+    if upload and os.path.exists(upload['path']):
+        os.remove(upload['path'])
+
+def expire_chunked_uploads():
+    """Descarta las cargas sin confirmar más antiguas que UPLOAD_TTL_HOURS"""
+    limit = time.time() - UPLOAD_TTL_HOURS * 3600
+    for upload_id in [key for key, upload in chunked_uploads.items() if upload['updated'] < limit]:
+        print(f"🗑️ Carga por bloques expirada: {upload_id}")
+        discard_chunked_upload(upload_id)
+
+@app.post("/api/uploads")
+async def init_chunked_upload(data: dict):
+    """Inicia una carga por bloques: {file_type, filename, size}"""
+    expire_chunked_uploads()
+    
+    file_type = data.get('file_type')
+    filename = os.path.basename(str(data.get('filename', '')))
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="size inválido")
+    
+    if file_type not in ('extracto',) + BRAND_TYPES:
+        raise HTTPException(status_code=400, detail=f"Tipo de archivo inválido: {file_type}")
+    workspace = get_workspace(data.get('currency_code'))
+    if not filename.endswith(INPUT_EXTENSIONS):
+        raise HTTPException(status_code=400, detail=f"Formato no soportado: {filename}")
+    if size < 0:
+        raise HTTPException(status_code=400, detail="size inválido")
+    if MAX_UPLOAD_BYTES and size > MAX_UPLOAD_BYTES:
+        raise admission_error(413, f"{filename}: {size / 2**20:.1f} MB superan el máximo de "
+                                   f"{MAX_UPLOAD_BYTES / 2**20:.1f} MB por carga", 'bytes')
+    
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    upload_id = uuid.uuid4().hex[:12]
+    path = os.path.join(UPLOAD_DIR, f"{upload_id}.part")
+    # Reservar el tamaño final: cada bloque se escribe en su posición
+    with open(path, "wb") as f:
+        f.truncate(size)
+    
+    upload = {
+        'id': upload_id,
+        'file_type': file_type,
+        'filename': filename,
+        'size': size,
+        'chunk_size': UPLOAD_CHUNK_SIZE,
+        'chunks': max(1, math.ceil(size / UPLOAD_CHUNK_SIZE)),
+        'received': {},
+        'path': path,
+        'currency': workspace['currency'],
+        'updated': time.time()
+    }
+    chunked_uploads[upload_id] = upload
+    print(f"📤 Carga por bloques {upload_id}: {filename} ({size} bytes, {upload['chunks']} bloques)")
+    return chunked_upload_status(upload)
+
+@app.get("/api/uploads/{upload_id}")
+async def get_chunked_upload_status(upload_id: str):
+    return chunked_upload_status(get_chunked_upload(upload_id))
+
+@app.put("/api/uploads/{upload_id}/chunks/{index}")
+async def upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    x_chunk_sha256: Optional[str] = Header(None)
+):
+    """Escribe un bloque directamente en su posición del archivo parcial, verificando su SHA-256"""
+    upload = get_chunked_upload(upload_id)
+    if not 0 <= index < upload['chunks']:
+        raise HTTPException(status_code=400, detail=f"Bloque fuera de rango: {index}")
+    
+    offset = index * upload['chunk_size']
+    expected_size = min(upload['chunk_size'], upload['size'] - offset)
+    digest = hashlib.sha256()
+    written = 0
+    
+    # Un bloque reenviado invalida el anterior hasta verificarse
+    upload['received'].pop(index, None)
+    with open(upload['path'], "r+b") as f:
+        f.seek(offset)
+        async for block in request.stream():
+            written += len(block)
+            if written > expected_size:
+                raise HTTPException(status_code=400, detail=f"Bloque {index} excede {expected_size} bytes")
+            digest.update(block)
+            f.write(block)
+    
+    if written != expected_size:
+        raise HTTPException(status_code=400, detail=f"Bloque {index} incompleto: {written}/{expected_size} bytes")
+    checksum = digest.hexdigest()
+    if x_chunk_sha256 and x_chunk_sha256.lower() != checksum:
+        raise HTTPException(status_code=400, detail=f"Checksum inválido en bloque {index}")
+    
+    upload['received'][index] = checksum
+    upload['updated'] = time.time()
+    return {'index': index, 'sha256': checksum, 'received': len(upload['received']), 'chunks': upload['chunks']}
+
+@app.post("/api/uploads/{upload_id}/commit")
+async def commit_chunked_upload(
+    upload_id: str,
+    delimiter: str = ',',
+    decimal: str = '.',
+    thousands: str = '',
+    progress_id: Optional[str] = None
+):
+    """Confirma una carga completa y la procesa con el lector de su tipo de archivo"""
+    upload = get_chunked_upload(upload_id)
+    status = chunked_upload_status(upload)
+    if status['missing']:
+        raise HTTPException(status_code=409, detail={'message': 'Faltan bloques', 'missing': status['missing']})
+    csv_options = resolve_csv_options(delimiter, decimal, thousands)
+    
+    file_type = upload['file_type']
+    filename = upload['filename']
+    workspace = get_workspace(upload['currency'])
+    def parse_upload() -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        if file_type == 'extracto':
+            df_final, file_info = load_extracto_file(upload['path'], filename, csv_options), None
+        else:
+            df_final, file_info = load_brand_file(file_type, upload['path'], filename, csv_options)
+            if df_final is None:
+                raise Exception(f"Sin registros válidos o faltan columnas en {filename}")
+        return prepare_loaded_frame(workspace, file_type, compact_frame(df_final)), file_info
+    
+    try:
+        prepared, file_info = await run_in_threadpool(parse_upload)
+    except Exception as e:
+        print(f"❌ Error procesando {file_type}: {e}")
+        publish_progress(progress_id, 'error', {'detail': str(e)}, done=True)
+        raise HTTPException(status_code=400, detail=f"Error procesando {file_type}: {e}")
+    finally:
+        discard_chunked_upload(upload_id)
+    
+    register_loaded_frame(workspace, file_type, prepared, file_info, progress_id)
+    rows = prepared['rows']
+    increment_metric('conciliador_rows_ingested_total', {'file_type': file_type}, rows)
+    publish_progress(progress_id, 'file_parsed', {'file': filename, 'file_type': file_type, 'rows': rows})
+    
+    if file_type == 'extracto':
+        print(f"✅ Extracto cargado: {len(df)} filas")
+        response = {"message": f"Extracto cargado: {len(df)} registros"}
+    else:
+        response = {"message": f"{file_type.upper()} cargado: {len(df)} registros"}
+    publish_progress(progress_id, 'done', response, done=True)
+    return response
+
+@app.delete("/api/uploads/{upload_id}")
+async def abort_chunked_upload(upload_id: str):
+    get_chunked_upload(upload_id)
+    discard_chunked_upload(upload_id)
+    return {"message": f"Carga {upload_id} cancelada"}
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Convierte un DataFrame cargado a tipos compactos sin alterar los valores que lee el motor"""
+    compact = {}
+    
+    for col in df.columns:
+        series = df[col]
+        
+        if col == '#REF':
+            # Vacía al cargar: se regenera al expandir
+            if (series.astype(str) == '').all():
+                continue
+            compact[col] = series
+            continue
+        
+        if col == 'ESTADO':
+            compact[col] = series.astype('category')
+            continue
+        
+        if series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+            values = series.to_numpy(dtype=object)
+            value_types = set(map(type, values))
+            
+            # Números de Python guardados como objeto -> columnas numéricas
+            if value_types and value_types <= {float, np.float64}:
+                compact[col] = series.astype('float64')
+                continue
+            if value_types == {int}:
+                compact[col] = series.astype('int64')
+                continue
+            
+            # Textos repetidos (fechas, códigos, descripciones) -> categóricos
+            only_text = all(t is str or (t in (float, np.float64)) for t in value_types)
+            if only_text and not any(isinstance(v, float) and not np.isnan(v) for v in values):
+                if series.nunique(dropna=True) <= len(series) // 2:
+                    compact[col] = series.astype('category')
+                    continue
+        
+        compact[col] = series
+    
+    return pd.DataFrame(compact, index=df.index)
+
+def expand_compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Crea una copia de trabajo con ESTADO y #REF editables a partir de un DataFrame compacto"""
+    if df is None or df.empty:
+        return pd.DataFrame()
+    
+    # Copia superficial: solo ESTADO y #REF se reemplazan, el resto comparte los datos (o el memory-map)
+    working = df.copy(deep=False)
+    working['ESTADO'] = working['ESTADO'].astype(object)
+    if '#REF' not in working.columns:
+        working['#REF'] = ''
+    return working
+
+def consolidate_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Une los lotes de una hoja columna por columna en un arreglo del tamaño final (una sola copia de cada valor)"""
+    frames = [df for df in frames if df is not None and not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+    
+    # Lotes con identificadores consecutivos quedan con un RangeIndex
+    index = frames[0].index.append([df.index for df in frames[1:]])
+    bounds = np.cumsum([0] + [len(df) for df in frames])
+    columns = {}
+    for column in dict.fromkeys(col for df in frames for col in df.columns):
+        parts = [df[column] if column in df.columns else None for df in frames]
+        dtypes = [part.dtype for part in parts if part is not None]
+        complete = len(dtypes) == len(parts)
+        
+        if complete and all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+            # Categóricos de distintos archivos: unión de categorías, sin pasar a objeto
+            values = pd.api.types.union_categoricals([part.array for part in parts], ignore_order=True)
+        elif complete and all(dtype == dtypes[0] for dtype in dtypes) and not isinstance(dtypes[0], np.dtype):
+            # Mismo tipo de extensión (textos Arrow): concatenación nativa del tipo
+            values = type(parts[0].array)._concat_same_type([part.array for part in parts])
+        else:
+            if all(isinstance(dtype, np.dtype) and np.issubdtype(dtype, np.number) for dtype in dtypes):
+                # Columnas ausentes en algún lote se completan con NaN
+                dtype = np.result_type(*dtypes, *([] if complete else [np.float64]))
+            elif complete and all(dtype == dtypes[0] for dtype in dtypes):
+                dtype = dtypes[0]
+            else:
+                dtype = np.dtype(object)
+            values = np.empty(bounds[-1], dtype=dtype)
+            for part, start, stop in zip(parts, bounds, bounds[1:]):
+                values[start:stop] = np.nan if part is None else part.to_numpy(dtype=dtype)
+        columns[column] = pd.Series(values, index=index, dtype=values.dtype, copy=False)
+    
+    return pd.DataFrame(columns, index=index, copy=False)
+
+def load_pyarrow():
+    """Importa pyarrow la primera vez que se usa"""
+    global pa, pa_ipc
+    if pa is None:
+        import pyarrow
+        import pyarrow.ipc
+        pa, pa_ipc = pyarrow, pyarrow.ipc
+    return pa
+
+class ArrowFrame:
+    """DataFrame guardado como archivo Arrow IPC en temp/arrow; se lee con memory-map al usarlo"""
+    
+    def __init__(self, df: pd.DataFrame, path: str):
+        load_pyarrow()
+        table = pa.Table.from_pandas(df)
+        with pa.OSFile(path, 'wb') as sink:
+            with pa_ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        self.path = path
+        self.rows = len(df)
+        self.nbytes = os.path.getsize(path)
+    
+    def __len__(self) -> int:
+        return self.rows
+    
+    def load(self) -> pd.DataFrame:
+        """Reconstruye el DataFrame sobre el archivo mapeado (sin copia para columnas numéricas sin nulos)"""
+        load_pyarrow()
+        source = pa.memory_map(self.path, 'r')
+        table = pa_ipc.open_file(source).read_all()
+        return table.to_pandas(split_blocks=True)
+
+def store_frame(df: pd.DataFrame, directory: Optional[str] = None):
+    """Guarda un DataFrame compacto en Arrow si está habilitado; si no, lo deja en memoria"""
+    if not ARROW_STORAGE or df.empty:
+        return df
+    
+    # Los workers guardan sus resultados en el directorio del proceso principal, que los sigue usando
+    directory = directory or ARROW_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{uuid.uuid4()}.arrow")
+    try:
+        return ArrowFrame(df, path)
+    except (pa.ArrowException, ValueError, TypeError) as e:
+        # Columnas con tipos mezclados que Arrow no admite: se mantiene en memoria
+        print(f"⚠️ No se pudo guardar en Arrow, se mantiene en memoria: {e}")
+        if os.path.exists(path):
+            os.remove(path)
+        return df
+
+def load_frame(stored) -> Optional[pd.DataFrame]:
+    """Devuelve el DataFrame de un dato cargado, esté en memoria o en Arrow"""
+    if isinstance(stored, ArrowFrame):
+        return stored.load()
+    return stored
+
+def frame_nbytes(stored) -> int:
+    """Bytes que ocupa un dato cargado (archivo Arrow o memoria del DataFrame)"""
+    if stored is None:
+        return 0
+    if isinstance(stored, ArrowFrame):
+        return stored.nbytes
+    return int(stored.memory_usage(deep=True).sum())
+
+def release_frame(stored):
+    """Elimina el archivo Arrow de un dato que se reemplaza"""
+    if isinstance(stored, ArrowFrame) and os.path.exists(stored.path):
+        os.remove(stored.path)
+
+@atexit.register
+def cleanup_arrow_storage():
+    """Borra los archivos Arrow de este proceso al terminar"""
+    shutil.rmtree(ARROW_DIR, ignore_errors=True)
+
+def load_inputs_from_directory(directory: str, csv_options: Optional[Dict[str, str]] = None) -> Tuple[pd.DataFrame, Dict[str, pd.DataFrame]]:
+    """Carga un periodo desde disco: EXTRACTO* en la raíz y una subcarpeta por marca (amex/, diners/, mc/, visa/, payu/)"""
+    extracto_files = sorted(
+        name for name in os.listdir(directory)
+        if name.upper().startswith('EXTRACTO') and name.endswith(INPUT_EXTENSIONS)
+    )
+    if not extracto_files:
+        raise FileNotFoundError(f"No hay archivo EXTRACTO en {directory}")
+    extracto_df = load_extracto_file(os.path.join(directory, extracto_files[-1]), extracto_files[-1], csv_options)
+    
+    brand_frames = {}
+    for brand in ['amex', 'diners', 'mc', 'visa', 'payu']:
+        brand_dir = os.path.join(directory, brand)
+        loaded = []
+        if os.path.isdir(brand_dir):
+            for name in sorted(os.listdir(brand_dir)):
+                if not name.endswith(INPUT_EXTENSIONS):
+                    continue
+                df, _ = load_brand_file(brand, os.path.join(brand_dir, name), name, csv_options)
+                if df is not None:
+                    # Identificadores únicos en la marca, como al cargar por la API
+                    start = sum(len(previous) for previous in loaded)
+                    loaded.append(df.set_axis(pd.RangeIndex(start, start + len(df))))
+        brand_frames[brand] = consolidate_frames(loaded)
+    
+    return extracto_df, brand_frames
 
 def detectar_formato_mes_anio(filename: str) -> Dict[str, Any]:
     """Detecta si un nombre de archivo contiene formato mes-año (ENE25, FEB26, etc.)"""
@@ -624,143 +1942,1032 @@ def find_combination_by_sum(records: List[Dict], target_sum: float, max_combinat
                 if abs(sum_val - target_sum) < 0.01:
                     return [limited_records[i], limited_records[j], limited_records[k]]
     
-    return []
+    return []
+
+@app.post("/api/reconcile")
+async def reconcile(
+    trace: bool = False,
+    trace_level: str = 'match',
+    trace_sample: float = 1.0,
+    trace_phases: Optional[str] = None,
+    profile: Optional[str] = None,
+    progress_id: Optional[str] = None,
+    date_window: Optional[int] = None,
+    acquirer_partitions: Optional[bool] = None,
+    out_of_core: Optional[bool] = None,
+    currency_code: Optional[str] = None,
+    x_profile: Optional[str] = Header(None)
+):
+    global reconcile_jobs_running, admitted_memory
+    
+    workspace = get_workspace(currency_code)
+    extracto_data = workspace['extracto']
+    if extracto_data is None or len(extracto_data) == 0:
+        publish_progress(progress_id, 'error', {'detail': "No hay extracto cargado"}, done=True)
+        raise HTTPException(status_code=400, detail="No hay extracto cargado")
+    
+    if trace_level not in MatchTracer.LEVELS:
+        raise HTTPException(status_code=400, detail=f"Nivel de traza inválido: {trace_level}")
+    
+    window = DATE_WINDOW_DAYS if date_window is None else date_window
+    if not 0 <= window <= DATE_WINDOW_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"date_window inválido: {window} (0 a {DATE_WINDOW_MAX_DAYS} días hábiles)")
+    partitions = ACQUIRER_PARTITIONS if acquirer_partitions is None else acquirer_partitions
+    
+    # Muestreo por fase: "amex_f2=0.1,mc_f1=0.5"
+    phase_sample = {}
+    if trace_phases:
+        try:
+            for item in trace_phases.split(','):
+                phase, rate = item.split('=')
+                phase_sample[phase.strip()] = float(rate)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="trace_phases inválido, usar fase=tasa separados por coma")
+    
+    profile_mode = resolve_profile_mode(profile, x_profile)
+    reserved, by_month = admit_reconcile(workspace, progress_id, out_of_core)
+    job = new_job('reconcile')
+    job_id = job['id']
+    tracer = None
+    currency_value = workspace['currency']
+    
+    reconcile_jobs_running += 1
+    admitted_memory += reserved
+    workspace['running'] += 1
+    try:
+        print(f"🔄 INICIANDO CONCILIACIÓN MULTI-PASO ({currency_value or 'sin moneda'})")
+        
+        if trace:
+            trace_path = f"outputs/TRACE_{job_id}.jsonl.gz"
+            tracer = MatchTracer(trace_path, trace_level, trace_sample, phase_sample)
+            job['files']['trace'] = trace_path
+        
+        # El job recibe los datos guardados (rutas Arrow), no los DataFrames: los lee y consolida él mismo
+        inputs = {
+            'extracto': extracto_data,
+            'brands': {brand: list(workspace['brands'][brand]) for brand in BRAND_TYPES}
+        }
+        # Con traza o perfilado se ejecuta el motor aunque el resultado esté en caché
+        use_cache = not (tracer or profile_mode)
+        options = {
+            'job_id': job_id,
+            'currency': currency_value,
+            'date_window': window,
+            'acquirer_partitions': partitions,
+            'out_of_core': by_month,
+            'progress_id': progress_id,
+            'cached_fingerprints': set(result_cache) if use_cache else set(),
+            'arrow_dir': ARROW_DIR
+        }
+        
+        async def execute() -> Dict[str, Any]:
+            if RECONCILE_WORKERS == 'process' and not (tracer or profile_mode):
+                return await run_in_worker(workspace, inputs, options)
+            
+            progress = progress_callback(progress_id)
+            
+            def run_local() -> Dict[str, Any]:
+                # La traza y el perfil necesitan el motor en este proceso (hilo de trabajo, sin bloquear el event loop)
+                with profile_job(job, profile_mode) as profiler:
+                    if profiler is None:
+                        return run_reconcile_job(inputs, options, tracer, progress)
+                    return profiler.call(run_reconcile_job, inputs, options, tracer, progress)
+            
+            if RECONCILE_WORKERS == 'process':
+                return await run_in_threadpool(run_local)
+            return await asyncio.wrap_future(workspace_executor(workspace).submit(run_local))
+        
+        job_result = await execute()
+        fingerprint = job_result['fingerprint']
+        
+        # El job se detiene tras la huella si ya estaba en caché
+        cached = None
+        if job_result['cached']:
+            cached = cache_get(fingerprint)
+            if cached is None:
+                # Expulsada de la caché mientras el job calculaba la huella: se concilia
+                options['cached_fingerprints'] = set()
+                job_result = await execute()
+        elif use_cache:
+            result_cache_stats['misses'] += 1
+        
+        if cached is not None:
+            output_path = f"outputs/{cached['output_filename']}"
+            if not os.path.exists(output_path):
+                await run_in_threadpool(lambda: write_results_excel(load_result_sheets(cached['result']), output_path))
+            set_last_result(workspace, cached['result'], cached['indexes'], cached['response'])
+            print(f"♻️ Resultado en caché: {fingerprint[:12]}")
+            publish_progress(progress_id, 'done', {**cached['response'], 'cached': True}, done=True)
+            return {**cached['response'], "cached": True, "job_id": job_id}
+        
+        result = job_result['result']
+        output_filename = job_result['output_filename']
+        
+        # Métricas por fase
+        observe_metric('conciliador_export_duration_seconds', {}, job_result['export_seconds'])
+        for phase, seconds in result['timings'].items():
+            observe_metric('conciliador_phase_duration_seconds', {'phase': phase}, seconds)
+        for phase, matches in result['stats'].items():
+            increment_metric('conciliador_phase_matches_total', {'phase': phase}, matches)
+        
+        # Estadísticas calculadas por el job
+        total_extracto = result['extracto_total']
+        conciliados = result['conciliados']
+        
+        print(f"✅ CONCILIACIÓN COMPLETADA: {conciliados}/{total_extracto} registros conciliados")
+        
+        response = {
+            "message": "Conciliación completada",
+            "stats": {
+                "extracto_total": total_extracto,
+                "conciliados": conciliados,
+                "pendientes": total_extracto - conciliados
+            },
+            "out_of_core": by_month,
+            "download_url": f"/api/download/{output_filename}"
+        }
+        # Opciones que cambian qué fila concilia con cuál respecto de la conciliación completa
+        warnings = []
+        if by_month:
+            warnings.append("Conciliación por meses: cada mes concilia antes que los siguientes; "
+                            "el resultado puede diferir de la conciliación completa")
+        if partitions:
+            warnings.append("Particiones por adquirente: ante montos repetidos se prefiere la fila del extracto "
+                            "del adquirente; el resultado puede diferir de la conciliación completa")
+        if warnings:
+            response["warnings"] = warnings
+        
+        # Guardar resultado e índices (construidos por el job) para la API de consulta
+        set_last_result(workspace, result, job_result['indexes'], response)
+        cache_put(fingerprint, {
+            'result': result,
+            'indexes': job_result['indexes'],
+            'response': response,
+            'output_filename': output_filename
+        })
+        
+        publish_progress(progress_id, 'done', {**response, 'cached': False}, done=True)
+        return {**response, "cached": False, **job_links(job)}
+        
+    except HTTPException as e:
+        # Rechazos con su propio código (p. ej. otro perfilado en curso)
+        publish_progress(progress_id, 'error', {'detail': e.detail}, done=True)
+        raise
+    except Exception as e:
+        print(f"❌ ERROR: {e}")
+        publish_progress(progress_id, 'error', {'detail': str(e)}, done=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if tracer:
+            tracer.close()
+        reconcile_jobs_running -= 1
+        admitted_memory -= reserved
+        workspace['running'] -= 1
+        if not workspace['running']:
+            for stored in workspace['stale_frames']:
+                release_frame(stored)
+            workspace['stale_frames'] = []
+
+def memory_status() -> Tuple[Optional[int], Optional[int]]:
+    """(límite, disponible) en bytes: del cgroup del contenedor si tiene límite, si no de /proc/meminfo"""
+    def read_value(path: str) -> Optional[int]:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            return None
+        return int(value) if value.isdigit() else None
+    
+    def read_stat(path: str, key: str) -> int:
+        try:
+            with open(path) as f:
+                for line in f:
+                    name, _, value = line.partition(' ')
+                    if name == key:
+                        return int(value)
+        except (OSError, ValueError):
+            pass
+        return 0
+    
+    # cgroup v2 y v1; la caché de archivos inactiva se puede liberar y no cuenta como usada
+    for root, limit_name, usage_name, cache_key in (
+        ('/sys/fs/cgroup', 'memory.max', 'memory.current', 'inactive_file'),
+        ('/sys/fs/cgroup/memory', 'memory.limit_in_bytes', 'memory.usage_in_bytes', 'total_inactive_file')
+    ):
+        limit = read_value(os.path.join(root, limit_name))
+        usage = read_value(os.path.join(root, usage_name))
+        if limit and usage is not None and limit < 1 << 60:
+            usage -= read_stat(os.path.join(root, 'memory.stat'), cache_key)
+            return limit, max(0, limit - usage)
+    
+    meminfo = {}
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                meminfo[key] = int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None, None
+    return meminfo.get('MemTotal'), meminfo.get('MemAvailable')
+
+def admit_reconcile(workspace: Dict[str, Any], progress_id: Optional[str] = None,
+                    out_of_core: Optional[bool] = None) -> Tuple[int, bool]:
+    """Admite una conciliación si hay cupo y memoria para su estimación; devuelve los bytes que reserva y si va por meses"""
+    if MAX_CONCURRENT_RECONCILES and reconcile_jobs_running >= MAX_CONCURRENT_RECONCILES:
+        raise admission_error(429, f"Hay {reconcile_jobs_running} conciliaciones en curso (máximo {MAX_CONCURRENT_RECONCILES}), "
+                                   f"reintentar en {RETRY_AFTER_SECONDS}s", 'concurrency', progress_id)
+    
+    mode = OUT_OF_CORE if out_of_core is None else ('1' if out_of_core else '0')
+    loaded = frame_nbytes(workspace['extracto']) + sum(
+        frame_nbytes(df) for frames in workspace['brands'].values() for df in frames
+    )
+    
+    def partitioned_estimate() -> int:
+        # Entradas compactas completas más la memoria de trabajo de un mes
+        months = len(workspace['extracto_months'])
+        return int(loaded + loaded * RECONCILE_MEMORY_FACTOR / max(1, months))
+    
+    partitioned = mode == '1'
+    estimated = partitioned_estimate() if partitioned else int(loaded * RECONCILE_MEMORY_FACTOR)
+    limit, available = memory_status()
+    if limit is None or available is None:
+        return estimated, partitioned
+    
+    reserve = MEMORY_RESERVE_MB * 1024 * 1024
+    if mode == 'auto' and (estimated > limit - reserve or admitted_memory + estimated > available - reserve):
+        partitioned = True
+        estimated = partitioned_estimate()
+        print(f"🗓️ La conciliación completa no cabe en memoria: se concilia por meses (~{estimated / 2**20:.1f} MB)")
+    if estimated > limit - reserve:
+        raise admission_error(413, f"La conciliación necesita ~{estimated / 2**20:.1f} MB y el servidor tiene "
+                                   f"{(limit - reserve) / 2**20:.1f} MB para conciliar: dividir los archivos por periodo", 'memory', progress_id)
+    # Las conciliaciones en curso todavía pueden crecer hasta su estimación
+    if admitted_memory + estimated > available - reserve:
+        raise admission_error(429, f"Memoria insuficiente en este momento (~{estimated / 2**20:.1f} MB necesarios, "
+                                   f"{max(0, available - reserve) / 2**20:.1f} MB libres), reintentar en {RETRY_AFTER_SECONDS}s",
+                              'memory', progress_id)
+    return estimated, partitioned
+
+def load_reconcile_inputs(inputs: Dict[str, Any]) -> Tuple[pd.DataFrame, Dict[str, pd.DataFrame]]:
+    """Lee el extracto y consolida los lotes de cada marca desde los datos guardados (Arrow con memory-map)"""
+    extracto_df = load_frame(inputs['extracto'])
+    brand_frames = {
+        brand: consolidate_frames([load_frame(stored) for stored in inputs['brands'][brand]])
+        for brand in BRAND_TYPES
+    }
+    return extracto_df, brand_frames
+
+def run_reconcile_job(inputs: Dict[str, Any], options: Dict[str, Any], tracer: Optional['MatchTracer'] = None,
+                      progress: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Carga, conciliación, Excel, histórico y libro de pendientes de un job (en el worker de la moneda o en un hilo)"""
+    progress_id = options['progress_id']
+    if progress is None and progress_id and worker_progress_queue is not None:
+        progress = lambda event, data: worker_progress_queue.put((progress_id, event, data))
+    
+    try:
+        if options['out_of_core']:
+            # Por meses: cada marca queda como la lista de lotes guardados, el motor los reparte sin consolidarlos
+            extracto_df = load_frame(inputs['extracto'])
+            brand_frames = {brand: list(inputs['brands'][brand]) for brand in BRAND_TYPES}
+        else:
+            # Consolidar archivos en el propio job (los guardados en Arrow se leen con memory-map)
+            extracto_df, brand_frames = load_reconcile_inputs(inputs)
+        
+        # Agregar los pendientes de corridas anteriores guardados en el libro
+        ledger_rows = {}
+        if LEDGER_ENABLED:
+            brand_frames, ledger_rows = ledger_carry_forward(options['currency'], extracto_df, brand_frames)
+        
+        if progress:
+            progress('started', {
+                'currency': options['currency'], 'extracto': len(extracto_df),
+                **{brand: sum(len(piece) for piece in sheet_pieces(data)) for brand, data in brand_frames.items()}
+            })
+        
+        # Huella de las entradas normalizadas; si ya está en caché no se concilia
+        fingerprint = compute_input_fingerprint(extracto_df, brand_frames, options['currency'],
+                                                {'date_window': options['date_window'],
+                                                 'acquirer_partitions': options['acquirer_partitions'],
+                                                 'out_of_core': options['out_of_core']})
+        if fingerprint in options['cached_fingerprints']:
+            return {'fingerprint': fingerprint, 'cached': True}
+        
+        # Realizar conciliación multi-paso directamente sobre los DataFrames compactos (el motor no los modifica)
+        engine = perform_reconciliation_multi_step
+        if options['out_of_core']:
+            # El extracto también se reparte desde su archivo guardado
+            engine = perform_reconciliation_partitioned
+            extracto_df = [inputs['extracto']]
+        result = engine(
+            extracto_df, *(brand_frames[brand] for brand in BRAND_TYPES),
+            tracer=tracer,
+            progress=progress,
+            date_window=options['date_window'],
+            acquirer_partitions=options['acquirer_partitions']
+        )
+        del extracto_df, brand_frames
+        
+        # Generar Excel con resultados
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_filename = f"CONCILIACION_{options['currency'] or None}_{timestamp}.xlsx"
+        output_path = f"outputs/{output_filename}"
+        
+        export_start = time.perf_counter()
+        write_results_excel(result, output_path, progress)
+        export_seconds = time.perf_counter() - export_start
+        
+        if HISTORY_ENABLED:
+            history_record(options['job_id'], options['currency'], fingerprint, output_filename, result)
+        if ledger_rows:
+            ledger_record(options['currency'], options['job_id'], ledger_rows, result)
+        
+        # Índices de la API de consulta y resumen, junto con el resultado (fuera del event loop)
+        indexes = build_result_indexes(result)
+        result_summary = summarize_result(result, options['arrow_dir'])
+    finally:
+        if progress_id and worker_progress_queue is not None:
+            worker_progress_queue.put((progress_id, None, None))
+    
+    # Solo vuelve lo que usa la API: las hojas quedan en Arrow y se leen al consultarlas
+    return {'fingerprint': fingerprint, 'cached': False, 'result': result_summary, 'indexes': indexes,
+            'output_filename': output_filename, 'export_seconds': export_seconds}
+
+def summarize_result(result: Dict[str, Any], directory: Optional[str] = None) -> Dict[str, Any]:
+    """Hojas del resultado guardadas en Arrow más las estadísticas, tiempos y montos que usa la API"""
+    estados = result['extracto']['ESTADO'].astype(str)
+    return {
+        'sheets': {
+            sheet: store_frame(result[sheet], directory) if result.get(sheet) is not None else None
+            for sheet in SHEET_DATE_COLUMNS
+        },
+        'stats': result['stats'],
+        'timings': result['timings'],
+        'extracto_total': len(estados),
+        'conciliados': int((~estados.str.startswith('Pendiente')).sum()),
+        'amounts': extracto_amounts(result)
+    }
+
+def load_result_sheets(result: Dict[str, Any]) -> Dict[str, pd.DataFrame]:
+    """Hojas de un resultado resumido (para reescribir su Excel)"""
+    return {sheet: load_frame(stored) for sheet, stored in result['sheets'].items()}
+
+def release_result(result: Optional[Dict[str, Any]]):
+    """Elimina los archivos de un resultado que ya no usan la caché ni ningún espacio de trabajo"""
+    if result is None:
+        return
+    if any(entry['result'] is result for entry in result_cache.values()):
+        return
+    if any(workspace['last_result'] is result for workspace in workspaces.values()):
+        return
+    for stored in result['sheets'].values():
+        release_frame(stored)
+
+def set_last_result(workspace: Dict[str, Any], result: Dict[str, Any], indexes: Dict[str, Dict[str, Any]],
+                    response: Dict[str, Any]):
+    """Publica el último resultado de la moneda para la API de consulta"""
+    previous = workspace['last_result']
+    workspace['last_result'] = result
+    workspace['result_indexes'] = indexes
+    workspace['result_frames'] = {}
+    workspace['last_response'] = response
+    if previous is not result:
+        release_result(previous)
+
+async def run_in_worker(workspace: Dict[str, Any], inputs: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
+    """Ejecuta el job en el proceso worker de la moneda; su progreso llega por la cola del worker"""
+    progress_id = options['progress_id']
+    flushed = threading.Event()
+    if progress_id:
+        worker_flushes[progress_id] = flushed
+    
+    try:
+        job_result = await asyncio.wrap_future(workspace_executor(workspace).submit(run_reconcile_job, inputs, options))
+        if progress_id:
+            # Publicar 'done' recién cuando el progreso del worker ya está en el canal
+            await run_in_threadpool(flushed.wait, 5)
+        return job_result
+    except BrokenProcessPool:
+        # El worker murió (por ejemplo sin memoria): se recrea en la próxima conciliación
+        workspace['executor'] = None
+        raise
+    finally:
+        worker_flushes.pop(progress_id, None)
+
+@app.post("/api/reconcile/all")
+async def reconcile_all(progress_id: Optional[str] = None, date_window: Optional[int] = None,
+                        acquirer_partitions: Optional[bool] = None, out_of_core: Optional[bool] = None):
+    """Concilia en paralelo todas las monedas con extracto cargado y devuelve el resumen combinado"""
+    ready = [key for key, workspace in workspaces.items() if workspace['extracto'] is not None and len(workspace['extracto'])]
+    if not ready:
+        raise HTTPException(status_code=400, detail="No hay extracto cargado")
+    
+    # Cada moneda en su worker; con progress_id cada una publica en "<id>:<moneda>"
+    outcomes = await asyncio.gather(*(
+        reconcile(progress_id=f"{progress_id}:{key}" if progress_id else None, date_window=date_window,
+                  acquirer_partitions=acquirer_partitions, out_of_core=out_of_core, currency_code=key, x_profile=None)
+        for key in ready
+    ), return_exceptions=True)
+    
+    results = {}
+    for key, outcome in zip(ready, outcomes):
+        if isinstance(outcome, HTTPException):
+            results[key] = {'error': outcome.detail}
+        elif isinstance(outcome, Exception):
+            results[key] = {'error': str(outcome)}
+        else:
+            results[key] = outcome
+    return {"results": results, **await summary()}
+
+def extracto_amounts(result: Dict[str, Any]) -> Dict[str, float]:
+    """Montos conciliados y pendientes del extracto de un resultado"""
+    extracto = result['extracto']
+    montos = np.array([convert_to_number(v) for v in extracto['MONTO']], dtype=float)
+    pendientes = extracto['ESTADO'].astype(str).str.startswith('Pendiente').to_numpy()
+    return {
+        'monto_conciliado': round(float(np.nansum(montos[~pendientes])), 2),
+        'monto_pendiente': round(float(np.nansum(montos[pendientes])), 2)
+    }
+
+@app.get("/api/summary")
+async def summary():
+    """Resumen combinado de los espacios de trabajo de todas las monedas"""
+    currencies = {}
+    totals = {'extracto_total': 0, 'conciliados': 0, 'pendientes': 0}
+    
+    for key, workspace in workspaces.items():
+        extracto_data = workspace['extracto']
+        entry = {
+            'loaded': {
+                'extracto': len(extracto_data) if extracto_data is not None else 0,
+                **{brand: sum(len(df) for df in frames) for brand, frames in workspace['brands'].items()}
+            },
+            'running': workspace['running'] > 0,
+            'last_reconcile': None
+        }
+        if workspace['last_response'] is not None:
+            stats = workspace['last_response']['stats']
+            entry['last_reconcile'] = {
+                **stats,
+                **workspace['last_result']['amounts'],
+                'phases': workspace['last_result']['stats'],
+                'download_url': workspace['last_response']['download_url']
+            }
+            for name in totals:
+                totals[name] += stats[name]
+        currencies[key or '-'] = entry
+    
+    # Los montos no se suman entre monedas; los totales son cantidades de registros
+    return {"currencies": currencies, "totals": totals}
+
+def new_job(kind: str) -> Dict[str, Any]:
+    """Crea y registra un job (conciliación o carga) para asociarle artefactos"""
+    job = {
+        'id': uuid.uuid4().hex[:12],
+        'kind': kind,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'files': {}
+    }
+    register_job(job)
+    return job
+
+def job_links(job: Dict[str, Any]) -> Dict[str, str]:
+    """Campos de respuesta con el id del job y las URLs de sus artefactos"""
+    links = {"job_id": job['id']}
+    for artifact in job['files']:
+        links[f"{artifact}_url"] = f"/api/jobs/{job['id']}/{artifact}"
+    return links
+
+def register_job(job: Dict[str, Any]):
+    """Registra una conciliación y elimina los artefactos de las más antiguas"""
+    jobs[job['id']] = job
+    while len(jobs) > JOB_HISTORY_SIZE:
+        _, old_job = jobs.popitem(last=False)
+        for path in old_job['files'].values():
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception as e:
+                print(f"⚠️ Error eliminando artefacto {path}: {e}")
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Información de un job y sus artefactos"""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return {
+        "id": job['id'],
+        "kind": job['kind'],
+        "created": job['created'],
+        "profile": job.get('profile'),
+        **job_links(job)
+    }
+
+@app.get("/api/jobs/{job_id}/trace")
+async def download_trace(job_id: str):
+    """Descarga la traza de conciliación de un job (JSON por línea, gzip)"""
+    job = jobs.get(job_id)
+    trace_path = job['files'].get('trace') if job else None
+    if not trace_path or not os.path.exists(trace_path):
+        raise HTTPException(status_code=404, detail="Traza no encontrada")
+    return FileResponse(path=trace_path, filename=os.path.basename(trace_path), media_type='application/gzip')
+
+@app.get("/api/jobs/{job_id}/profile")
+async def download_profile(job_id: str):
+    """Descarga el perfil de un job (.prof de cProfile o pilas plegadas del muestreo)"""
+    job = jobs.get(job_id)
+    profile_path = job['files'].get('profile') if job else None
+    if not profile_path or not os.path.exists(profile_path):
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return FileResponse(path=profile_path, filename=os.path.basename(profile_path), media_type='application/octet-stream')
+
+def publish_progress(progress_id: Optional[str], event: str, data: Optional[Dict[str, Any]] = None, done: bool = False):
+    """Agrega un evento al canal de progreso (seguro desde hilos de trabajo)"""
+    if not progress_id:
+        return
+    now = time.time()
+    with progress_lock:
+        # Canales terminados y sin lectura reciente se descartan
+        for key in [key for key, channel in progress_channels.items()
+                    if channel['done'] and now - channel['updated'] > PROGRESS_RETENTION_SECONDS]:
+            del progress_channels[key]
+        channel = progress_channels.setdefault(progress_id, {'events': [], 'done': False, 'updated': now})
+        channel['events'].append({'event': event, 'data': {'t': round(now, 3), **(data or {})}})
+        channel['updated'] = now
+        channel['done'] = channel['done'] or done
+
+def progress_callback(progress_id: Optional[str]) -> Optional[Callable[[str, Dict[str, Any]], None]]:
+    """Callback para el motor y la exportación (None si no se pidió progreso)"""
+    if not progress_id:
+        return None
+    return lambda event, data: publish_progress(progress_id, event, data)
+
+@app.get("/api/progress/{progress_id}")
+async def progress_stream(progress_id: str, request: Request):
+    """Eventos de progreso (Server-Sent Events) de una carga o conciliación hasta que termina"""
+    async def event_stream():
+        sent = 0
+        last_write = time.time()
+        while True:
+            with progress_lock:
+                channel = progress_channels.get(progress_id)
+                events = channel['events'][sent:] if channel else []
+                done = bool(channel and channel['done'])
+            
+            for item in events:
+                yield f"event: {item['event']}\ndata: {json.dumps(item['data'], default=str)}\n\n"
+            sent += len(events)
+            if events:
+                last_write = time.time()
+            elif time.time() - last_write > 15:
+                # Comentario para mantener viva la conexión a través de proxies
+                yield ": ping\n\n"
+                last_write = time.time()
+            
+            if done or await request.is_disconnected():
+                break
+            await asyncio.sleep(PROGRESS_POLL_INTERVAL)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def resolve_profile_mode(query_value: Optional[str], header_value: Optional[str]) -> Optional[str]:
+    """Modo de perfilado pedido por parámetro o header (None si está desactivado)"""
+    value = (query_value or header_value or '').strip().lower()
+    if value in ('', '0', 'false', 'off'):
+        return None
+    if value in ('1', 'true', 'on'):
+        return 'cprofile'
+    if value not in PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"Modo de perfilado inválido: {value} ({', '.join(PROFILE_MODES)})")
+    return value
+
+class StackSampler(threading.Thread):
+    """Muestrea periódicamente la pila de un hilo y acumula pilas plegadas (formato flamegraph)"""
+    
+    def __init__(self, thread_id: Optional[int], interval: float):
+        super().__init__(daemon=True)
+        # Hilo muestreado (None: ninguno, entre llamadas perfiladas)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = {}
+        self.stop_event = threading.Event()
+    
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            thread_id = self.thread_id
+            frame = sys._current_frames().get(thread_id) if thread_id is not None else None
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+    
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+class JobProfiler:
+    """Perfil de un job: cProfile o muestreo sobre el hilo que ejecuta cada llamada perfilada"""
+    
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.profile = cProfile.Profile() if mode == 'cprofile' else None
+        self.sampler = StackSampler(None, PROFILE_SAMPLE_INTERVAL) if mode != 'cprofile' else None
+        if self.sampler:
+            self.sampler.start()
+    
+    def call(self, fn: Callable, *args):
+        """Ejecuta fn perfilando el hilo actual (cProfile es por hilo; el muestreo apunta a este hilo)"""
+        if self.profile:
+            return self.profile.runcall(fn, *args)
+        self.sampler.thread_id = threading.get_ident()
+        try:
+            return fn(*args)
+        finally:
+            self.sampler.thread_id = None
+    
+    def save(self, job_id: str) -> str:
+        """Detiene el perfil y lo guarda en outputs/ (.prof de cProfile o pilas plegadas)"""
+        if self.profile:
+            profile_path = f"outputs/PROFILE_{job_id}.prof"
+            self.profile.dump_stats(profile_path)
+            return profile_path
+        self.sampler.stop()
+        profile_path = f"outputs/PROFILE_{job_id}.folded"
+        with open(profile_path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.sampler.counts.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        return profile_path
 
-@app.post("/api/reconcile")
-async def reconcile():
-    global extracto_data, amex_data, diners_data, mc_data, visa_data, payu_data, files_info
+async def run_ingest(profiler: Optional[JobProfiler], fn: Callable, *args):
+    """Lee archivos en el threadpool, perfilando ese hilo si el job se está perfilando"""
+    if profiler is not None:
+        return await run_in_threadpool(profiler.call, fn, *args)
+    return await run_in_threadpool(fn, *args)
+
+@contextlib.contextmanager
+def profile_job(job: Optional[Dict[str, Any]], mode: Optional[str]):
+    """Perfila el bloque con pico de tracemalloc y guarda el perfil en el job; las llamadas a perfilar pasan por profiler.call"""
+    if not mode:
+        yield None
+        return
     
-    if extracto_data is None or len(extracto_data) == 0:
-        raise HTTPException(status_code=400, detail="No hay extracto cargado")
+    # tracemalloc (start/reset_peak/stop) es del proceso: un segundo perfilado concurrente se rechaza
+    if not profile_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Ya hay un perfilado en curso; reintente cuando termine")
     
     try:
-        print("🔄 INICIANDO CONCILIACIÓN MULTI-PASO")
-        
-        # Consolidar archivos
-        all_amex = pd.concat(amex_data) if amex_data else pd.DataFrame()
-        all_diners = pd.concat(diners_data) if diners_data else pd.DataFrame()
-        all_mc = pd.concat(mc_data) if mc_data else pd.DataFrame()
-        all_visa = pd.concat(visa_data) if visa_data else pd.DataFrame()
-        all_payu = pd.concat(payu_data) if payu_data else pd.DataFrame()
-        
-        # Realizar conciliación multi-paso
-        result = perform_reconciliation_multi_step(
-            extracto_data.copy(),
-            all_amex.copy() if not all_amex.empty else pd.DataFrame(),
-            all_diners.copy() if not all_diners.empty else pd.DataFrame(),
-            all_mc.copy() if not all_mc.empty else pd.DataFrame(),
-            all_visa.copy() if not all_visa.empty else pd.DataFrame(),
-            all_payu.copy() if not all_payu.empty else pd.DataFrame()
-        )
-        
-        # Generar Excel con resultados
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"CONCILIACION_{currency}_{timestamp}.xlsx"
-        output_path = f"outputs/{output_filename}"
-        
-        # Crear Excel con formato
-        workbook = xlsxwriter.Workbook(output_path)
-        
-        # Formatos mejorados
-        header_format = workbook.add_format({
-            'bold': True,
-            'bg_color': '#D7E4BC',
-            'border': 1,
-            'text_wrap': True,
-            'valign': 'top'
-        })
-        
-        pending_format = workbook.add_format({
-            'bg_color': '#FFE6E6',
-            'border': 1
-        })
-        
-        conciliated_format = workbook.add_format({
-            'bg_color': '#E6FFE6',
-            'border': 1
-        })
-        
-        ma_format = workbook.add_format({
-            'bg_color': '#FFF2CC',
-            'border': 1
-        })
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
         
-        # Escribir hojas
-        sheets_data = [
-            ('EXTRACTO', result['extracto']),
-            ('AMEX', result['amex']),
-            ('DINERS', result['diners']),
-            ('MC', result['mc']),
-            ('VISA', result['visa']),
-            ('PAYU', result['payu'])
-        ]
+        profiler = JobProfiler(mode)
+        start = time.perf_counter()
         
-        for sheet_name, data in sheets_data:
-            if data is not None and not data.empty:
-                ws = workbook.add_worksheet(sheet_name)
-                
-                # Escribir headers
-                for col, header in enumerate(data.columns):
-                    ws.write(0, col, header, header_format)
-                
-                # Escribir datos con formato condicional
-                for row_idx, (_, data_row) in enumerate(data.iterrows(), 1):
-                    # Determinar formato de fila basado en ESTADO
-                    row_format = None
-                    if 'ESTADO' in data.columns:
-                        estado_value = str(data_row['ESTADO'])
-                        if 'Pendiente' in estado_value and 'MA' not in estado_value:
-                            row_format = pending_format
-                        elif 'Conciliado' in estado_value or 'CONCILIADO' in estado_value:
-                            row_format = conciliated_format
-                        elif 'MA' in estado_value:
-                            row_format = ma_format
-                    
-                    # Escribir datos de la fila
-                    for col_idx, value in enumerate(data_row):
-                        formatted_value = str(value) if pd.notna(value) else ''
-                        if row_format:
-                            ws.write(row_idx, col_idx, formatted_value, row_format)
-                        else:
-                            ws.write(row_idx, col_idx, formatted_value)
-                
-                # Agregar filtro automático
-                if len(data) > 0:
-                    ws.autofilter(0, 0, len(data), len(data.columns) - 1)
-                
-                # Fijar primera fila (headers) - CRÍTICO: debe ir después de escribir datos
-                ws.freeze_panes(1, 0)
+        try:
+            yield profiler
+        finally:
+            elapsed = time.perf_counter() - start
+            profile_path = profiler.save(job['id'])
+            
+            peak = tracemalloc.get_traced_memory()[1]
+            if started_tracemalloc:
+                tracemalloc.stop()
+            
+            job['files']['profile'] = profile_path
+            job['profile'] = {
+                'mode': mode,
+                'seconds': round(elapsed, 4),
+                'tracemalloc_peak_mb': round(peak / (1024 * 1024), 2)
+            }
+            print(f"🔬 Perfil {mode} del job {job['id']}: {elapsed:.2f}s, pico {peak / (1024 * 1024):.1f} MB")
+    finally:
+        profile_lock.release()
+
+def compute_input_fingerprint(extracto_df, brand_frames: Dict[str, Any], currency_value, options: Optional[Dict[str, Any]] = None) -> str:
+    """Calcula una huella SHA-256 de las entradas normalizadas de la conciliación (DataFrames o listas de lotes)"""
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps({'currency': currency_value, 'options': options or {}}, sort_keys=True, default=str).encode())
+    
+    for name, data in [('extracto', extracto_df)] + list(brand_frames.items()):
+        hasher.update(name.encode())
+        empty = True
+        # Lote a lote: mismos bytes que la hoja consolidada
+        for piece in sheet_pieces(data):
+            df = load_frame(piece)
+            if df is None or df.empty:
+                continue
+            if empty:
+                # Columnas + contenido fila a fila, sin depender de los índices
+                hasher.update('|'.join(str(col) for col in df.columns).encode())
+                empty = False
+            hasher.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+        if empty:
+            hasher.update(b'<vacio>')
+    
+    return hasher.hexdigest()
+
+def cache_get(fingerprint: str) -> Optional[Dict[str, Any]]:
+    """Devuelve la entrada en caché (y la marca como usada recientemente)"""
+    entry = result_cache.get(fingerprint)
+    if entry is None:
+        result_cache_stats['misses'] += 1
+        return None
+    result_cache.move_to_end(fingerprint)
+    result_cache_stats['hits'] += 1
+    return entry
+
+def cache_put(fingerprint: str, entry: Dict[str, Any]):
+    """Guarda una entrada en caché, expulsando las menos usadas si se supera el tamaño"""
+    result_cache[fingerprint] = entry
+    result_cache.move_to_end(fingerprint)
+    
+    while len(result_cache) > RESULT_CACHE_SIZE:
+        _, evicted = result_cache.popitem(last=False)
+        result_cache_stats['evictions'] += 1
+        release_result(evicted['result'])
+        evicted_path = f"outputs/{evicted['output_filename']}"
+        try:
+            if os.path.exists(evicted_path):
+                os.remove(evicted_path)
+        except Exception as e:
+            print(f"⚠️ Error eliminando archivo expulsado de caché {evicted_path}: {e}")
+
+def is_cached_output(filename: str) -> bool:
+    """Indica si un archivo de salida pertenece a un resultado en caché"""
+    return any(entry['output_filename'] == filename for entry in result_cache.values())
+
+@app.get("/api/cache")
+async def get_cache_stats():
+    """Estado de la caché de resultados"""
+    return {
+        "size": len(result_cache),
+        "max_size": RESULT_CACHE_SIZE,
+        **result_cache_stats
+    }
+
+def write_results_excel(result: Dict[str, Any], output_path: str,
+                        progress: Optional[Callable[[str, Dict[str, Any]], None]] = None):
+    """Escribe el resultado de la conciliación en un Excel con formato"""
+    import xlsxwriter
+    
+    # Crear Excel con formato
+    workbook = xlsxwriter.Workbook(output_path)
+    
+    # Formatos mejorados
+    header_format = workbook.add_format({
+        'bold': True,
+        'bg_color': '#D7E4BC',
+        'border': 1,
+        'text_wrap': True,
+        'valign': 'top'
+    })
+    
+    pending_format = workbook.add_format({
+        'bg_color': '#FFE6E6',
+        'border': 1
+    })
+    
+    conciliated_format = workbook.add_format({
+        'bg_color': '#E6FFE6',
+        'border': 1
+    })
+    
+    ma_format = workbook.add_format({
+        'bg_color': '#FFF2CC',
+        'border': 1
+    })
+    
+    # Escribir hojas
+    sheets_data = [
+        ('EXTRACTO', result['extracto']),
+        ('AMEX', result['amex']),
+        ('DINERS', result['diners']),
+        ('MC', result['mc']),
+        ('VISA', result['visa']),
+        ('PAYU', result['payu'])
+    ]
+    
+    for sheet_name, data in sheets_data:
+        if data is not None and not data.empty:
+            ws = workbook.add_worksheet(sheet_name)
+            
+            # Escribir headers
+            for col, header in enumerate(data.columns):
+                ws.write(0, col, header, header_format)
+            
+            # Escribir datos con formato condicional
+            if progress:
+                progress('export', {'sheet': sheet_name, 'rows_written': 0, 'rows_total': len(data)})
+            for row_idx, (_, data_row) in enumerate(data.iterrows(), 1):
+                if progress and row_idx % EXPORT_PROGRESS_ROWS == 0:
+                    progress('export', {'sheet': sheet_name, 'rows_written': row_idx, 'rows_total': len(data)})
+                # Determinar formato de fila basado en ESTADO
+                row_format = None
+                if 'ESTADO' in data.columns:
+                    estado_value = str(data_row['ESTADO'])
+                    if 'Pendiente' in estado_value and 'MA' not in estado_value:
+                        row_format = pending_format
+                    elif 'Conciliado' in estado_value or 'CONCILIADO' in estado_value:
+                        row_format = conciliated_format
+                    elif 'MA' in estado_value:
+                        row_format = ma_format
                 
-                # Ajustar ancho de columnas
-                for col_idx, header in enumerate(data.columns):
-                    max_length = max(len(str(header)), 
-                                   data.iloc[:, col_idx].astype(str).str.len().max() if len(data) > 0 else 0)
-                    ws.set_column(col_idx, col_idx, min(max_length + 2, 50))
-        
-        workbook.close()
+                # Escribir datos de la fila
+                for col_idx, value in enumerate(data_row):
+                    formatted_value = str(value) if pd.notna(value) else ''
+                    if row_format:
+                        ws.write(row_idx, col_idx, formatted_value, row_format)
+                    else:
+                        ws.write(row_idx, col_idx, formatted_value)
+            
+            # Agregar filtro automático
+            if len(data) > 0:
+                ws.autofilter(0, 0, len(data), len(data.columns) - 1)
+            
+            # Fijar primera fila (headers) - CRÍTICO: debe ir después de escribir datos
+            ws.freeze_panes(1, 0)
+            
+            # Ajustar ancho de columnas
+            for col_idx, header in enumerate(data.columns):
+                max_length = max(len(str(header)), 
+                               data.iloc[:, col_idx].astype(str).str.len().max() if len(data) > 0 else 0)
+                ws.set_column(col_idx, col_idx, min(max_length + 2, 50))
+    
+    workbook.close()
+
+def business_day_number(fecha) -> int:
+    """Número de días hábiles (lun-vie) desde 0001-01-01; sábado y domingo cuentan como el lunes siguiente"""
+    weeks, weekday = divmod(fecha.toordinal() - 1, 7)
+    return weeks * 5 + min(weekday, 5)
+
+class DateWindowIndex:
+    """Candidatos ordenados por (monto en céntimos, día hábil) para buscar dentro de ±N días hábiles con búsqueda binaria"""
+    
+    def __init__(self, window: int, tolerance: Optional[float] = None):
+        self.window = window
+        # Sin tolerancia el monto debe coincidir al céntimo; con tolerancia se revisan los céntimos vecinos
+        self.tolerance = tolerance
+        self.keys = []
+        self.items = []
+        self.taken = set()
+        self.sorted = True
+    
+    def add(self, monto: float, fecha, payload) -> int:
+        """Agrega un candidato y devuelve su número de orden (desempate de primer match)"""
+        seq = len(self.items)
+        self.keys.append((int(round(monto * 100)), business_day_number(fecha), seq))
+        self.items.append((monto, fecha.toordinal(), payload))
+        self.sorted = False
+        return seq
+    
+    def discard(self, seq: int):
+        """Descarta un candidato usado por otra vía"""
+        self.taken.add(seq)
+    
+    def __len__(self) -> int:
+        """Candidatos aún disponibles"""
+        return len(self.items) - len(self.taken)
+    
+    def take(self, monto: float, fecha, accept: Optional[Callable[[Any], bool]] = None) -> Optional[Tuple[Any, int]]:
+        """Toma el candidato más cercano en fecha (luego el primero agregado); devuelve (payload, días hábiles) o None"""
+        if not self.sorted:
+            self.keys.sort()
+            self.sorted = True
         
-        # Calcular estadísticas
-        total_extracto = len(result['extracto'])
-        conciliados = len(result['extracto'][~result['extracto']['ESTADO'].str.startswith('Pendiente')])
+        cents = int(round(monto * 100))
+        day = business_day_number(fecha)
+        ordinal = fecha.toordinal()
+        offsets = (0,) if self.tolerance is None else (-1, 0, 1)
+        best = None
         
-        print(f"✅ CONCILIACIÓN COMPLETADA: {conciliados}/{total_extracto} registros conciliados")
+        for offset in offsets:
+            lo = bisect.bisect_left(self.keys, (cents + offset, day - self.window))
+            hi = bisect.bisect_right(self.keys, (cents + offset, day + self.window, len(self.items)))
+            for _, item_day, seq in self.keys[lo:hi]:
+                if seq in self.taken:
+                    continue
+                item_monto, item_ordinal, payload = self.items[seq]
+                if self.tolerance is not None and not abs(monto - item_monto) < self.tolerance:
+                    continue
+                if accept is not None and not accept(payload):
+                    continue
+                rank = (abs(item_day - day), abs(item_ordinal - ordinal), seq)
+                if best is None or rank < best:
+                    best = rank
         
-        return {
-            "message": "Conciliación completada",
-            "stats": {
-                "extracto_total": total_extracto,
-                "conciliados": conciliados,
-                "pendientes": total_extracto - conciliados
-            },
-            "download_url": f"/api/download/{output_filename}"
+        if best is None:
+            return None
+        self.taken.add(best[2])
+        return self.items[best[2]][2], best[0]
+
+class MatchTracer:
+    """Traza estructurada de la conciliación (JSON por línea, comprimida) con niveles y muestreo por fase"""
+    
+    LEVELS = {'debug': logging.DEBUG, 'match': logging.INFO}
+    
+    def __init__(self, path: str, level: str = 'match', sample: float = 1.0, phase_sample: Optional[Dict[str, float]] = None):
+        if level not in self.LEVELS:
+            raise ValueError(f"Nivel de traza inválido: {level}")
+        self.path = path
+        self.level = self.LEVELS[level]
+        # Muestreo determinista: se emite 1 de cada N eventos por fase
+        self.every = {}
+        for phase, rate in (phase_sample or {}).items():
+            self.every[phase] = self._every(rate)
+        self.default_every = self._every(sample)
+        self.counters = {}
+        self.events = 0
+        self.start = time.perf_counter()
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+    
+    @staticmethod
+    def _every(rate: float) -> int:
+        if rate <= 0:
+            return 0
+        return max(1, round(1 / min(rate, 1.0)))
+    
+    def _emit(self, level: int, phase: str, event: str, fields: Dict[str, Any]):
+        if level < self.level:
+            return
+        every = self.every.get(phase, self.default_every)
+        if every == 0:
+            return
+        count = self.counters.get(phase, 0)
+        self.counters[phase] = count + 1
+        if count % every:
+            return
+        record = {
+            't': round((time.perf_counter() - self.start) * 1000, 3),
+            'lvl': logging.getLevelName(level),
+            'phase': phase,
+            'event': event,
+            **fields
         }
-        
-    except Exception as e:
-        print(f"❌ ERROR: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        self.file.write(json.dumps(record, default=str, ensure_ascii=False) + '\n')
+        self.events += 1
+    
+    def debug(self, phase: str, event: str, **fields):
+        """Evento de detalle (búsquedas de claves, candidatos)"""
+        self._emit(logging.DEBUG, phase, event, fields)
+    
+    def match(self, phase: str, event: str, **fields):
+        """Evento de conciliación realizada"""
+        self._emit(logging.INFO, phase, event, fields)
+    
+    def close(self):
+        self.file.close()
+
+class SheetResults:
+    """ESTADO y #REF de una hoja en arreglos propios, por posición; la hoja de entrada solo se lee"""
+    
+    def __init__(self, df: Optional[pd.DataFrame]):
+        self.source = df if df is not None else pd.DataFrame()
+        # Con etiquetas repetidas (entradas de otro origen) las filas se identifican por posición
+        self.rows = self.source if self.source.index.is_unique else self.source.set_axis(pd.RangeIndex(len(self.source)))
+        self.position = self.rows.index.get_loc
+        self.estado = self._column('ESTADO')
+        self.ref = self._column('#REF')
+    
+    def _column(self, column: str) -> np.ndarray:
+        if column not in self.source.columns:
+            return np.full(len(self.source), '', dtype=object)
+        return np.array(self.source[column], dtype=object)
+    
+    def mark(self, label, estado: str, ref: str):
+        """Registra el resultado de la fila con esa etiqueta"""
+        position = self.position(label)
+        self.estado[position] = estado
+        self.ref[position] = ref
+    
+    def pending(self) -> np.ndarray:
+        """Máscara de las filas aún pendientes"""
+        return np.fromiter((isinstance(estado, str) and estado.startswith('Pendiente') for estado in self.estado),
+                           dtype=bool, count=len(self.estado))
+    
+    def pending_rows(self):
+        """(etiqueta, fila) de las filas pendientes en el orden de la hoja"""
+        return self.rows[self.pending()].iterrows()
+    
+    def frame(self) -> pd.DataFrame:
+        """Hoja de salida: copia superficial de la entrada (mismas etiquetas) con ESTADO y #REF de los resultados"""
+        output = self.source.copy(deep=False)
+        output['ESTADO'] = pd.Series(self.estado, index=output.index, dtype=object, copy=False)
+        output['#REF'] = pd.Series(self.ref, index=output.index, dtype=object, copy=False)
+        return output
 
-def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, visa_df, payu_df):
-    """Realiza la conciliación multi-paso siguiendo EXACTAMENTE la lógica del archivo original"""
+def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, visa_df, payu_df, tracer: Optional['MatchTracer'] = None,
+                                      progress: Optional[Callable[[str, Dict[str, Any]], None]] = None, date_window: int = 0,
+                                      acquirer_partitions: bool = False):
+    """Realiza la conciliación multi-paso siguiendo EXACTAMENTE la lógica del archivo original (date_window: ± días hábiles)"""
     print("🔄 INICIANDO CONCILIACIÓN MULTI-PASO")
     
     # Contadores
@@ -772,15 +2979,62 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
         'payu': 0
     }
     
+    # Duración de cada fase en segundos (mismas claves que stats)
+    timings = {}
+    
+    def start_phase(phase: str) -> float:
+        """Marca el inicio de una fase y notifica el avance"""
+        if progress:
+            progress('phase_started', {'phase': phase})
+        return time.perf_counter()
+    
+    def finish_phase(phase: str, phase_start: float):
+        """Registra la duración de una fase y notifica sus conciliaciones y el acumulado"""
+        timings[phase] = time.perf_counter() - phase_start
+        if progress:
+            progress('phase_finished', {
+                'phase': phase,
+                'seconds': round(timings[phase], 4),
+                'matches': stats[phase],
+                'total_matches': sum(stats.values())
+            })
+    
+    # ESTADO y #REF se escriben en arreglos por hoja: las entradas (compactas o en memory-map) no se copian ni se modifican
+    results = {
+        sheet: SheetResults(df)
+        for sheet, df in zip(('extracto',) + BRAND_TYPES, (extracto_df, amex_df, diners_df, mc_df, visa_df, payu_df))
+    }
+    extracto_df, amex_df, diners_df, mc_df, visa_df, payu_df = (results[sheet].rows for sheet in ('extracto',) + BRAND_TYPES)
+    
+    use_partitions = acquirer_partitions and 'ADQUIRENTE' in extracto_df.columns
+    
+    def extracto_candidates(family: Optional[str] = None, remaining: Optional[Callable[[], bool]] = None):
+        """Filas pendientes del extracto para una fase; con particiones, primero las de la familia y luego el resto"""
+        # Cada fase solo modifica la fila que visita, así que filtrar las pendientes al inicio no cambia el resultado
+        pending = results['extracto'].pending()
+        if not (use_partitions and family):
+            yield from extracto_df[pending].iterrows()
+            return
+        
+        in_family = (extracto_df['ADQUIRENTE'] == family).to_numpy(dtype=bool)
+        yield from extracto_df[pending & in_family].iterrows()
+        # Respaldo: las demás filas pendientes, salvo que la marca ya no tenga candidatos
+        if remaining is None or remaining():
+            yield from extracto_df[pending & ~in_family].iterrows()
+    
     # PASO 1: Conciliación AMEX (2 fases) - LÓGICA EXACTA DEL HTML
     if not amex_df.empty:
         print("💳 PASO 1: Conciliando AMEX")
         
+        phase_start = start_phase('amex_f2')
+        
         # FASE 2: Construir mapa AMEX (fecha + monto) - EXACTO AL HTML
         amex_map = {}
+        # Con ventana de fechas se busca en un índice ordenado en vez del mapa exacto
+        amex_window = DateWindowIndex(date_window) if date_window > 0 else None
         print("📊 PASO 1: Procesando AMEX para conciliación")
         
-        for amex_idx, amex_row in amex_df.iterrows():
+        for amex_idx, amex_row in results['amex'].pending_rows():
             if not amex_row['ESTADO'].startswith('Pendiente'):
                 continue
                 
@@ -802,20 +3056,25 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
             
             if fecha_key and not np.isnan(monto):
                 key = f"{fecha_key}_{monto:.2f}"
-                print(f"💳 [AMEX {amex_idx}] Key: \"{key}\" | Código: {amex_row['CODIGO']}")
+                if tracer:
+                    tracer.debug('amex_f2', 'amex_key', amex=amex_idx, key=key, codigo=amex_row['CODIGO'])
                 
-                if key not in amex_map:
-                    amex_map[key] = []
-                amex_map[key].append({
+                entry = {
                     'row_idx': amex_idx, 
                     'row': amex_row,
                     'codigo': amex_row['CODIGO']
-                })
+                }
+                if amex_window is not None:
+                    amex_window.add(monto, fecha_obj, entry)
+                    continue
+                if key not in amex_map:
+                    amex_map[key] = []
+                amex_map[key].append(entry)
         
-        print(f"AMEX Map size: {len(amex_map)}")
+        print(f"AMEX Map size: {len(amex_map) if amex_window is None else len(amex_window.items)}")
         
         # FASE 2: Conciliación por fecha + monto - IGUAL AL HTML
-        for idx, ext_row in extracto_df.iterrows():
+        for idx, ext_row in extracto_candidates('amex', lambda: bool(amex_map) if amex_window is None else len(amex_window) > 0):
             if not ext_row['ESTADO'].startswith('Pendiente'):
                 continue
                 
@@ -831,11 +3090,24 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
             
             if fecha_key and not np.isnan(monto):
                 key = f"{fecha_key}_{monto:.2f}"
-                print(f"[EXTRACTO {idx}] Buscando key: \"{key}\"")
+                if tracer:
+                    tracer.debug('amex_f2', 'lookup', extracto=idx, key=key)
                 
-                if key in amex_map and len(amex_map[key]) > 0:
+                match_data = None
+                dias_habiles = 0
+                if amex_window is not None:
+                    found = amex_window.take(monto, fecha_ext)
+                    if found:
+                        match_data, dias_habiles = found
+                elif key in amex_map and len(amex_map[key]) > 0:
                     # Tomar el primer match (como matches.shift() en HTML)
                     match_data = amex_map[key].pop(0)
+                    
+                    # Eliminar key si no quedan matches
+                    if len(amex_map[key]) == 0:
+                        del amex_map[key]
+                
+                if match_data:
                     match_row = match_data['row']
                     amex_idx = match_data['row_idx']
                     
@@ -846,22 +3118,19 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                     # Verificar etiqueta MA-
                     es_archivo_ma = match_row['ESTADO'] == 'Pendiente MA'
                     etiqueta = 'MA-' if es_archivo_ma else ''
-                    print(f"Etiqueta aplicada: {etiqueta}, Estado original: {match_row['ESTADO']}")
                     
                     # Marcar como conciliado
-                    extracto_df.at[idx, 'ESTADO'] = f'{etiqueta}P2-F2-Conciliado'
-                    extracto_df.at[idx, '#REF'] = f'{etiqueta}{cod_com} - {fecha_str}'
-                    amex_df.at[amex_idx, 'ESTADO'] = f'{etiqueta}P2-F2-Conciliado'
-                    amex_df.at[amex_idx, '#REF'] = f'{etiqueta}{op_num} - {fecha_str}'
+                    results['extracto'].mark(idx, f'{etiqueta}P2-F2-Conciliado', f'{etiqueta}{cod_com} - {fecha_str}')
+                    results['amex'].mark(amex_idx, f'{etiqueta}P2-F2-Conciliado', f'{etiqueta}{op_num} - {fecha_str}')
                     
                     stats['amex_f2'] += 1
-                    print(f"[EXTRACTO {idx}] ✅ P2-F2-Conciliado con AMEX código {cod_com}")
-                    
-                    # Eliminar key si no quedan matches
-                    if len(amex_map[key]) == 0:
-                        del amex_map[key]
+                    if tracer:
+                        tracer.match('amex_f2', 'match', extracto=idx, amex=amex_idx, key=key, codigo=cod_com, etiqueta=etiqueta,
+                                     dias_habiles=dias_habiles)
         
         print(f"Conciliados AMEX F2: {stats['amex_f2']}")
+        finish_phase('amex_f2', phase_start)
+        phase_start = start_phase('amex_f3')
         
         # FASE 3: Conciliación solo por monto - IGUAL AL HTML
         print("🔄 PASO 1 - FASE 3: Conciliando AMEX (solo monto, fechas diferentes)")
@@ -870,21 +3139,22 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
         amex_monto_map = {}
         
         # Procesar solo registros AMEX no conciliados en FASE 2
-        for amex_idx, amex_row in amex_df.iterrows():
+        for amex_idx, amex_row in results['amex'].pending_rows():
             if amex_row['ESTADO'].startswith('Pendiente'):  # Solo pendientes de FASE 2
                 monto_raw = amex_row['NETO_TOTAL']
                 monto = convert_to_number(monto_raw)
                 
                 if not np.isnan(monto):
                     monto_key = f"{monto:.2f}"
-                    print(f"[AMEX F3 {amex_idx}] Monto: \"{monto_key}\" | Código: {amex_row['CODIGO']}")
+                    if tracer:
+                        tracer.debug('amex_f3', 'amex_key', amex=amex_idx, key=monto_key, codigo=amex_row['CODIGO'])
                     
                     if monto_key not in amex_monto_map:
                         amex_monto_map[monto_key] = []
                     amex_monto_map[monto_key].append({'row_idx': amex_idx, 'row': amex_row})
         
         # Conciliar por monto con registros pendientes del extracto
-        for idx, ext_row in extracto_df.iterrows():
+        for idx, ext_row in extracto_candidates('amex', lambda: bool(amex_monto_map)):
             if not ext_row['ESTADO'].startswith('Pendiente'):
                 continue
                 
@@ -908,30 +3178,32 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                     # Verificar etiqueta MA-
                     es_archivo_ma = match_row['ESTADO'] == 'Pendiente MA'
                     etiqueta = 'MA-' if es_archivo_ma else ''
-                    print(f"Etiqueta F3 aplicada: {etiqueta}, Estado original: {match_row['ESTADO']}")
                     
                     # Marcar como conciliado
-                    extracto_df.at[idx, 'ESTADO'] = f'{etiqueta}P2-F3-Conciliado'
-                    extracto_df.at[idx, '#REF'] = f'{etiqueta}{cod_com} - Monto: {monto_key} (fechas diferentes)'
-                    amex_df.at[amex_idx, 'ESTADO'] = f'{etiqueta}P2-F3-Conciliado'
-                    amex_df.at[amex_idx, '#REF'] = f'{etiqueta}{op_num} - Monto: {monto_key} (fechas diferentes)'
+                    results['extracto'].mark(idx, f'{etiqueta}P2-F3-Conciliado', f'{etiqueta}{cod_com} - Monto: {monto_key} (fechas diferentes)')
+                    results['amex'].mark(amex_idx, f'{etiqueta}P2-F3-Conciliado', f'{etiqueta}{op_num} - Monto: {monto_key} (fechas diferentes)')
                     
                     stats['amex_f3'] += 1
-                    print(f"[EXTRACTO {idx}] ✅ P2-F3-Conciliado con AMEX código {cod_com} (fechas diferentes)")
+                    if tracer:
+                        tracer.match('amex_f3', 'match', extracto=idx, amex=amex_idx, key=monto_key, codigo=cod_com, etiqueta=etiqueta)
                     
                     # Eliminar key si no quedan matches
                     if len(amex_monto_map[monto_key]) == 0:
                         del amex_monto_map[monto_key]
         
         print(f"[F3 RESUMEN] {stats['amex_f3']} conciliaciones realizadas en fase 3")
+        finish_phase('amex_f3', phase_start)
     
     # PASO 2: Conciliación DINERS (3 fases)
     if not diners_df.empty:
         print("🏦 PASO 2: Conciliando DINERS")
         
+        phase_start = start_phase('diners_f1')
+        
         # Agrupar DINERS por orden de pago y fecha
         diners_groups = {}
-        for idx, diners_row in diners_df.iterrows():
+        diners_group_dates = {}
+        for idx, diners_row in results['diners'].pending_rows():
             if not diners_row['ESTADO'].startswith('Pendiente'):
                 continue
                 
@@ -949,6 +3221,7 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                 
                 if group_key not in diners_groups:
                     diners_groups[group_key] = []
+                    diners_group_dates[group_key] = fecha_pago
                 
                 diners_groups[group_key].append({
                         'idx': idx,
@@ -956,8 +3229,16 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                         'monto': convert_to_number(diners_row['IMPORTE NETO DE PAGO'])
                     })
         
+        # Con ventana de fechas los grupos se indexan por (total, fecha de pago)
+        diners_window = None
+        if date_window > 0:
+            diners_window = DateWindowIndex(date_window, tolerance=0.01)
+            for group_key, group_items in diners_groups.items():
+                total_grupo = sum(item['monto'] for item in group_items if not np.isnan(item['monto']))
+                diners_window.add(total_grupo, diners_group_dates[group_key], group_key)
+        
         # Fase 1: Por fecha y monto exacto
-        for idx, ext_row in extracto_df.iterrows():
+        for idx, ext_row in extracto_candidates('diners', lambda: bool(diners_groups)):
             if not ext_row['ESTADO'].startswith('Pendiente'):
                 continue
                 
@@ -967,9 +3248,15 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
             if fecha_ext and not np.isnan(monto_ext):
                 fecha_ext_key = fecha_ext.strftime('%Y-%m-%d')
                 
+                if diners_window is not None:
+                    found = diners_window.take(monto_ext, fecha_ext)
+                    candidates = [(found[0], diners_groups[found[0]])] if found else []
+                else:
+                    candidates = list(diners_groups.items())
+                
                 # Buscar grupo DINERS que coincida
-                for group_key, group_items in list(diners_groups.items()):
-                    if fecha_ext_key in group_key:
+                for group_key, group_items in candidates:
+                    if diners_window is not None or fecha_ext_key in group_key:
                         total_grupo = sum(item['monto'] for item in group_items if not np.isnan(item['monto']))
                         
                         if abs(monto_ext - total_grupo) < 0.01:
@@ -980,20 +3267,24 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                             es_ma = any(item['row']['ESTADO'] == 'Pendiente MA' for item in group_items)
                             etiqueta = 'MA-' if es_ma else ''
                             
-                            extracto_df.at[idx, 'ESTADO'] = f'{etiqueta}P3-F1-Conciliado'
-                            extracto_df.at[idx, '#REF'] = f'{etiqueta}{orden_pago} - {fecha_ext_key}'
+                            results['extracto'].mark(idx, f'{etiqueta}P3-F1-Conciliado', f'{etiqueta}{orden_pago} - {fecha_ext_key}')
                             
                             for item in group_items:
-                                diners_df.at[item['idx'], 'ESTADO'] = f'{etiqueta}P3-F1-Conciliado'
-                                diners_df.at[item['idx'], '#REF'] = f'{etiqueta}{ext_row["OPERACIÓN - NÚMERO"]} - {orden_pago} - {fecha_ext_key}'
+                                results['diners'].mark(item['idx'], f'{etiqueta}P3-F1-Conciliado', f'{etiqueta}{ext_row["OPERACIÓN - NÚMERO"]} - {orden_pago} - {fecha_ext_key}')
                             
                             del diners_groups[group_key]
                             stats['diners_f1'] += 1
-                            print(f"🏦 ✅ [EXTRACTO {idx}] P3-F1 - CONCILIADO con DINERS | Fecha: {fecha_ext_key} | Monto: {total_grupo} | Orden: {orden_pago}")
+                            if tracer:
+                                tracer.match('diners_f1', 'match', extracto=idx, orden=orden_pago, fecha=fecha_ext_key,
+                                             total=total_grupo, items=len(group_items), etiqueta=etiqueta,
+                                             dias_habiles=found[1] if diners_window is not None else 0)
                             break
         
+        finish_phase('diners_f1', phase_start)
+        phase_start = start_phase('diners_f2')
+        
         # Fase 2: Monto + 2.07
-        for idx, ext_row in extracto_df.iterrows():
+        for idx, ext_row in extracto_candidates('diners', lambda: bool(diners_groups)):
             if not ext_row['ESTADO'].startswith('Pendiente'):
                 continue
                 
@@ -1011,19 +3302,22 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                         es_ma = any(item['row']['ESTADO'] == 'Pendiente MA' for item in group_items)
                         etiqueta = 'MA-' if es_ma else ''
                         
-                        extracto_df.at[idx, 'ESTADO'] = f'{etiqueta}P3-F2-Conciliado'
-                        extracto_df.at[idx, '#REF'] = f'{etiqueta}DINERS - Monto: {monto_ext:.2f} + 2.07'
+                        results['extracto'].mark(idx, f'{etiqueta}P3-F2-Conciliado', f'{etiqueta}DINERS - Monto: {monto_ext:.2f} + 2.07')
                         
                         for item in group_items:
-                            diners_df.at[item['idx'], 'ESTADO'] = f'{etiqueta}P3-F2-Conciliado'
-                            diners_df.at[item['idx'], '#REF'] = f'{etiqueta}{ext_row["OPERACIÓN - NÚMERO"]} - Ajustado'
+                            results['diners'].mark(item['idx'], f'{etiqueta}P3-F2-Conciliado', f'{etiqueta}{ext_row["OPERACIÓN - NÚMERO"]} - Ajustado')
                         
                         del diners_groups[group_key]
                         stats['diners_f2'] += 1
+                        if tracer:
+                            tracer.match('diners_f2', 'match', extracto=idx, grupo=group_key, total=total_grupo, etiqueta=etiqueta)
                         break
         
+        finish_phase('diners_f2', phase_start)
+        phase_start = start_phase('diners_f3')
+        
         # Fase 3: Restar 5.90 a DINERS pendientes
-        for idx, ext_row in extracto_df.iterrows():
+        for idx, ext_row in extracto_candidates('diners', lambda: bool(diners_groups)):
             if not ext_row['ESTADO'].startswith('Pendiente'):
                 continue
                 
@@ -1040,25 +3334,29 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                         es_ma = any(item['row']['ESTADO'] == 'Pendiente MA' for item in group_items)
                         etiqueta = 'MA-' if es_ma else ''
                         
-                        extracto_df.at[idx, 'ESTADO'] = f'{etiqueta}P3-F3-Conciliado'
-                        extracto_df.at[idx, '#REF'] = f'{etiqueta}DINERS - Extracto: {monto_ext:.2f} = DINERS: {total_grupo:.2f} - 5.90'
+                        results['extracto'].mark(idx, f'{etiqueta}P3-F3-Conciliado', f'{etiqueta}DINERS - Extracto: {monto_ext:.2f} = DINERS: {total_grupo:.2f} - 5.90')
                         
                         for item in group_items:
-                            diners_df.at[item['idx'], 'ESTADO'] = f'{etiqueta}P3-F3-Conciliado'
-                            diners_df.at[item['idx'], '#REF'] = f'{etiqueta}{ext_row["OPERACIÓN - NÚMERO"]} - Ajustado: {total_grupo:.2f} - 5.90'
+                            results['diners'].mark(item['idx'], f'{etiqueta}P3-F3-Conciliado', f'{etiqueta}{ext_row["OPERACIÓN - NÚMERO"]} - Ajustado: {total_grupo:.2f} - 5.90')
                         
                         del diners_groups[group_key]
                         stats['diners_f3'] += 1
+                        if tracer:
+                            tracer.match('diners_f3', 'match', extracto=idx, grupo=group_key, total=total_grupo, etiqueta=etiqueta)
                         break
+        
+        finish_phase('diners_f3', phase_start)
     
     # PASO 3: Conciliación MC (3 fases) - EXACTO AL HTML
     if not mc_df.empty:
         print("💳 PASO 3: Conciliando MC")
         
+        phase_start = start_phase('mc_f1')
+        
         # Construir mapa MC EXACTAMENTE como el HTML - línea por línea
         mc_commerce_map = {}
         
-        for mc_idx, mc_row in mc_df.iterrows():
+        for mc_idx, mc_row in results['mc'].pending_rows():
             if not mc_row['ESTADO'].startswith('Pendiente'):
                 continue
                 
@@ -1083,7 +3381,7 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
         print(f"💳 [MC] Mapa de comercios creado con {len(mc_commerce_map)} comercios (línea por línea)")
         
         # FASE 1: Conciliación por CODCOM + MONTO (línea por línea) - EXACTO AL HTML
-        for idx, ext_row in extracto_df.iterrows():
+        for idx, ext_row in extracto_candidates('mc', lambda: any(mc_commerce_map.values())):
             if not ext_row['ESTADO'].startswith('Pendiente'):
                 continue
                 
@@ -1097,12 +3395,13 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                     full_code = match.group(1)
                     codcom_key = full_code[-7:]  # slice(-7) en JS = últimos 7
                     
-                    print(f"💳 [PASO 4-F1] Extracto {idx}: REFERENCIA2=\"{referencia2}\" → codcomKey=\"{codcom_key}\" | Monto: {monto_ext}")
+                    if tracer:
+                        tracer.debug('mc_f1', 'lookup', extracto=idx, referencia2=referencia2, codcom=codcom_key, monto=monto_ext)
                     
                     if codcom_key in mc_commerce_map:
                         potential_matches = mc_commerce_map[codcom_key]
-                        print(f"💳 [PASO 4-F1] Encontrado comercio {codcom_key} con {len(potential_matches)} registros")
-                        print(f"💳 [PASO 4-F1] Montos disponibles para {codcom_key}: {[m['monto'] for m in potential_matches]}")
+                        if tracer:
+                            tracer.debug('mc_f1', 'candidates', extracto=idx, codcom=codcom_key, candidatos=len(potential_matches))
                         
                         # Buscar coincidencia exacta de monto
                         match_index = -1
@@ -1122,23 +3421,25 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                             etiqueta = 'MA-' if es_archivo_ma else ''
                             
                             # Marcar extracto como conciliado
-                            extracto_df.at[idx, 'ESTADO'] = f'{etiqueta}P4-F1-Conciliado'
-                            extracto_df.at[idx, '#REF'] = f'{etiqueta}MC-{codcom_key} - {fecha_proceso_str}'
+                            results['extracto'].mark(idx, f'{etiqueta}P4-F1-Conciliado', f'{etiqueta}MC-{codcom_key} - {fecha_proceso_str}')
                             
                             # Marcar MC como conciliado
                             mc_idx = mc_record['index']
-                            mc_df.at[mc_idx, 'ESTADO'] = f'{etiqueta}P4-F1-Conciliado'
-                            mc_df.at[mc_idx, '#REF'] = f'{etiqueta}{op_num} - {fecha_proceso_str}'
+                            results['mc'].mark(mc_idx, f'{etiqueta}P4-F1-Conciliado', f'{etiqueta}{op_num} - {fecha_proceso_str}')
                             
                             stats['mc_f1'] += 1
-                            print(f"💳 ✅ [PASO 4-F1] CONCILIADO: Extracto {idx} con MC registro | Monto: {monto_ext}")
+                            if tracer:
+                                tracer.match('mc_f1', 'match', extracto=idx, mc=mc_idx, codcom=codcom_key, monto=monto_ext, etiqueta=etiqueta)
                             
                             # Eliminar el registro para no reutilizarlo
                             potential_matches.pop(match_index)
-                        else:
-                            print(f"💳 ❌ [PASO 4-F1] NO MATCH: Comercio {codcom_key} encontrado pero sin coincidencia de monto {monto_ext}")
-                    else:
-                        print(f"💳 ❌ [PASO 4-F1] NO FOUND: Comercio {codcom_key} no existe en mcCommerceMap")
+                        elif tracer:
+                            tracer.debug('mc_f1', 'no_match', extracto=idx, codcom=codcom_key, monto=monto_ext)
+                    elif tracer:
+                        tracer.debug('mc_f1', 'no_commerce', extracto=idx, codcom=codcom_key)
+        
+        finish_phase('mc_f1', phase_start)
+        phase_start = start_phase('mc_f2')
         
         # FASE 2: Conciliación solo por MONTO (como AMEX Fase 3) - EXACTO AL HTML
         print("💳 [PASO 4 - FASE 2] Conciliando MC (solo MONTO)")
@@ -1153,7 +3454,7 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                         mc_monto_map[monto_key] = []
                     mc_monto_map[monto_key].append(registro)
         
-        for idx, ext_row in extracto_df.iterrows():
+        for idx, ext_row in extracto_candidates('mc', lambda: bool(mc_monto_map)):
             if not ext_row['ESTADO'].startswith('Pendiente'):
                 continue
                 
@@ -1173,25 +3474,27 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                     etiqueta = 'MA-' if es_archivo_ma else ''
                     
                     # Marcar extracto como conciliado
-                    extracto_df.at[idx, 'ESTADO'] = f'{etiqueta}P4-F2-Conciliado'
-                    extracto_df.at[idx, '#REF'] = f'{etiqueta}MC - Monto: {monto_key}'
+                    results['extracto'].mark(idx, f'{etiqueta}P4-F2-Conciliado', f'{etiqueta}MC - Monto: {monto_key}')
                     
                     # Marcar MC como conciliado
                     mc_idx = mc_record['index']
-                    mc_df.at[mc_idx, 'ESTADO'] = f'{etiqueta}P4-F2-Conciliado'
-                    mc_df.at[mc_idx, '#REF'] = f'{etiqueta}{op_num} - Monto: {monto_key}'
+                    results['mc'].mark(mc_idx, f'{etiqueta}P4-F2-Conciliado', f'{etiqueta}{op_num} - Monto: {monto_key}')
                     
                     stats['mc_f2'] += 1
-                    print(f"💳 ✅ [PASO 4-F2] CONCILIADO: Extracto {idx} con MC por monto | Monto: {monto_ext}")
+                    if tracer:
+                        tracer.match('mc_f2', 'match', extracto=idx, mc=mc_idx, key=monto_key, etiqueta=etiqueta)
                     
                     if len(matches) == 0:
                         del mc_monto_map[monto_key]
         
+        finish_phase('mc_f2', phase_start)
+        phase_start = start_phase('mc_f3')
+        
         # Fase 3: Agrupación por fecha del extracto vs MC pendientes
         extracto_fecha_groups = {}
         
         # Agrupar extracto pendiente por fecha
-        for idx, ext_row in extracto_df.iterrows():
+        for idx, ext_row in extracto_candidates():
             if not ext_row['ESTADO'].startswith('Pendiente'):
                 continue
                 
@@ -1209,7 +3512,7 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
         
         # Crear lista de MC pendientes
         mc_pendientes = []
-        for mc_idx, mc_row in mc_df.iterrows():
+        for mc_idx, mc_row in results['mc'].pending_rows():
             if mc_row['ESTADO'].startswith('Pendiente'):
                 monto_mc = convert_to_number(mc_row['NETO_TOTAL'])
                 if not np.isnan(monto_mc):
@@ -1233,24 +3536,30 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                 
                 # Marcar extracto como conciliado
                 for item in fecha_group['items']:
-                    extracto_df.at[item['idx'], 'ESTADO'] = f'{etiqueta}P4-F3-Conciliado'
-                    extracto_df.at[item['idx'], '#REF'] = f'{etiqueta}MC-Fecha: {fecha_key} - Total: {total_extracto:.2f}'
+                    results['extracto'].mark(item['idx'], f'{etiqueta}P4-F3-Conciliado', f'{etiqueta}MC-Fecha: {fecha_key} - Total: {total_extracto:.2f}')
                 
                 # Marcar MC como conciliado
                 for mc_record in mc_combination:
                     mc_etiqueta = 'MA-' if mc_record['row']['ESTADO'] == 'Pendiente MA' else ''
-                    mc_df.at[mc_record['idx'], 'ESTADO'] = f'{mc_etiqueta}P4-F3-Conciliado'
-                    mc_df.at[mc_record['idx'], '#REF'] = f'{mc_etiqueta}Extracto-Fecha: {fecha_key} - Total: {total_extracto:.2f}'
+                    results['mc'].mark(mc_record['idx'], f'{mc_etiqueta}P4-F3-Conciliado', f'{mc_etiqueta}Extracto-Fecha: {fecha_key} - Total: {total_extracto:.2f}')
                     
                     # Remover de pendientes para evitar reutilización
                     mc_pendientes = [mc for mc in mc_pendientes if mc['idx'] != mc_record['idx']]
                 
                 stats['mc_f3'] += len(fecha_group['items'])
+                if tracer:
+                    tracer.match('mc_f3', 'match', fecha=fecha_key, total=total_extracto,
+                                 extracto=[item['idx'] for item in fecha_group['items']],
+                                 mc=[mc_record['idx'] for mc_record in mc_combination], etiqueta=etiqueta)
+        
+        finish_phase('mc_f3', phase_start)
     
     # PASO 4: Conciliación VISA (2 fases) - EXACTO AL HTML
     if not visa_df.empty:
         print("🏦 PASO 4: Conciliando VISA")
         
+        phase_start = start_phase('visa_f1')
+        
         # Construir mapa VISA EXACTAMENTE como el HTML - AGRUPAR POR FECHA PROCESO Y TOTALIZAR POR COMERCIO
         visa_commerce_map = {}
         
@@ -1295,9 +3604,17 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
         
         print(f"🏦 [VISA] Mapa de comercios creado con {len(visa_commerce_map)} comercios (agrupado por fecha y totalizado)")
         
+        # VISA no exige fecha igual; con ventana se prefiere el grupo de fecha más cercana y si no hay, el primero
+        visa_window = None
+        if date_window > 0:
+            visa_window = DateWindowIndex(date_window, tolerance=0.01)
+            for comercio, grupos in visa_commerce_map.items():
+                for grupo in grupos:
+                    grupo['seq'] = visa_window.add(grupo['total'], datetime.strptime(grupo['fecha_proceso'], '%Y-%m-%d'), (comercio, grupo))
+        
         # FASE 1: Línea de extracto vs Grupos totalizados de VISA - EXACTO AL HTML
         print("🏦 [PASO 5 - FASE 1] Extracto línea vs VISA grupos")
-        for idx, ext_row in extracto_df.iterrows():
+        for idx, ext_row in extracto_candidates('visa', lambda: bool(visa_commerce_map)):
             if not ext_row['ESTADO'].startswith('Pendiente'):
                 continue
                 
@@ -1311,17 +3628,24 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                     full_code = match.group(1)
                     codcom_key = full_code[-7:]  # slice(-7) en JS = últimos 7
                     
-                    print(f"🏦 [PASO 5 F1] Extracto {idx}: REFERENCIA2=\"{referencia2}\" → codcomKey=\"{codcom_key}\" | Monto: {monto_ext}")
+                    if tracer:
+                        tracer.debug('visa_f1', 'lookup', extracto=idx, referencia2=referencia2, codcom=codcom_key, monto=monto_ext)
                     
                     if codcom_key in visa_commerce_map:
                         grupos_visa = visa_commerce_map[codcom_key]
                         
                         # Buscar grupo VISA que coincida con el monto del extracto
                         match_index = -1
-                        for i, grupo in enumerate(grupos_visa):
-                            if abs(monto_ext - grupo['total']) < 0.01:
-                                match_index = i
-                                break
+                        fecha_ext = parse_date(ext_row['FECHA']) if visa_window is not None else None
+                        if fecha_ext:
+                            found = visa_window.take(monto_ext, fecha_ext, accept=lambda payload: payload[0] == codcom_key)
+                            if found:
+                                match_index = next(i for i, grupo in enumerate(grupos_visa) if grupo is found[0][1])
+                        if match_index == -1:
+                            for i, grupo in enumerate(grupos_visa):
+                                if abs(monto_ext - grupo['total']) < 0.01:
+                                    match_index = i
+                                    break
                         
                         if match_index != -1:
                             grupo_visa = grupos_visa[match_index]
@@ -1334,29 +3658,45 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                             etiqueta = 'MA-' if es_archivo_ma else ''
                             
                             # Marcar extracto como conciliado F1
-                            extracto_df.at[idx, 'ESTADO'] = f'{etiqueta}P5-F1-Conciliado'
-                            extracto_df.at[idx, '#REF'] = f'{etiqueta}VISA-{codcom_key} - {fecha_proceso_str}'
+                            results['extracto'].mark(idx, f'{etiqueta}P5-F1-Conciliado', f'{etiqueta}VISA-{codcom_key} - {fecha_proceso_str}')
                             
                             # Marcar todos los registros VISA del grupo como conciliados F1
                             for item in grupo_visa['items']:
                                 visa_idx = item['index']
-                                visa_df.at[visa_idx, 'ESTADO'] = f'{etiqueta}P5-F1-Conciliado'
-                                visa_df.at[visa_idx, '#REF'] = f'{etiqueta}{op_num} - {fecha_proceso_str}'
+                                results['visa'].mark(visa_idx, f'{etiqueta}P5-F1-Conciliado', f'{etiqueta}{op_num} - {fecha_proceso_str}')
                             
                             stats['visa_f1'] += 1
-                            print(f"🏦 ✅ [PASO 5 F1] CONCILIADO: Extracto {idx} con VISA grupo | Monto: {monto_ext}")
+                            if tracer:
+                                tracer.match('visa_f1', 'match', extracto=idx, codcom=codcom_key, fecha=grupo_visa['fecha_proceso'],
+                                             visa=[item['index'] for item in grupo_visa['items']], etiqueta=etiqueta)
                             
                             # Eliminar el grupo para no reutilizarlo
                             grupos_visa.pop(match_index)
+                            if visa_window is not None:
+                                visa_window.discard(grupo_visa['seq'])
                             
                             if len(grupos_visa) == 0:
                                 del visa_commerce_map[codcom_key]
         
+        finish_phase('visa_f1', phase_start)
+        phase_start = start_phase('visa_f2')
+        
         # Fase 2: Extracto agrupado por fecha y comercio vs grupos VISA
         extracto_visa_groups = {}
         
+        # Grupos VISA no conciliados en F1, por comercio y fecha de proceso
+        visa_groups = {}
+        for comercio, grupos in visa_commerce_map.items():
+            for grupo in grupos:
+                visa_groups[f"{comercio}_{grupo['fecha_proceso']}"] = {
+                    'comercio': comercio,
+                    'fecha': grupo['fecha_proceso'],
+                    'total': grupo['total'],
+                    'items': [{'idx': item['index'], 'row': item['row']} for item in grupo['items']]
+                }
+        
         # Agrupar extracto pendiente por fecha y comercio
-        for idx, ext_row in extracto_df.iterrows():
+        for idx, ext_row in extracto_candidates():
             if not ext_row['ESTADO'].startswith('Pendiente'):
                 continue
                 
@@ -1379,10 +3719,27 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                     extracto_visa_groups[group_key]['total'] += monto_ext
                     extracto_visa_groups[group_key]['items'].append({'idx': idx, 'row': ext_row})
         
+        # Con ventana de fechas los grupos VISA restantes se indexan por (total, fecha de proceso)
+        visa_group_window = None
+        if date_window > 0:
+            visa_group_window = DateWindowIndex(date_window, tolerance=0.01)
+            for visa_group_key, visa_group in visa_groups.items():
+                visa_group_window.add(visa_group['total'], datetime.strptime(visa_group['fecha'], '%Y-%m-%d'), visa_group_key)
+        
         # Comparar grupos del extracto con grupos VISA restantes
         for ext_group_key, ext_group in extracto_visa_groups.items():
+            candidates = list(visa_groups.items())
+            if visa_group_window is not None:
+                # Primero el grupo más cercano en fecha dentro de la ventana; si no hay, el primero como siempre
+                found = visa_group_window.take(
+                    ext_group['total'], datetime.strptime(ext_group['fecha'], '%Y-%m-%d'),
+                    accept=lambda key: key in visa_groups and ext_group['codcom'] in visa_groups[key]['comercio']
+                )
+                if found:
+                    candidates = [(found[0], visa_groups[found[0]])]
+            
             # Buscar grupo VISA con el mismo comercio y monto total (fechas pueden ser diferentes)
-            for visa_group_key, visa_group in list(visa_groups.items()):
+            for visa_group_key, visa_group in candidates:
                 if (ext_group['codcom'] in visa_group['comercio'] and 
                     abs(ext_group['total'] - visa_group['total']) < 0.01):
                     
@@ -1392,24 +3749,35 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
                     
                     # Conciliar todos los registros del extracto
                     for item in ext_group['items']:
-                        extracto_df.at[item['idx'], 'ESTADO'] = f'{etiqueta}P5-F2-Conciliado'
-                        extracto_df.at[item['idx'], '#REF'] = f'{etiqueta}VISA-{ext_group["codcom"]} - Monto: {ext_group["total"]:.2f} ({ext_group["fecha"]}→{visa_group["fecha"]})'
+                        results['extracto'].mark(item['idx'], f'{etiqueta}P5-F2-Conciliado', f'{etiqueta}VISA-{ext_group["codcom"]} - Monto: {ext_group["total"]:.2f} ({ext_group["fecha"]}→{visa_group["fecha"]})')
                     
                     # Conciliar todos los registros VISA del grupo
                     for item in visa_group['items']:
                         visa_etiqueta = 'MA-' if item['row']['ESTADO'] == 'Pendiente MA' else ''
-                        visa_df.at[item['idx'], 'ESTADO'] = f'{visa_etiqueta}P5-F2-Conciliado'
-                        visa_df.at[item['idx'], '#REF'] = f'{visa_etiqueta}{ext_group["items"][0]["row"]["OPERACIÓN - NÚMERO"]} - Monto: {ext_group["total"]:.2f} ({ext_group["fecha"]}→{visa_group["fecha"]})'
+                        results['visa'].mark(item['idx'], f'{visa_etiqueta}P5-F2-Conciliado', f'{visa_etiqueta}{ext_group["items"][0]["row"]["OPERACIÓN - NÚMERO"]} - Monto: {ext_group["total"]:.2f} ({ext_group["fecha"]}→{visa_group["fecha"]})')
                     
                     del visa_groups[visa_group_key]
                     stats['visa_f2'] += 1
+                    if tracer:
+                        tracer.match('visa_f2', 'match', grupo=ext_group_key, visa_grupo=visa_group_key,
+                                     total=ext_group['total'], etiqueta=etiqueta)
                     break
+        
+        finish_phase('visa_f2', phase_start)
     
     # PASO 5: Conciliación PAYU
     if not payu_df.empty:
         print("💰 PASO 5: Conciliando PAYU")
+        phase_start = start_phase('payu')
+        
+        # PAYU pendientes con su débito por etiqueta, calculados una vez (en orden) y retirados al conciliar
+        payu_candidates = {
+            payu_idx: (payu_row, abs(convert_to_number(payu_row['DEBITOS'])))
+            for payu_idx, payu_row in results['payu'].pending_rows()
+            if payu_row['ESTADO'].startswith('Pendiente')
+        }
         
-        for idx, ext_row in extracto_df.iterrows():
+        for idx, ext_row in extracto_candidates('payu', lambda: bool(payu_candidates)):
             if not ext_row['ESTADO'].startswith('Pendiente'):
                 continue
                 
@@ -1417,34 +3785,160 @@ def perform_reconciliation_multi_step(extracto_df, amex_df, diners_df, mc_df, vi
             
             if not np.isnan(monto_ext):
                 # Buscar en PAYU
-                for payu_idx, payu_row in payu_df.iterrows():
-                    if not payu_row['ESTADO'].startswith('Pendiente'):
-                        continue
-                        
-                    debitos_payu = abs(convert_to_number(payu_row['DEBITOS']))
-                    
+                for payu_idx, (payu_row, debitos_payu) in payu_candidates.items():
                     if not np.isnan(debitos_payu) and abs(monto_ext - debitos_payu) < 0.01:
                         # Conciliar
                         etiqueta = 'MA-' if payu_row['ESTADO'] == 'Pendiente MA' else ''
-                        extracto_df.at[idx, 'ESTADO'] = f'{etiqueta}P6-Conciliado'
-                        extracto_df.at[idx, '#REF'] = f'{etiqueta}PAYU - Monto: {monto_ext:.2f}'
-                        payu_df.at[payu_idx, 'ESTADO'] = f'{etiqueta}P6-Conciliado'
-                        payu_df.at[payu_idx, '#REF'] = f'{etiqueta}{ext_row["OPERACIÓN - NÚMERO"]}'
+                        results['extracto'].mark(idx, f'{etiqueta}P6-Conciliado', f'{etiqueta}PAYU - Monto: {monto_ext:.2f}')
+                        results['payu'].mark(payu_idx, f'{etiqueta}P6-Conciliado', f'{etiqueta}{ext_row["OPERACIÓN - NÚMERO"]}')
                         stats['payu'] += 1
+                        if tracer:
+                            tracer.match('payu', 'match', extracto=idx, payu=payu_idx, monto=monto_ext, etiqueta=etiqueta)
                         break
+                else:
+                    continue
+                # Las etiquetas son únicas en la hoja: se retira solo el PAYU conciliado
+                del payu_candidates[payu_idx]
+        
+        finish_phase('payu', phase_start)
     
     print(f"✅ Conciliación completada. Estadísticas: {stats}")
     
     return {
-        'extracto': extracto_df,
-        'amex': amex_df if not amex_df.empty else None,
-        'diners': diners_df if not diners_df.empty else None,
-        'mc': mc_df if not mc_df.empty else None,
-        'visa': visa_df if not visa_df.empty else None,
-        'payu': payu_df if not payu_df.empty else None,
-        'stats': stats
+        # ADQUIRENTE es de uso interno del motor: no se exporta ni se guarda en el histórico
+        'extracto': results['extracto'].frame().drop(columns='ADQUIRENTE', errors='ignore'),
+        'amex': results['amex'].frame() if not amex_df.empty else None,
+        'diners': results['diners'].frame() if not diners_df.empty else None,
+        'mc': results['mc'].frame() if not mc_df.empty else None,
+        'visa': results['visa'].frame() if not visa_df.empty else None,
+        'payu': results['payu'].frame() if not payu_df.empty else None,
+        'stats': stats,
+        'timings': timings
     }
 
+def partition_month(value) -> str:
+    """Mes (AAAA-MM) de una fecha de cualquier hoja; '' si no se puede leer"""
+    if isinstance(value, (int, float, np.integer, np.floating)) and not pd.isna(value) and 19000101 <= value <= 29991231:
+        # AAAAMMDD numérico (AMEX, MC)
+        value = str(int(value))
+    if isinstance(value, str) and re.match(ISO_DATE_PATTERN, value.strip()):
+        value = datetime.strptime(value.strip()[:10], '%Y-%m-%d')
+    parsed = parse_date(value)
+    return parsed.strftime('%Y-%m') if parsed is not None else ''
+
+def frame_months(df: pd.DataFrame, sheet: str) -> np.ndarray:
+    """Mes de cada fila según la columna de fecha de la hoja (cada valor distinto se parsea una vez)"""
+    column = SHEET_DATE_COLUMNS[sheet]
+    if df is None or column not in df.columns:
+        return np.full(0 if df is None else len(df), '', dtype=object)
+    codes, uniques = pd.factorize(df[column])
+    months = np.array([partition_month(value) for value in uniques] + [''], dtype=object)
+    # Los nulos (código -1) caen en la última posición: sin fecha
+    return months[codes]
+
+def sheet_pieces(data) -> list:
+    """Partes de una hoja: un DataFrame o la lista de lotes guardados (Arrow o DataFrame) en el orden de carga"""
+    if data is None:
+        return []
+    return list(data) if isinstance(data, (list, tuple)) else [data]
+
+def perform_reconciliation_partitioned(extracto_df, amex_df, diners_df, mc_df, visa_df, payu_df, tracer: Optional['MatchTracer'] = None,
+                                       progress: Optional[Callable[[str, Dict[str, Any]], None]] = None, date_window: int = 0,
+                                       acquirer_partitions: bool = False):
+    """Conciliación por meses con memoria acotada: las entradas se reparten por mes en archivos Arrow y se concilia
+    un mes a la vez; lo pendiente de cada hoja pasa al mes siguiente, así las fases solo por monto (AMEX F3, MC F2,
+    PAYU) siguen viendo los pendientes de meses anteriores. Cada hoja puede ser un DataFrame o la lista de lotes
+    guardados, que se reparten uno a uno sin consolidarlos. Devuelve las hojas en el orden de las entradas"""
+    sheets = ('extracto',) + BRAND_TYPES
+    partitions = {}
+    
+    # Repartir cada lote por mes en disco; cada parte recuerda la posición de sus filas en la hoja completa
+    for sheet, data in zip(sheets, (extracto_df, amex_df, diners_df, mc_df, visa_df, payu_df)):
+        offset = 0
+        for piece in sheet_pieces(data):
+            df = load_frame(piece)
+            if df is None or df.empty:
+                continue
+            months = frame_months(df, sheet)
+            positions = np.arange(offset, offset + len(df))
+            offset += len(df)
+            for month in sorted(set(months)):
+                mask = months == month
+                partitions.setdefault(month, {}).setdefault(sheet, []).append(
+                    (positions[mask], store_frame(compact_frame(df.iloc[mask])))
+                )
+            del df
+    
+    months = sorted(partitions)
+    print(f"🗓️ Conciliación por meses: {len(months)} partes ({', '.join(month or 'sin fecha' for month in months)})")
+    
+    stats, timings = {}, {}
+    finished = {sheet: [] for sheet in sheets}
+    carried = {}
+    try:
+        for number, month in enumerate(months, 1):
+            if progress:
+                progress('partition_started', {'partition': month, 'number': number, 'partitions': len(months)})
+            last = number == len(months)
+            
+            # Pendientes de meses anteriores + filas del mes, en el orden relativo de la entrada completa
+            frames, positions = {}, {}
+            for sheet in sheets:
+                pieces = ([carried.pop(sheet)] if sheet in carried else []) + partitions[month].pop(sheet, [])
+                if not pieces:
+                    frames[sheet] = pd.DataFrame()
+                    continue
+                sheet_positions = np.concatenate([piece_positions for piece_positions, _ in pieces])
+                df = consolidate_frames([load_frame(stored) for _, stored in pieces])
+                for _, stored in pieces:
+                    release_frame(stored)
+                order = np.argsort(sheet_positions, kind='stable')
+                frames[sheet], positions[sheet] = df.iloc[order], sheet_positions[order]
+            
+            if frames['extracto'].empty:
+                # Sin extracto en el mes: las marcas esperan al mes siguiente
+                results = {sheet: expand_compact_frame(frames[sheet]) for sheet in BRAND_TYPES}
+            else:
+                results = perform_reconciliation_multi_step(
+                    *(frames[sheet] for sheet in sheets), tracer=tracer, progress=progress,
+                    date_window=date_window, acquirer_partitions=acquirer_partitions
+                )
+                for phase, matches in results['stats'].items():
+                    stats[phase] = stats.get(phase, 0) + matches
+                for phase, seconds in results['timings'].items():
+                    timings[phase] = timings.get(phase, 0) + seconds
+            
+            for sheet, sheet_result in results.items():
+                if sheet not in positions or sheet_result is None or sheet_result.empty:
+                    continue
+                # En el último mes todo queda en el resultado
+                pending = sheet_result['ESTADO'].astype(str).str.startswith('Pendiente').to_numpy() & (not last)
+                finished[sheet].append((positions[sheet][~pending], sheet_result[~pending]))
+                if pending.any():
+                    carried[sheet] = (positions[sheet][pending], store_frame(frames[sheet][pending]))
+    finally:
+        for month_parts in partitions.values():
+            for pieces in month_parts.values():
+                for _, stored in pieces:
+                    release_frame(stored)
+        for _, stored in carried.values():
+            release_frame(stored)
+    
+    # Reunir cada hoja en el orden original
+    output = {}
+    for sheet in sheets:
+        if not finished[sheet]:
+            output[sheet] = None
+            continue
+        sheet_positions = np.concatenate([piece_positions for piece_positions, _ in finished[sheet]])
+        df = consolidate_frames([piece for _, piece in finished[sheet]])
+        output[sheet] = df.iloc[np.argsort(sheet_positions, kind='stable')]
+    if output['extracto'] is None:
+        output['extracto'] = expand_compact_frame(consolidate_frames([load_frame(piece) for piece in sheet_pieces(extracto_df)]))
+    
+    print(f"✅ Conciliación por meses completada. Estadísticas: {stats}")
+    return {**output, 'stats': stats, 'timings': timings}
+
 @app.get("/api/download/{filename}")
 async def download_file(filename: str):
     file_path = f"outputs/{filename}"
@@ -1462,6 +3956,9 @@ async def download_file(filename: str):
         
         def delete_file_after_delay():
             time.sleep(5)  # Esperar 5 segundos para asegurar que la descarga termine
+            # Los archivos en caché se eliminan al ser expulsados de la caché
+            if is_cached_output(filename):
+                return
             try:
                 if os.path.exists(file_path):
                     os.remove(file_path)
@@ -1475,6 +3972,690 @@ async def download_file(filename: str):
         return response
     raise HTTPException(status_code=404, detail="Archivo no encontrado")
 
+def metric_key(name: str, labels: Dict[str, str]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    """Clave de una serie: nombre + etiquetas ordenadas"""
+    return name, tuple(sorted(labels.items()))
+
+def observe_metric(name: str, labels: Dict[str, str], value: float):
+    """Registra una observación en un histograma"""
+    series = metric_histograms.setdefault(metric_key(name, labels), {
+        'buckets': [0] * len(METRIC_BUCKETS), 'sum': 0.0, 'count': 0
+    })
+    for i, bound in enumerate(METRIC_BUCKETS):
+        if value <= bound:
+            series['buckets'][i] += 1
+    series['sum'] += value
+    series['count'] += 1
+
+def increment_metric(name: str, labels: Dict[str, str], amount: float = 1):
+    """Incrementa un contador"""
+    key = metric_key(name, labels)
+    metric_counters[key] = metric_counters.get(key, 0) + amount
+
+def format_labels(labels, extra: Optional[Dict[str, str]] = None) -> str:
+    """Formatea etiquetas como {a="1",b="2"}"""
+    pairs = list(labels) + list((extra or {}).items())
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+def render_metrics() -> str:
+    """Genera el texto de exposición de todas las métricas"""
+    # Indicadores calculados al momento de la consulta
+    gauges = {
+        ('conciliador_reconcile_jobs_running', ()): reconcile_jobs_running,
+        ('conciliador_reconcile_admitted_bytes', ()): admitted_memory,
+        ('conciliador_result_cache_entries', ()): len(result_cache)
+    }
+    for key, workspace in workspaces.items():
+        extracto_data = workspace['extracto']
+        labels = (('currency', key), ('file_type', 'extracto'))
+        gauges[('conciliador_workspace_rows', labels)] = len(extracto_data) if extracto_data is not None else 0
+        gauges[('conciliador_workspace_bytes', labels)] = frame_nbytes(extracto_data)
+        for file_type, frames in workspace['brands'].items():
+            labels = (('currency', key), ('file_type', file_type))
+            gauges[('conciliador_workspace_rows', labels)] = sum(len(df) for df in frames)
+            gauges[('conciliador_workspace_bytes', labels)] = sum(frame_nbytes(df) for df in frames)
+    
+    lines = []
+    for name, (metric_type, help_text) in METRIC_DEFINITIONS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        
+        if metric_type == 'histogram':
+            for (series_name, labels), series in sorted(metric_histograms.items()):
+                if series_name != name:
+                    continue
+                for bound, count in zip(METRIC_BUCKETS, series['buckets']):
+                    lines.append(f"{name}_bucket{format_labels(labels, {'le': repr(bound)})} {count}")
+                lines.append(f"{name}_bucket{format_labels(labels, {'le': '+Inf'})} {series['count']}")
+                lines.append(f"{name}_sum{format_labels(labels)} {series['sum']}")
+                lines.append(f"{name}_count{format_labels(labels)} {series['count']}")
+        else:
+            values = metric_counters if metric_type == 'counter' else gauges
+            for (series_name, labels), value in sorted(values.items()):
+                if series_name == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+    
+    return '\n'.join(lines) + '\n'
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métricas en formato Prometheus"""
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+def parse_index_date(value):
+    """Parsea una fecha para los índices, incluyendo AAAAMMDD numérico (AMEX/MC)"""
+    if isinstance(value, (int, float)) and not pd.isna(value) and not 40000 < value < 100000:
+        return parse_date(str(int(value)))
+    return parse_date(value)
+
+def index_dates_iso(values) -> List[Optional[str]]:
+    """Fechas AAAA-MM-DD de una columna; cada valor distinto se parsea una sola vez (se repiten mucho)"""
+    parsed = {}
+    dates = []
+    for value in values:
+        key = (type(value), value)
+        if key not in parsed:
+            fecha = parse_index_date(value)
+            parsed[key] = fecha.strftime('%Y-%m-%d') if fecha is not None else None
+        dates.append(parsed[key])
+    return dates
+
+def build_result_indexes(result: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Construye una sola vez los índices de cada hoja del resultado (ESTADO, fase, fecha y monto)"""
+    indexes = {}
+    
+    for sheet in SHEET_DATE_COLUMNS:
+        data = result.get(sheet)
+        if data is None or data.empty:
+            continue
+        
+        # Posiciones 0..n-1 independientes de los índices repetidos entre archivos
+        data = data.reset_index(drop=True)
+        estados = data['ESTADO'].astype(str).to_numpy()
+        
+        # ESTADO ordenado para búsquedas por prefijo con searchsorted
+        estado_order = np.argsort(estados, kind='stable')
+        
+        # Fase (P2-F2, P4-F1, P6...) -> posiciones
+        fases = {}
+        for pos, estado in enumerate(estados):
+            match = re.search(r'P\d(?:-F\d)?', estado)
+            fase = match.group(0) if match else 'PENDIENTE'
+            fases.setdefault(fase, []).append(pos)
+        
+        # Fechas y montos como arreglos numéricos ordenados
+        fechas = np.array([
+            np.datetime64(fecha, 'D') if fecha is not None else np.datetime64('NaT')
+            for fecha in (parse_index_date(v) for v in data[SHEET_DATE_COLUMNS[sheet]])
+        ], dtype='datetime64[D]')
+        montos = np.array([convert_to_number(v) for v in data[SHEET_AMOUNT_COLUMNS[sheet]]], dtype=float)
+        fecha_order = np.argsort(fechas, kind='stable')
+        monto_order = np.argsort(montos, kind='stable')
+        
+        indexes[sheet] = {
+            'estado_order': estado_order,
+            'estado_sorted': estados[estado_order],
+            'fases': {fase: np.array(pos, dtype=np.int64) for fase, pos in fases.items()},
+            'fecha_order': fecha_order,
+            'fecha_sorted': fechas[fecha_order],
+            'monto_order': monto_order,
+            'monto_sorted': montos[monto_order]
+        }
+    
+    return indexes
+
+def range_positions(sorted_values, order, low, high) -> np.ndarray:
+    """Posiciones cuyo valor está en [low, high] usando búsqueda binaria sobre el arreglo ordenado"""
+    start = np.searchsorted(sorted_values, low, side='left') if low is not None else 0
+    end = np.searchsorted(sorted_values, high, side='right') if high is not None else len(sorted_values)
+    return order[start:end]
+
+def to_json_value(value):
+    """Convierte un valor de pandas/numpy a un valor serializable en JSON"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+@app.get("/api/results/{sheet}")
+async def get_results(
+    sheet: str,
+    estado: Optional[str] = None,
+    fase: Optional[str] = None,
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    monto_min: Optional[float] = None,
+    monto_max: Optional[float] = None,
+    columns: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    currency_code: Optional[str] = None
+):
+    """Consulta paginada y filtrable del resultado de la última conciliación de la moneda"""
+    workspace = get_workspace(currency_code)
+    if workspace['last_result'] is None:
+        raise HTTPException(status_code=404, detail="No hay resultados de conciliación")
+    
+    sheet = sheet.lower()
+    if sheet not in SHEET_DATE_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Hoja inválida: {sheet}")
+    
+    index = workspace['result_indexes'].get(sheet)
+    if index is None:
+        return {"sheet": sheet, "total": 0, "rows": [], "next_cursor": None}
+    
+    # La hoja se lee de Arrow la primera vez que se consulta; posiciones 0..n-1 como en los índices
+    result_frames = workspace['result_frames']
+    data = result_frames.get(sheet)
+    if data is None:
+        stored = workspace['last_result']['sheets'][sheet]
+        data = await run_in_threadpool(lambda: load_frame(stored).reset_index(drop=True))
+        result_frames[sheet] = data
+    mask = np.ones(len(data), dtype=bool)
+    
+    # Filtro por prefijo de ESTADO (rango contiguo en el arreglo ordenado)
+    if estado:
+        estado_sorted = index['estado_sorted']
+        start = np.searchsorted(estado_sorted, estado, side='left')
+        end = np.searchsorted(estado_sorted, estado + '\uffff', side='left')
+        selected = np.zeros(len(data), dtype=bool)
+        selected[index['estado_order'][start:end]] = True
+        mask &= selected
+    
+    # Filtro por código de fase
+    if fase:
+        selected = np.zeros(len(data), dtype=bool)
+        selected[index['fases'].get(fase.upper(), np.array([], dtype=np.int64))] = True
+        mask &= selected
+    
+    # Filtro por rango de fechas
+    if fecha_desde or fecha_hasta:
+        try:
+            low = np.datetime64(pd.Timestamp(fecha_desde), 'D') if fecha_desde else None
+            high = np.datetime64(pd.Timestamp(fecha_hasta), 'D') if fecha_hasta else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Fecha inválida, usar AAAA-MM-DD")
+        fecha_sorted = index['fecha_sorted']
+        valid = int((~np.isnat(fecha_sorted)).sum())
+        selected = np.zeros(len(data), dtype=bool)
+        selected[range_positions(fecha_sorted[:valid], index['fecha_order'][:valid], low, high)] = True
+        mask &= selected
+    
+    # Filtro por rango de montos
+    if monto_min is not None or monto_max is not None:
+        monto_sorted = index['monto_sorted']
+        valid = int((~np.isnan(monto_sorted)).sum())
+        selected = np.zeros(len(data), dtype=bool)
+        selected[range_positions(monto_sorted[:valid], index['monto_order'][:valid], monto_min, monto_max)] = True
+        mask &= selected
+    
+    # Selección de columnas
+    if columns:
+        selected_columns = [col.strip() for col in columns.split(',') if col.strip()]
+        missing = [col for col in selected_columns if col not in data.columns]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Columnas inexistentes: {', '.join(missing)}")
+    else:
+        selected_columns = list(data.columns)
+    
+    # Paginación por cursor (posición de la última fila entregada)
+    positions = np.flatnonzero(mask)
+    total = len(positions)
+    if cursor:
+        try:
+            positions = positions[positions > int(cursor)]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+    
+    limit = max(1, min(limit, 1000))
+    page = positions[:limit]
+    next_cursor = str(int(page[-1])) if len(positions) > limit else None
+    
+    column_positions = [data.columns.get_loc(col) for col in selected_columns]
+    rows = [
+        {col: to_json_value(value) for col, value in zip(selected_columns, row)}
+        for row in data.iloc[page, column_positions].itertuples(index=False, name=None)
+    ]
+    
+    return {
+        "sheet": sheet,
+        "total": total,
+        "rows": rows,
+        "next_cursor": next_cursor
+    }
+
+def ledger_connect() -> sqlite3.Connection:
+    """Abre el libro de pendientes (crea la tabla e índices si no existen)"""
+    os.makedirs(os.path.dirname(LEDGER_PATH) or '.', exist_ok=True)
+    conn = sqlite3.connect(LEDGER_PATH, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS ledger_items (
+            brand TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            row_hash TEXT NOT NULL,
+            monto_cents INTEGER,
+            fecha TEXT,
+            codcom TEXT,
+            row_json TEXT NOT NULL,
+            first_run TEXT NOT NULL,
+            last_run TEXT NOT NULL,
+            runs INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (brand, currency, row_hash)
+        );
+        CREATE INDEX IF NOT EXISTS idx_ledger_monto ON ledger_items (currency, monto_cents);
+        CREATE INDEX IF NOT EXISTS idx_ledger_fecha ON ledger_items (currency, brand, fecha);
+        CREATE INDEX IF NOT EXISTS idx_ledger_codcom ON ledger_items (currency, codcom);
+    """)
+    return conn
+
+def ledger_encode_value(value):
+    """Valor de una fila en forma JSON estable (las fechas se marcan para restaurarlas)"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return {'__fecha__': value.isoformat()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def ledger_decode_value(value):
+    if isinstance(value, dict) and '__fecha__' in value:
+        return pd.Timestamp(value['__fecha__'])
+    return value
+
+def ledger_row_hashes(brand: str, df: pd.DataFrame) -> Tuple[List[str], List[str]]:
+    """Huella y JSON de cada fila de una marca (sin ESTADO ni #REF), en el orden del DataFrame"""
+    columns = [col for col in df.columns if col not in ('ESTADO', '#REF')]
+    hashes, rows_json = [], []
+    for row in df[columns].to_numpy(dtype=object):
+        row_json = json.dumps(dict(zip(columns, map(ledger_encode_value, row))), ensure_ascii=False, default=str)
+        hashes.append(hashlib.sha1(f"{brand}|{row_json}".encode()).hexdigest())
+        rows_json.append(row_json)
+    return hashes, rows_json
+
+def ledger_carry_forward(currency_value, extracto_df: pd.DataFrame,
+                         brand_frames: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Dict[str, list]]]:
+    """Agrega a cada marca los pendientes guardados hasta la última fecha del extracto que no se volvieron a subir
+    (cada marca es un DataFrame o la lista de lotes guardados; a la lista se agrega un lote más)"""
+    fechas = [fecha for fecha in (parse_date(v) for v in extracto_df['FECHA'].dropna().unique()) if fecha is not None]
+    if not fechas:
+        return brand_frames, {}
+    fecha_hasta = max(fechas)
+    fecha_desde = fecha_hasta - pd.Timedelta(days=LEDGER_MAX_AGE_DAYS)
+    
+    frames = dict(brand_frames)
+    ledger_rows = {}
+    with ledger_lock, contextlib.closing(ledger_connect()) as conn:
+        for brand, data in brand_frames.items():
+            hashes, rows_json = [], []
+            start = 0
+            for piece in sheet_pieces(data):
+                df = load_frame(piece)
+                if df is None or df.empty:
+                    continue
+                piece_hashes, piece_rows = ledger_row_hashes(brand, df)
+                hashes += piece_hashes
+                rows_json += piece_rows
+                start = max(start, int(df.index.max()) + 1)
+            current = set(hashes)
+            
+            # Búsqueda por el índice (moneda, marca, fecha)
+            carried = [
+                (row_hash, row_json) for row_hash, row_json in conn.execute(
+                    "SELECT row_hash, row_json FROM ledger_items WHERE currency = ? AND brand = ? AND fecha BETWEEN ? AND ? "
+                    "ORDER BY fecha, rowid",
+                    (currency_value or '', brand, fecha_desde.strftime('%Y-%m-%d'), fecha_hasta.strftime('%Y-%m-%d'))
+                ) if row_hash not in current
+            ]
+            
+            if carried:
+                records = [
+                    {col: ledger_decode_value(value) for col, value in json.loads(row_json).items()}
+                    for _, row_json in carried
+                ]
+                carried_df = pd.DataFrame(records)
+                # Vienen de meses anteriores: se etiquetan como archivo MA-
+                carried_df['ESTADO'] = 'Pendiente MA'
+                carried_df['#REF'] = ''
+                # Índices a continuación de los cargados para no chocar con las etiquetas que usa el motor
+                carried_df.index = pd.RangeIndex(start, start + len(carried_df))
+                if isinstance(data, list):
+                    frames[brand] = data + [carried_df]
+                else:
+                    frames[brand] = consolidate_frames([data, carried_df])
+                print(f"📒 Libro de pendientes: {len(carried)} {brand.upper()} de corridas anteriores")
+            
+            # Huella y JSON alineados por posición con la hoja que devuelve el motor
+            ledger_rows[brand] = {
+                'hashes': hashes + [row_hash for row_hash, _ in carried],
+                'rows_json': rows_json + [row_json for _, row_json in carried]
+            }
+    
+    return frames, ledger_rows
+
+def ledger_record(currency_value, run_id: str, ledger_rows: Dict[str, Dict[str, list]], result: Dict[str, Any]):
+    """Guarda los ítems de marcas que siguen Pendiente y quita del libro los que se conciliaron"""
+    run = f"{datetime.now().strftime('%Y-%m-%dT%H:%M:%S')} {run_id}"
+    currency_key = currency_value or ''
+    stored = removed = 0
+    
+    with ledger_lock, contextlib.closing(ledger_connect()) as conn, conn:
+        for brand, rows in ledger_rows.items():
+            sheet = result.get(brand)
+            if sheet is None or len(sheet) != len(rows['hashes']):
+                continue
+            
+            pending = sheet['ESTADO'].astype(str).str.startswith('Pendiente').to_numpy()
+            montos = sheet[SHEET_AMOUNT_COLUMNS[brand]].to_numpy(dtype=object)
+            fechas = index_dates_iso(sheet[SHEET_DATE_COLUMNS[brand]].to_numpy(dtype=object))
+            codcom_column = SHEET_CODCOM_COLUMNS[brand]
+            codcoms = sheet[codcom_column].to_numpy(dtype=object) if codcom_column else None
+            
+            inserts, deletes = [], []
+            for pos, row_hash in enumerate(rows['hashes']):
+                if not pending[pos]:
+                    deletes.append((brand, currency_key, row_hash))
+                    continue
+                monto = convert_to_number(montos[pos])
+                inserts.append((
+                    brand, currency_key, row_hash,
+                    None if np.isnan(monto) else int(round(monto * 100)),
+                    fechas[pos],
+                    str(codcoms[pos]).strip() if codcoms is not None and not pd.isna(codcoms[pos]) else None,
+                    rows['rows_json'][pos], run, run
+                ))
+            
+            conn.executemany(
+                "INSERT INTO ledger_items (brand, currency, row_hash, monto_cents, fecha, codcom, row_json, first_run, last_run) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (brand, currency, row_hash) DO UPDATE SET last_run = excluded.last_run, runs = runs + 1",
+                inserts
+            )
+            before = conn.total_changes
+            conn.executemany("DELETE FROM ledger_items WHERE brand = ? AND currency = ? AND row_hash = ?", deletes)
+            removed += conn.total_changes - before
+            stored += len(inserts)
+    
+    print(f"📒 Libro de pendientes: {stored} pendientes guardados, {removed} conciliados retirados")
+
+@app.get("/api/ledger")
+async def get_ledger(
+    brand: Optional[str] = None,
+    currency_code: Optional[str] = None,
+    monto: Optional[float] = None,
+    codcom: Optional[str] = None,
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    limit: int = 100
+):
+    """Resumen y búsqueda en el libro de pendientes (por monto, código de comercio o rango de fechas)"""
+    currency_key = workspace_key(currency_code)
+    conditions, params = ["currency = ?"], [currency_key]
+    if brand:
+        conditions.append("brand = ?")
+        params.append(brand.lower())
+    if monto is not None:
+        conditions.append("monto_cents = ?")
+        params.append(int(round(monto * 100)))
+    if codcom:
+        conditions.append("codcom = ?")
+        params.append(codcom.strip())
+    try:
+        if fecha_desde:
+            conditions.append("fecha >= ?")
+            params.append(pd.Timestamp(fecha_desde).strftime('%Y-%m-%d'))
+        if fecha_hasta:
+            conditions.append("fecha <= ?")
+            params.append(pd.Timestamp(fecha_hasta).strftime('%Y-%m-%d'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fecha inválida, usar AAAA-MM-DD")
+    
+    limit = max(1, min(limit, 1000))
+    where = ' AND '.join(conditions)
+    with contextlib.closing(ledger_connect()) as conn:
+        summary = dict(conn.execute(
+            "SELECT brand, COUNT(*) FROM ledger_items WHERE currency = ? GROUP BY brand", (currency_key,)
+        ).fetchall())
+        items = [
+            {
+                'brand': row[0], 'fecha': row[1], 'codcom': row[2],
+                'monto': row[3] / 100 if row[3] is not None else None,
+                'first_run': row[4], 'last_run': row[5], 'runs': row[6],
+                'row': {col: to_json_value(ledger_decode_value(value)) for col, value in json.loads(row[7]).items()}
+            }
+            for row in conn.execute(
+                f"SELECT brand, fecha, codcom, monto_cents, first_run, last_run, runs, row_json FROM ledger_items "
+                f"WHERE {where} ORDER BY fecha, rowid LIMIT ?", params + [limit]
+            )
+        ]
+    
+    return {"currency": currency_key, "summary": summary, "items": items}
+
+@app.delete("/api/ledger")
+async def clear_ledger(brand: Optional[str] = None, currency_code: Optional[str] = None):
+    """Vacía el libro de pendientes de la moneda (opcionalmente solo una marca)"""
+    currency_key = workspace_key(currency_code)
+    with ledger_lock, contextlib.closing(ledger_connect()) as conn, conn:
+        if brand:
+            deleted = conn.execute("DELETE FROM ledger_items WHERE currency = ? AND brand = ?", (currency_key, brand.lower())).rowcount
+        else:
+            deleted = conn.execute("DELETE FROM ledger_items WHERE currency = ?", (currency_key,)).rowcount
+    return {"message": f"Libro de pendientes: {deleted} ítems eliminados"}
+
+def history_connect() -> sqlite3.Connection:
+    """Abre el histórico de conciliaciones (crea las tablas e índices si no existen)"""
+    os.makedirs(os.path.dirname(HISTORY_PATH) or '.', exist_ok=True)
+    conn = sqlite3.connect(HISTORY_PATH, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS history_runs (
+            run_id TEXT PRIMARY KEY,
+            run_at TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            fingerprint TEXT,
+            output_filename TEXT,
+            fecha_desde TEXT,
+            fecha_hasta TEXT,
+            stats_json TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS history_rows (
+            id INTEGER PRIMARY KEY,
+            run_id TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            sheet TEXT NOT NULL,
+            estado TEXT,
+            fase TEXT,
+            ref TEXT,
+            operacion TEXT,
+            codcom TEXT,
+            monto_cents INTEGER,
+            fecha TEXT,
+            row_json TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_history_runs_at ON history_runs (run_at);
+        CREATE INDEX IF NOT EXISTS idx_history_operacion ON history_rows (operacion);
+        CREATE INDEX IF NOT EXISTS idx_history_codcom ON history_rows (codcom, fecha);
+        CREATE INDEX IF NOT EXISTS idx_history_monto ON history_rows (monto_cents, fecha);
+        CREATE INDEX IF NOT EXISTS idx_history_fecha ON history_rows (fecha);
+        CREATE INDEX IF NOT EXISTS idx_history_run ON history_rows (run_id);
+    """)
+    return conn
+
+def history_record(run_id: str, currency_value, fingerprint: str, output_filename: str, result: Dict[str, Any]):
+    """Guarda las filas de todas las hojas de una conciliación con sus campos de búsqueda"""
+    currency_key = currency_value or ''
+    rows = []
+    fechas_run = []
+    
+    for sheet in SHEET_DATE_COLUMNS:
+        data = result.get(sheet)
+        if data is None or data.empty:
+            continue
+        
+        columns = list(data.columns)
+        estados = data['ESTADO'].astype(str).to_numpy()
+        refs = data['#REF'].astype(str).to_numpy()
+        montos = data[SHEET_AMOUNT_COLUMNS[sheet]].to_numpy(dtype=object)
+        fechas = index_dates_iso(data[SHEET_DATE_COLUMNS[sheet]].to_numpy(dtype=object))
+        if sheet == 'extracto':
+            fechas_run.extend(fecha for fecha in fechas if fecha)
+            # Operación propia y código de comercio de REFERENCIA2 (últimos 7 de los 9 dígitos)
+            operaciones = data['OPERACIÓN - NÚMERO'].to_numpy(dtype=object)
+            codcoms = [
+                match.group(1)[-7:] if match else None
+                for match in (re.search(r'(\d{9})', str(value)) for value in data['REFERENCIA2'].to_numpy(dtype=object))
+            ] if 'REFERENCIA2' in data.columns else [None] * len(data)
+        else:
+            # La operación del extracto conciliado es el inicio del #REF de la fila de la marca
+            operaciones = [ref[3:] if ref.startswith('MA-') else ref for ref in refs]
+            operaciones = [ref.split(' - ')[0].strip() or None for ref in operaciones]
+            codcom_column = SHEET_CODCOM_COLUMNS[sheet]
+            codcoms = data[codcom_column].to_numpy(dtype=object) if codcom_column else [None] * len(data)
+        
+        for pos, row in enumerate(data.to_numpy(dtype=object)):
+            monto = convert_to_number(montos[pos])
+            fase = re.search(r'P\d(?:-F\d)?', estados[pos])
+            operacion = operaciones[pos]
+            codcom = codcoms[pos]
+            rows.append((
+                run_id, currency_key, sheet, estados[pos],
+                fase.group(0) if fase else 'PENDIENTE',
+                refs[pos] or None,
+                str(operacion).strip() if operacion is not None and not pd.isna(operacion) else None,
+                str(codcom).strip() if codcom is not None and not pd.isna(codcom) else None,
+                None if np.isnan(monto) else int(round(monto * 100)),
+                fechas[pos],
+                json.dumps({col: to_json_value(value) for col, value in zip(columns, row)}, ensure_ascii=False, default=str)
+            ))
+    
+    with history_lock, contextlib.closing(history_connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO history_runs (run_id, run_at, currency, fingerprint, output_filename, fecha_desde, fecha_hasta, stats_json) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_id, datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), currency_key, fingerprint, output_filename,
+             min(fechas_run) if fechas_run else None, max(fechas_run) if fechas_run else None,
+             json.dumps(result['stats']))
+        )
+        conn.executemany(
+            "INSERT INTO history_rows (run_id, currency, sheet, estado, fase, ref, operacion, codcom, monto_cents, fecha, row_json) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+    print(f"🗄️ Histórico: {len(rows)} filas guardadas de la corrida {run_id}")
+
+@app.get("/api/history/runs")
+async def get_history_runs(currency_code: Optional[str] = None, limit: int = 50):
+    """Corridas guardadas en el histórico, de la más reciente a la más antigua"""
+    conditions, params = [], []
+    if currency_code:
+        conditions.append("currency = ?")
+        params.append(currency_code)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    limit = max(1, min(limit, 1000))
+    with contextlib.closing(history_connect()) as conn:
+        runs = [
+            {
+                'run_id': row[0], 'run_at': row[1], 'currency': row[2], 'output_filename': row[3],
+                'fecha_desde': row[4], 'fecha_hasta': row[5], 'stats': json.loads(row[6])
+            }
+            for row in conn.execute(
+                f"SELECT run_id, run_at, currency, output_filename, fecha_desde, fecha_hasta, stats_json FROM history_runs "
+                f"{where} ORDER BY run_at DESC LIMIT ?", params + [limit]
+            )
+        ]
+    return {"runs": runs}
+
+@app.get("/api/history/search")
+async def search_history(
+    operacion: Optional[str] = None,
+    codcom: Optional[str] = None,
+    monto: Optional[float] = None,
+    monto_min: Optional[float] = None,
+    monto_max: Optional[float] = None,
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    sheet: Optional[str] = None,
+    estado: Optional[str] = None,
+    run_id: Optional[str] = None,
+    currency_code: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100
+):
+    """Búsqueda en el histórico por operación, código de comercio, monto o rango de fechas (entre meses)"""
+    conditions, params = [], []
+    if not any([operacion, codcom, monto is not None, monto_min is not None, monto_max is not None,
+                fecha_desde, fecha_hasta, run_id]):
+        raise HTTPException(status_code=400, detail="Indicar operacion, codcom, monto, rango de fechas o run_id")
+    
+    if operacion:
+        conditions.append("operacion = ?")
+        params.append(operacion.strip())
+    if codcom:
+        conditions.append("codcom = ?")
+        params.append(codcom.strip())
+    if monto is not None:
+        conditions.append("monto_cents = ?")
+        params.append(int(round(monto * 100)))
+    if monto_min is not None:
+        conditions.append("monto_cents >= ?")
+        params.append(int(round(monto_min * 100)))
+    if monto_max is not None:
+        conditions.append("monto_cents <= ?")
+        params.append(int(round(monto_max * 100)))
+    try:
+        if fecha_desde:
+            conditions.append("fecha >= ?")
+            params.append(pd.Timestamp(fecha_desde).strftime('%Y-%m-%d'))
+        if fecha_hasta:
+            conditions.append("fecha <= ?")
+            params.append(pd.Timestamp(fecha_hasta).strftime('%Y-%m-%d'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fecha inválida, usar AAAA-MM-DD")
+    if sheet:
+        if sheet.lower() not in SHEET_DATE_COLUMNS:
+            raise HTTPException(status_code=400, detail=f"Hoja inválida: {sheet}")
+        conditions.append("sheet = ?")
+        params.append(sheet.lower())
+    if estado:
+        conditions.append("estado LIKE ?")
+        params.append(f"{estado}%")
+    if run_id:
+        conditions.append("run_id = ?")
+        params.append(run_id)
+    if currency_code:
+        conditions.append("currency = ?")
+        params.append(currency_code)
+    if cursor:
+        try:
+            conditions.append("id > ?")
+            params.append(int(cursor))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+    
+    limit = max(1, min(limit, 1000))
+    with contextlib.closing(history_connect()) as conn:
+        found = conn.execute(
+            f"SELECT id, run_id, currency, sheet, estado, fase, ref, operacion, codcom, fecha, row_json FROM history_rows "
+            f"WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?", params + [limit + 1]
+        ).fetchall()
+    
+    rows = [
+        {
+            'run_id': row[1], 'currency': row[2], 'sheet': row[3], 'estado': row[4], 'fase': row[5],
+            'ref': row[6], 'operacion': row[7], 'codcom': row[8], 'fecha': row[9], 'row': json.loads(row[10])
+        }
+        for row in found[:limit]
+    ]
+    next_cursor = str(found[limit - 1][0]) if len(found) > limit else None
+    return {"rows": rows, "next_cursor": next_cursor}
+
 if __name__ == "__main__":
     import uvicorn
     print("🚀 Iniciando Sistema de Conciliación Simple...")
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Verificación de equivalencia entre motores de conciliación
+Ejecuta el motor de referencia (perform_reconciliation_multi_step) y un motor
+candidato sobre las mismas entradas y compara ESTADO y #REF fila por fila
+(con --partitioned el candidato es la conciliación por meses, sobre varios rangos de meses)
+"""
+import argparse
+import contextlib
+import importlib
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import pandas as pd
+
+import conciliador
+
+SHEETS = ['extracto', 'amex', 'diners', 'mc', 'visa', 'payu']
+COMPARED_COLUMNS = ['ESTADO', '#REF']
+
+
+def load_engine(spec: str) -> Callable:
+    """Importa un motor con el formato 'modulo:funcion'"""
+    module_name, _, function_name = spec.partition(':')
+    if not function_name:
+        raise ValueError(f"Motor inválido '{spec}', usar modulo:funcion")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def run_engine(engine: Callable, extracto_df: pd.DataFrame, brand_frames: Dict[str, pd.DataFrame],
+               repeat: int) -> Tuple[Dict[str, Any], float]:
+    """Ejecuta un motor sobre copias de las entradas y devuelve el resultado y el mejor tiempo"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        inputs = [extracto_df.copy()] + [brand_frames[brand].copy() for brand in SHEETS[1:]]
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = engine(*inputs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def diff_results(reference: Dict[str, Any], candidate: Dict[str, Any]) -> List[str]:
+    """Compara ESTADO y #REF de cada hoja; devuelve la lista de diferencias"""
+    differences = []
+
+    for sheet in SHEETS:
+        ref_df = reference.get(sheet)
+        cand_df = candidate.get(sheet)
+        if ref_df is None and cand_df is None:
+            continue
+        if ref_df is None or cand_df is None:
+            differences.append(f"[{sheet}] hoja presente solo en {'candidato' if ref_df is None else 'referencia'}")
+            continue
+        if len(ref_df) != len(cand_df):
+            differences.append(f"[{sheet}] filas: referencia {len(ref_df)} vs candidato {len(cand_df)}")
+            continue
+
+        # Comparación por posición (los índices pueden repetirse entre archivos)
+        for column in COMPARED_COLUMNS:
+            ref_values = ref_df[column].astype(str).to_numpy()
+            cand_values = cand_df[column].astype(str).to_numpy()
+            mismatches = (ref_values != cand_values).nonzero()[0]
+            for pos in mismatches:
+                differences.append(
+                    f"[{sheet}] fila {pos} {column}: referencia '{ref_values[pos]}' vs candidato '{cand_values[pos]}'"
+                )
+
+    for key, value in reference.get('stats', {}).items():
+        cand_value = candidate.get('stats', {}).get(key)
+        if cand_value != value:
+            differences.append(f"[stats] {key}: referencia {value} vs candidato {cand_value}")
+
+    return differences
+
+
+def load_inputs(args: argparse.Namespace, months: int) -> Tuple[pd.DataFrame, Dict[str, pd.DataFrame]]:
+    """Carga entradas grabadas (directorio de periodo) o genera un dataset sintético de los meses indicados"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if args.inputs:
+            return conciliador.load_inputs_from_directory(args.inputs)
+
+        import benchmark
+        directory = os.path.join(args.workdir, f"rows_{args.rows}_seed_{args.seed}_months_{months}")
+        benchmark.write_dataset(benchmark.generate_dataset(args.rows, args.seed, months), directory)
+        return conciliador.load_inputs_from_directory(directory)
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Compara un motor candidato contra el motor de referencia')
+    parser.add_argument('--candidate', default='conciliador:perform_reconciliation_multi_step',
+                        help='Motor candidato (modulo:funcion)')
+    parser.add_argument('--reference', default='conciliador:perform_reconciliation_multi_step',
+                        help='Motor de referencia (modulo:funcion)')
+    parser.add_argument('--inputs', help='Directorio de periodo con EXTRACTO* y subcarpetas por marca')
+    parser.add_argument('--rows', type=int, default=2000, help='Filas del dataset sintético si no hay --inputs')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--months', type=int, nargs='+', default=[1],
+                        help='Meses que abarcan las fechas del dataset sintético (varios valores = una comparación por cada uno)')
+    parser.add_argument('--partitioned', action='store_true',
+                        help='Compara la conciliación por meses contra la completa (candidato perform_reconciliation_partitioned)')
+    parser.add_argument('--workdir', default='temp/equivalence')
+    parser.add_argument('--repeat', type=int, default=1, help='Repeticiones para medir el tiempo (mejor de N)')
+    parser.add_argument('--max-report', type=int, default=50, help='Máximo de diferencias a mostrar')
+    return parser.parse_args(argv)
+
+
+def compare(args: argparse.Namespace, reference: Callable, candidate: Callable, months: int) -> int:
+    """Compara los dos motores sobre un conjunto de entradas; devuelve el código de salida"""
+    extracto_df, brand_frames = load_inputs(args, months)
+    print(f"📄 Entradas ({months} meses): extracto {len(extracto_df)} filas, " +
+          ", ".join(f"{brand} {len(df)}" for brand, df in brand_frames.items()))
+
+    ref_result, ref_seconds = run_engine(reference, extracto_df, brand_frames, args.repeat)
+    cand_result, cand_seconds = run_engine(candidate, extracto_df, brand_frames, args.repeat)
+
+    differences = diff_results(ref_result, cand_result)
+    speedup = ref_seconds / cand_seconds if cand_seconds else float('inf')
+    print(f"⏱️ Referencia {ref_seconds:.4f}s | Candidato {cand_seconds:.4f}s | Aceleración x{speedup:.2f}")
+
+    if differences:
+        print(f"❌ {len(differences)} diferencias:")
+        for difference in differences[:args.max_report]:
+            print(f"  {difference}")
+        if len(differences) > args.max_report:
+            print(f"  ... {len(differences) - args.max_report} diferencias más")
+        return 1
+
+    # Con el dataset sintético cada fase debe conciliar algo; si no, la comparación no la cubre
+    if not args.inputs:
+        uncovered = [phase for phase, matches in ref_result['stats'].items() if not matches]
+        if uncovered:
+            print(f"❌ Fases sin conciliaciones en el dataset sintético: {', '.join(uncovered)}")
+            return 1
+
+    print("✅ Resultados idénticos (ESTADO, #REF y estadísticas)")
+    return 0
+
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+    if args.partitioned:
+        args.candidate = 'conciliador:perform_reconciliation_partitioned'
+    reference = load_engine(args.reference)
+    candidate = load_engine(args.candidate)
+
+    # Con entradas grabadas los meses son los del periodo: una sola comparación
+    month_counts = args.months[:1] if args.inputs else args.months
+    failed = [months for months in month_counts if compare(args, reference, candidate, months)]
+    if len(month_counts) > 1 and failed:
+        print(f"❌ Con diferencias: {', '.join(f'{months} meses' for months in failed)}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,483 @@
+document.addEventListener('DOMContentLoaded', function() {
+  // --- STATE MANAGEMENT ---
+  let currentStep = 1;
+  let selectedCurrency = null;
+  let uploadedFile = null;
+  let files = {
+    amex: [],
+    diners: [],
+    mc: [],
+    visa: [],
+    payu: []
+  };
+  let isProcessing = false;
+  let result = null;
+  const colorMap = {
+    amex: 'blue',
+    diners: 'green',
+    mc: 'red',
+    visa: 'purple',
+    payu: 'yellow'
+  };
+
+  // --- INITIALIZATION ---
+  setTimeout(() => {
+    showTypingIndicator();
+    setTimeout(() => {
+      hideTypingIndicator();
+      addBotMessage('¡Hola! 👋 Soy tu Asistente de Conciliación. Para empezar, por favor, selecciona una moneda.');
+      setTimeout(() => {
+        showStep(1);
+        setupEventListeners();
+      }, 800);
+    }, 1000);
+  }, 500);
+
+  // --- EVENT LISTENERS ---
+  function setupEventListeners() {
+    // Step 1: Currency selection
+    const currencySelector = document.getElementById('currency-selector');
+    const continueStep1Btn = document.getElementById('continue-step-1');
+
+    currencySelector.addEventListener('change', (e) => {
+      e.target.dataset.hasValue = !!e.target.value;
+      selectedCurrency = e.target.value;
+      continueStep1Btn.disabled = !selectedCurrency;
+    });
+
+    continueStep1Btn.addEventListener('click', goToStep2);
+
+    // Step 2: File upload
+    const fileInput = document.getElementById('file-input');
+    const continueStep2Btn = document.getElementById('continue-step-2');
+    const uploadArea = document.getElementById('upload-area');
+
+    fileInput.addEventListener('change', (e) => handleFileUpload(e.target.files[0]));
+
+    // Drag and Drop listeners
+    uploadArea.addEventListener('dragover', (e) => {
+      e.preventDefault();
+      uploadArea.classList.add('border-blue-500', 'bg-blue-50');
+    });
+
+    uploadArea.addEventListener('dragleave', (e) => {
+      e.preventDefault();
+      uploadArea.classList.remove('border-blue-500', 'bg-blue-50');
+    });
+
+    uploadArea.addEventListener('drop', (e) => {
+      e.preventDefault();
+      uploadArea.classList.remove('border-blue-500', 'bg-blue-50');
+      const droppedFiles = Array.from(e.dataTransfer.files);
+      if (droppedFiles.length > 0) {
+        handleFileUpload(droppedFiles[0]);
+      }
+    });
+
+    uploadArea.addEventListener('click', () => fileInput.click());
+
+    continueStep2Btn.addEventListener('click', goToStep3);
+
+    // Step 3: Multiple file uploads with drag and drop
+    setupFileUploadArea('amex', 'blue');
+    setupFileUploadArea('diners', 'green');
+    setupFileUploadArea('mc', 'red');
+    setupFileUploadArea('visa', 'purple');
+    setupFileUploadArea('payu', 'yellow');
+
+    const reconcileBtn = document.getElementById('continue-step-3');
+    reconcileBtn.addEventListener('click', () => {
+      goToStep4();
+    });
+
+    // Step 5: Download
+    const downloadBtn = document.getElementById('download-excel');
+    downloadBtn.addEventListener('click', downloadResult);
+  }
+
+  function setupFileUploadArea(type, color) {
+    const uploadArea = document.getElementById(`${type}-upload-area`);
+    const fileList = document.getElementById(`${type}-file-list`);
+
+    uploadArea.addEventListener('dragover', (e) => {
+      e.preventDefault();
+      uploadArea.classList.add(`border-${color}-500`, `bg-${color}-200`);
+    });
+
+    uploadArea.addEventListener('dragleave', (e) => {
+      e.preventDefault();
+      uploadArea.classList.remove(`border-${color}-500`, `bg-${color}-200`);
+    });
+
+    uploadArea.addEventListener('drop', (e) => {
+      e.preventDefault();
+      uploadArea.classList.remove(`border-${color}-500`, `bg-${color}-200`);
+      handleMultipleFileUpload(type, Array.from(e.dataTransfer.files));
+    });
+
+    uploadArea.addEventListener('click', () => {
+      const input = document.createElement('input');
+      input.type = 'file';
+      input.multiple = true;
+      input.accept = '.xlsx,.xls,.csv,.parquet';
+      input.addEventListener('change', (e) => {
+        handleMultipleFileUpload(type, Array.from(e.target.files));
+      });
+      input.click();
+    });
+  }
+
+  // --- CHUNKED UPLOADS ---
+  const CHUNK_RETRIES = 3;
+
+  function apiError(detail) {
+    const error = new Error(typeof detail === 'string' ? detail : detail?.message);
+    error.detail = error.message;
+    return error;
+  }
+
+  async function sha256Hex(buffer) {
+    // crypto.subtle solo existe en contextos seguros (https o localhost)
+    if (!window.crypto?.subtle) return null;
+    const digest = await crypto.subtle.digest('SHA-256', buffer);
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+  }
+
+  async function startOrResumeUpload(file, type) {
+    const resumeKey = `upload:${selectedCurrency}:${type}:${file.name}:${file.size}:${file.lastModified}`;
+    const savedId = localStorage.getItem(resumeKey);
+    if (savedId) {
+      const response = await fetch(`/api/uploads/${savedId}`);
+      if (response.ok) return { resumeKey, upload: await response.json() };
+      localStorage.removeItem(resumeKey);
+    }
+
+    const response = await fetch('/api/uploads', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ file_type: type, filename: file.name, size: file.size, currency_code: selectedCurrency })
+    });
+    const upload = await response.json();
+    if (!response.ok) throw apiError(upload.detail);
+    localStorage.setItem(resumeKey, upload.upload_id);
+    return { resumeKey, upload };
+  }
+
+  async function sendChunk(uploadId, index, buffer) {
+    const checksum = await sha256Hex(buffer);
+    for (let attempt = 1; ; attempt++) {
+      try {
+        const response = await fetch(`/api/uploads/${uploadId}/chunks/${index}`, {
+          method: 'PUT',
+          headers: checksum ? { 'X-Chunk-Sha256': checksum } : {},
+          body: buffer
+        });
+        if (response.ok) return;
+        if (attempt >= CHUNK_RETRIES) throw apiError((await response.json()).detail);
+      } catch (error) {
+        if (error.detail || attempt >= CHUNK_RETRIES) throw error;
+      }
+      await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+    }
+  }
+
+  // Sube un archivo por bloques (reanudando los que ya estén en el servidor) y lo confirma
+  async function uploadChunked(file, type, onProgress) {
+    const { resumeKey, upload } = await startOrResumeUpload(file, type);
+    const received = new Set(upload.received);
+    let uploadedBytes = 0;
+    received.forEach(index => {
+      uploadedBytes += Math.min(upload.chunk_size, file.size - index * upload.chunk_size);
+    });
+    onProgress(file.size ? uploadedBytes / file.size : 1);
+
+    for (let index = 0; index < upload.chunks; index++) {
+      if (received.has(index)) continue;
+      const buffer = await file.slice(index * upload.chunk_size, (index + 1) * upload.chunk_size).arrayBuffer();
+      await sendChunk(upload.upload_id, index, buffer);
+      uploadedBytes += buffer.byteLength;
+      onProgress(uploadedBytes / file.size);
+    }
+
+    const response = await fetch(`/api/uploads/${upload.upload_id}/commit`, { method: 'POST' });
+    const data = await response.json();
+    localStorage.removeItem(resumeKey);
+    if (!response.ok) throw apiError(data.detail);
+    return data;
+  }
+
+  function createProgressBar(container, fileName, color) {
+    const wrapper = document.createElement('div');
+    wrapper.className = 'mt-2 text-xs';
+    wrapper.innerHTML = `
+      <div class="flex justify-between text-${color}-900 mb-1">
+        <span class="truncate">${fileName}</span>
+        <span class="upload-percent">0%</span>
+      </div>
+      <div class="w-full bg-gray-200 rounded h-1.5">
+        <div class="upload-bar bg-${color}-500 h-1.5 rounded" style="width: 0%"></div>
+      </div>`;
+    container.appendChild(wrapper);
+    container.classList.remove('hidden');
+    return {
+      update(fraction) {
+        const percent = `${Math.round(fraction * 100)}%`;
+        wrapper.querySelector('.upload-bar').style.width = percent;
+        wrapper.querySelector('.upload-percent').textContent = percent;
+      },
+      remove() {
+        wrapper.remove();
+      }
+    };
+  }
+
+  // --- FILE HANDLING ---
+  async function handleFileUpload(file) {
+    if (!file) return;
+
+    uploadedFile = file;
+    displayUploadedFile(file);
+
+    const progress = createProgressBar(document.getElementById('file-display-container'), file.name, 'orange');
+    try {
+      const data = await uploadChunked(file, 'extracto', progress.update);
+      addBotMessage(`✅ ${data.message}`);
+      document.getElementById('continue-step-2').disabled = false;
+    } catch (error) {
+      addBotMessage(error.detail ? `❌ Error: ${error.detail}` : '❌ Error subiendo extracto. Verifica el archivo.');
+    } finally {
+      progress.remove();
+    }
+  }
+
+  function displayUploadedFile(file) {
+    const fileDisplayContainer = document.getElementById('file-display-container');
+    fileDisplayContainer.innerHTML = `
+      <div class="p-1 bg-orange-50 border border-orange-200 rounded text-xs flex items-center justify-between mt-2">
+        <div class="flex items-center gap-2 flex-1 min-w-0">
+          <i class="fas fa-file-excel text-orange-600 text-xs"></i>
+          <span class="font-medium text-orange-900 truncate">${file.name}</span>
+        </div>
+        <button onclick="removeFile()" class="p-1 text-red-500 hover:text-red-700">
+          <i class="fas fa-times text-xs"></i>
+        </button>
+      </div>`;
+    fileDisplayContainer.classList.remove('hidden');
+  }
+
+  window.removeFile = function() {
+    uploadedFile = null;
+    document.getElementById('file-input').value = '';
+    const fileDisplayContainer = document.getElementById('file-display-container');
+    fileDisplayContainer.innerHTML = '';
+    fileDisplayContainer.classList.add('hidden');
+    document.getElementById('continue-step-2').disabled = true;
+  }
+
+  async function handleMultipleFileUpload(type, fileList) {
+    if (!fileList.length) return;
+
+    const container = document.getElementById(`${type}-file-list`);
+    for (const file of fileList) {
+      const progress = createProgressBar(container, file.name, colorMap[type]);
+      try {
+        const data = await uploadChunked(file, type, progress.update);
+        files[type].push(file.name);
+        addBotMessage(`✅ ${data.message}`);
+        displayFileList(type, [file]);
+        updateContinueButton();
+      } catch (error) {
+        addBotMessage(error.detail ? `❌ Error cargando ${type}: ${error.detail}` : `❌ Error subiendo archivos ${type}.`);
+      } finally {
+        progress.remove();
+      }
+    }
+  }
+
+  function displayFileList(type, fileList) {
+    const container = document.getElementById(`${type}-file-list`);
+    const color = colorMap[type];
+
+    fileList.forEach(file => {
+      const fileDiv = document.createElement('div');
+      fileDiv.className = `p-1 bg-${color}-50 border border-${color}-200 rounded text-xs flex items-center justify-between`;
+      fileDiv.innerHTML = `
+        <div class="flex items-center gap-2 flex-1 min-w-0">
+          <i class="fas fa-file-excel text-${color}-600 text-xs"></i>
+          <span class="font-medium text-${color}-900 truncate">${file.name}</span>
+        </div>
+        <button class="p-1 text-red-500 hover:text-red-700" onclick="removeFileFromList('${type}', '${file.name}', this)">
+          <i class="fas fa-times text-xs"></i>
+        </button>`;
+      container.appendChild(fileDiv);
+    });
+  }
+
+  window.removeFileFromList = function(type, fileName, button) {
+    files[type] = files[type].filter(f => f !== fileName);
+    button.parentElement.remove();
+    updateContinueButton();
+  }
+
+  function updateContinueButton() {
+    const reconcileBtn = document.getElementById('continue-step-3');
+    const hasFiles = Object.values(files).some(f => f.length > 0);
+    reconcileBtn.disabled = !hasFiles;
+  }
+
+  // --- CHAT UI FUNCTIONS ---
+  function showTypingIndicator() {
+    document.getElementById('typing-indicator').classList.remove('hidden');
+    scrollToBottom();
+  }
+
+  function hideTypingIndicator() {
+    document.getElementById('typing-indicator').classList.add('hidden');
+  }
+
+  function addBotMessage(message) {
+    const chatMessages = document.getElementById('chat-messages');
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'flex items-start gap-3 fade-in';
+    messageDiv.innerHTML = `
+      <div class="w-8 h-8 bg-blue-600 rounded-full flex items-center justify-center flex-shrink-0">
+        <i class="fas fa-robot text-white text-sm"></i>
+      </div>
+      <div class="bg-gray-100 rounded-lg rounded-tl-none p-4 max-w-md">
+        <p class="text-gray-800">${message}</p>
+      </div>`;
+    chatMessages.appendChild(messageDiv);
+    scrollToBottom();
+  }
+
+  function scrollToBottom() {
+    const chatMessages = document.getElementById('chat-messages');
+    setTimeout(() => chatMessages.scrollTop = chatMessages.scrollHeight, 100);
+  }
+
+  // --- STEP NAVIGATION ---
+  function showStep(stepNumber) {
+    for (let i = 1; i <= 5; i++) {
+      const stepEl = document.getElementById(`step-${i}`);
+      if (stepEl) stepEl.classList.add('hidden');
+    }
+    document.getElementById('input-area').classList.remove('hidden');
+    const stepEl = document.getElementById(`step-${stepNumber}`);
+    stepEl.classList.remove('hidden');
+    stepEl.classList.add('fade-in');
+    currentStep = stepNumber;
+  }
+
+  async function goToStep2() {
+    // Set currency
+    try {
+      const response = await fetch('/api/set-currency', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ currency: selectedCurrency })
+      });
+
+      if (response.ok) {
+        addBotMessage(`Perfecto, has seleccionado ${selectedCurrency}. Ahora, por favor carga el archivo de extracto principal.`);
+        showStep(2);
+      }
+    } catch (error) {
+      addBotMessage('❌ Error configurando moneda. Inténtalo de nuevo.');
+    }
+  }
+
+  function goToStep3() {
+    addBotMessage(`Extracto principal cargado: ${uploadedFile.name}. Ahora, por favor, carga los archivos de conciliación.`);
+    showStep(3);
+
+    // Mostrar/ocultar sección PAYU según la moneda
+    const payuSection = document.getElementById('payu-section');
+    if (selectedCurrency === 'USD') {
+      payuSection.classList.remove('hidden');
+    } else {
+      payuSection.classList.add('hidden');
+    }
+  }
+
+  async function goToStep4() {
+    const totalFiles = Object.values(files).reduce((sum, arr) => sum + arr.length, 0);
+    addBotMessage(`Iniciando proceso de conciliación con ${totalFiles} archivo(s) de conciliación.`);
+    showStep(4);
+
+    const progressId = window.crypto?.randomUUID ? crypto.randomUUID() : Math.random().toString(36).slice(2);
+    const events = watchReconcileProgress(progressId);
+    try {
+      const response = await fetch(`/api/reconcile?progress_id=${encodeURIComponent(progressId)}&currency_code=${selectedCurrency}`, {
+        method: 'POST'
+      });
+
+      const data = await response.json();
+
+      if (response.ok) {
+        result = data;
+        goToStep5();
+      } else {
+        addBotMessage(`❌ Error en conciliación: ${data.detail}`);
+        showStep(3);
+      }
+    } catch (error) {
+      addBotMessage('❌ Error durante la conciliación. Revisa los archivos.');
+      showStep(3);
+    } finally {
+      events.close();
+    }
+  }
+
+  // Progreso en vivo de la conciliación (fases del motor y escritura del Excel)
+  function watchReconcileProgress(progressId) {
+    const bar = document.getElementById('reconcile-progress-bar');
+    const log = document.getElementById('reconcile-progress-log');
+    const totalPhases = 11;
+    let finishedPhases = 0;
+    let exportItem = null;
+    bar.style.width = '0%';
+    log.innerHTML = '';
+
+    const addLine = (text) => {
+      const item = document.createElement('li');
+      item.textContent = text;
+      log.appendChild(item);
+      return item;
+    };
+
+    const events = new EventSource(`/api/progress/${encodeURIComponent(progressId)}`);
+    events.addEventListener('started', (e) => {
+      const data = JSON.parse(e.data);
+      addLine(`Extracto: ${data.extracto} filas`);
+    });
+    events.addEventListener('phase_finished', (e) => {
+      const data = JSON.parse(e.data);
+      finishedPhases += 1;
+      bar.style.width = `${Math.min(90, Math.round(90 * finishedPhases / totalPhases))}%`;
+      addLine(`${data.phase}: ${data.matches} match(es) · ${data.total_matches} acumulados (${data.seconds.toFixed(2)}s)`);
+    });
+    events.addEventListener('export', (e) => {
+      const data = JSON.parse(e.data);
+      exportItem = exportItem || addLine('');
+      exportItem.textContent = `Escribiendo ${data.sheet}: ${data.rows_written}/${data.rows_total} filas`;
+    });
+    events.addEventListener('done', () => {
+      bar.style.width = '100%';
+      events.close();
+    });
+    events.addEventListener('error', () => events.close());
+    return events;
+  }
+
+  function goToStep5() {
+    addBotMessage(`¡Proceso completado! Tu archivo con el extracto conciliado está listo para descargar.`);
+    showStep(5);
+  }
+
+  function downloadResult() {
+    if (result?.download_url) {
+      window.location.href = result.download_url;
+      addBotMessage('📥 Descarga iniciada. ¡Proceso completado!');
+    }
+  }
+});